@@ -0,0 +1,165 @@
+"""Stand-in for ``anthropic.AsyncAnthropic`` that answers from ground truth."""
+
+import asyncio
+import json
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import anthropic
+import httpx
+import numpy as np
+
+
+def record_key(data: Dict[str, Any]) -> str:
+    return json.dumps(data, sort_keys=True)
+
+
+def _extract_json(text: str, marker: str) -> Any:
+    start = text.index(marker) + len(marker)
+    value, _ = json.JSONDecoder().raw_decode(text[start:].lstrip())
+    return value
+
+
+class _Messages:
+    def __init__(self, llm: "FakeAnthropic"):
+        self.llm = llm
+
+    async def create(self, **params: Any) -> SimpleNamespace:
+        return await self.llm.complete(params)
+
+
+class FakeAnthropic:
+    """Answer comparisons from a ground-truth oracle with simulated API behaviour.
+
+    Latency is drawn from a log-normal distribution with the given median and
+    shape, plus occasional ``straggler_rate`` calls that take ``straggler_factor``
+    times longer. Requests beyond ``requests_per_second`` raise RateLimitError, as
+    the real API would. ``error_rate`` flips a share of comparison verdicts.
+    ``model_latency`` overrides the median latency per model, and prompts that
+    allow an UNSURE answer get one ``unsure_rate`` of the time.
+    """
+
+    def __init__(
+        self,
+        entity_by_key: Dict[str, int],
+        latency_median: float = 0.3,
+        latency_sigma: float = 0.5,
+        straggler_rate: float = 0.01,
+        straggler_factor: float = 10.0,
+        requests_per_second: float | None = None,
+        error_rate: float = 0.0,
+        model_latency: Dict[str, float] | None = None,
+        unsure_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.entity_by_key = entity_by_key
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.straggler_rate = straggler_rate
+        self.straggler_factor = straggler_factor
+        self.requests_per_second = requests_per_second
+        self.error_rate = error_rate
+        self.model_latency = model_latency or {}
+        self.unsure_rate = unsure_rate
+        self.rng = np.random.default_rng(seed)
+
+        self.calls = 0
+        self.calls_by_model: Counter[str] = Counter()
+        self.input_tokens = 0
+        self.rate_limited = 0
+        # Distinct same-entity record pairs the pipeline asked about
+        self.true_pairs_compared: set[frozenset[str]] = set()
+        self._window_start = time.monotonic()
+        self._window_calls = 0
+        # Full record keys by the key of their projection onto a set of fields,
+        # for prompts that show only some of each record's fields
+        self._projections: Dict[tuple, Dict[str, str]] = {}
+
+        messages = _Messages(self)
+        self.messages = messages
+        self.beta = SimpleNamespace(
+            messages=messages, prompt_caching=SimpleNamespace(messages=messages)
+        )
+
+    def _check_rate_limit(self) -> None:
+        if self.requests_per_second is None:
+            return
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_calls = 0
+        self._window_calls += 1
+        if self._window_calls > self.requests_per_second:
+            self.rate_limited += 1
+            request = httpx.Request("POST", "https://fake.invalid/v1/messages")
+            raise anthropic.RateLimitError(
+                "Fake rate limit exceeded",
+                response=httpx.Response(429, request=request),
+                body=None,
+            )
+
+    def _latency(self, model: str) -> float:
+        median = self.model_latency.get(model, self.latency_median)
+        latency = median * float(np.exp(self.rng.normal(0.0, self.latency_sigma)))
+        if self.rng.random() < self.straggler_rate:
+            latency *= self.straggler_factor
+        return latency
+
+    def _full_key(self, data: Dict[str, Any]) -> str:
+        """Key of the record ``data`` is, or is a projection of."""
+        key = record_key(data)
+        if key in self.entity_by_key:
+            return key
+        fields = tuple(sorted(data))
+        if fields not in self._projections:
+            projections: Dict[str, str] = {}
+            for full_key in self.entity_by_key:
+                record = json.loads(full_key)
+                projection = {name: record[name] for name in fields if name in record}
+                projections.setdefault(record_key(projection), full_key)
+            self._projections[fields] = projections
+        return self._projections[fields].get(key, key)
+
+    def _compare(self, prompt: str, may_abstain: bool) -> str:
+        record1 = self._full_key(_extract_json(prompt, "Record 1:"))
+        record2 = self._full_key(_extract_json(prompt, "Record 2:"))
+        same = self.entity_by_key.get(record1, -1) == self.entity_by_key.get(
+            record2, -2
+        )
+        if same and record1 != record2:
+            self.true_pairs_compared.add(frozenset((record1, record2)))
+        if may_abstain and self.rng.random() < self.unsure_rate:
+            return "UNSURE"
+        if self.rng.random() < self.error_rate:
+            same = not same
+        return "YES" if same else "NO"
+
+    def _merge(self, prompt: str) -> str:
+        records: List[Dict[str, Any]] = _extract_json(prompt, "<duplicate_records>")
+        return json.dumps(records[0])
+
+    async def complete(self, params: Dict[str, Any]) -> SimpleNamespace:
+        self._check_rate_limit()
+        self.calls += 1
+        self.calls_by_model[params["model"]] += 1
+        await asyncio.sleep(self._latency(params["model"]))
+
+        prompt = params["messages"][-1]["content"]
+        self.input_tokens += len(prompt) // 4
+        if "<duplicate_records>" in prompt:
+            text = self._merge(prompt)
+        else:
+            system = "".join(block["text"] for block in params.get("system", []))
+            text = self._compare(prompt, "UNSURE" in system)
+
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text=text)],
+            usage=SimpleNamespace(
+                input_tokens=len(prompt) // 4,
+                output_tokens=max(1, len(text) // 4),
+                cache_read_input_tokens=0,
+                cache_creation_input_tokens=0,
+            ),
+        )
@@ -0,0 +1,325 @@
+"""End-to-end benchmark of ``dedupe_records`` against a fake LLM.
+
+Each dataset size runs in its own subprocess so peak RSS is measured per size.
+Results are printed as a table and optionally written as JSON for regression
+tracking:
+
+    uv run python -m benchmarks.run --sizes 1000 10000 --output bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+STAGES = [
+    "exact_duplicates",
+    "profile",
+    "embedding",
+    "candidates",
+    "insert",
+    "neighbor_search",
+    "union",
+    "rerank",
+    "classify",
+    "compare",
+    "merge",
+]
+CANDIDATE_GENERATION = ["embedding", "lsh", "lsh_rerank"]
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+# Comparison models under --cascade, fastest first
+CASCADE_MODELS = ["claude-3-haiku-20240307", "claude-3-5-sonnet-20241022"]
+# The fast model's median latency as a share of --latency-median
+FAST_MODEL_LATENCY = 0.4
+
+
+def _pairs(n: int) -> int:
+    return n * (n - 1) // 2
+
+
+def pairwise_scores(
+    groups: List[List[str]], entity_by_record: Dict[str, int]
+) -> Dict[str, float]:
+    """Pairwise precision and recall of predicted groups against ground truth."""
+    true_pairs = sum(_pairs(n) for n in Counter(entity_by_record.values()).values())
+    predicted_pairs = sum(_pairs(len(group)) for group in groups)
+    correct_pairs = sum(
+        _pairs(n)
+        for group in groups
+        for n in Counter(entity_by_record[record_id] for record_id in group).values()
+    )
+    return {
+        "precision": correct_pairs / predicted_pairs if predicted_pairs else 1.0,
+        "recall": correct_pairs / true_pairs if true_pairs else 1.0,
+        "predicted_pairs": predicted_pairs,
+        "true_pairs": true_pairs,
+    }
+
+
+def candidate_recall(
+    records: List[Dict[str, Any]], entity_ids: List[int], compared: set
+) -> float:
+    """Share of distinct same-entity record pairs that were ever compared."""
+    from .fake_llm import record_key
+
+    keys_by_entity: Dict[int, set] = {}
+    for record, entity in zip(records, entity_ids):
+        keys_by_entity.setdefault(entity, set()).add(record_key(record))
+    true_pairs = sum(_pairs(len(keys)) for keys in keys_by_entity.values())
+    return len(compared) / true_pairs if true_pairs else 1.0
+
+
+def run_single(args: argparse.Namespace, rows: int, candidates: str) -> Dict[str, Any]:
+    from src.dedupe_it import comparator, merger
+    from src.dedupe_it.config import Config
+    from src.dedupe_it.metrics import stage_duration
+    from src.dedupe_it.models import Record
+    from src.dedupe_it.record_store import exact_duplicates
+    from src.dedupe_it.service import dedupe_records
+
+    from .fake_llm import FakeAnthropic, record_key
+    from .synthetic import generate
+
+    start = time.perf_counter()
+    dataset = generate(
+        args.kind,
+        rows,
+        duplicate_rate=args.duplicate_rate,
+        perturbation=args.perturbation,
+        seed=args.seed,
+        wide=args.wide,
+    )
+    generate_seconds = time.perf_counter() - start
+
+    records = [Record(id=str(i), data=data) for i, data in enumerate(dataset.records)]
+    entity_by_record = {
+        record.id: entity for record, entity in zip(records, dataset.entity_ids)
+    }
+    fake_llm = FakeAnthropic(
+        {record_key(r): e for r, e in zip(dataset.records, dataset.entity_ids)},
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        straggler_rate=args.straggler_rate,
+        requests_per_second=args.requests_per_second,
+        error_rate=args.llm_error_rate,
+        model_latency={CASCADE_MODELS[0]: args.latency_median * FAST_MODEL_LATENCY},
+        unsure_rate=args.llm_unsure_rate,
+        seed=args.seed,
+    )
+    comparator.get_anthropic_client = lambda: fake_llm
+    merger.get_anthropic_client = lambda: fake_llm
+
+    config = Config(
+        embedding_model_name=args.embedding_model,
+        candidate_generation=candidates,
+        llm_call_budget=args.llm_call_budget,
+        rerank_model_name=args.rerank_model,
+        rerank_min_score=args.rerank_min_score,
+        rerank_accept_score=args.rerank_accept_score,
+        pair_classifier_dir=args.pair_classifier_dir,
+    )
+    if args.cascade:
+        config.compare_models = list(CASCADE_MODELS)
+    start = time.perf_counter()
+    result = asyncio.run(dedupe_records(records, config))
+    total_seconds = time.perf_counter() - start
+
+    groups = [group.record_ids for group in result.groups]
+    # Exact copies are collapsed before matching and never reach the comparator,
+    # so candidate recall is over the distinct records
+    distinct, _ = exact_duplicates(records, exclude_prefix="_dedupit_")
+    return {
+        "kind": args.kind,
+        "rows": rows,
+        "candidates": candidates,
+        "status": "ok",
+        "generate_seconds": generate_seconds,
+        "total_seconds": total_seconds,
+        "records_per_second": rows / total_seconds if total_seconds else 0.0,
+        "stage_seconds": {stage: stage_duration.labels(stage).sum for stage in STAGES},
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "llm_calls": fake_llm.calls,
+        "llm_input_tokens": fake_llm.input_tokens,
+        "llm_calls_by_model": dict(fake_llm.calls_by_model),
+        "llm_rate_limited": fake_llm.rate_limited,
+        "groups": len(groups),
+        "candidate_recall": candidate_recall(
+            [dataset.records[i] for i in distinct],
+            [dataset.entity_ids[i] for i in distinct],
+            fake_llm.true_pairs_compared,
+        ),
+        **pairwise_scores(groups, entity_by_record),
+    }
+
+
+def run_subprocess(
+    args: argparse.Namespace, rows: int, candidates: str
+) -> Dict[str, Any]:
+    with tempfile.NamedTemporaryFile(suffix=".json") as result_file:
+        command = [
+            sys.executable,
+            "-m",
+            "benchmarks.run",
+            *sys.argv[1:],
+            "--single",
+            str(rows),
+            "--single-candidates",
+            candidates,
+            "--result-file",
+            result_file.name,
+        ]
+        try:
+            subprocess.run(
+                command,
+                check=True,
+                timeout=args.timeout,
+                stdout=None if args.verbose else subprocess.DEVNULL,
+            )
+        except subprocess.TimeoutExpired:
+            return {
+                "kind": args.kind,
+                "rows": rows,
+                "candidates": candidates,
+                "status": "timeout",
+            }
+        except subprocess.CalledProcessError as e:
+            return {
+                "kind": args.kind,
+                "rows": rows,
+                "candidates": candidates,
+                "status": f"failed ({e.returncode})",
+            }
+        with open(result_file.name) as f:
+            return json.load(f)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    header = (
+        f"{'rows':>9} {'candidates':>10} {'status':>8} {'total s':>9} {'rec/s':>9} "
+        f"{'rss MB':>8} {'llm calls':>10} {'llm tokens':>10} {'cand rec':>8} "
+        f"{'precision':>9} "
+        f"{'recall':>7}  stages (s)"
+    )
+    print(header)
+    for r in results:
+        if r["status"] != "ok":
+            print(f"{r['rows']:>9} {r['candidates']:>10} {r['status']:>8}")
+            continue
+        stages = " ".join(f"{k}={v:.2f}" for k, v in r["stage_seconds"].items() if v)
+        print(
+            f"{r['rows']:>9} {r['candidates']:>10} {r['status']:>8} "
+            f"{r['total_seconds']:>9.2f} {r['records_per_second']:>9.1f} "
+            f"{r['peak_rss_mb']:>8.0f} {r['llm_calls']:>10} "
+            f"{r['llm_input_tokens']:>10} "
+            f"{r['candidate_recall']:>8.3f} {r['precision']:>9.3f} "
+            f"{r['recall']:>7.3f}  {stages}"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kind", choices=["person", "company"], default="person")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--perturbation", type=float, default=0.3)
+    parser.add_argument(
+        "--wide", action="store_true", help="Add low-signal CRM export columns"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embedding-model", default="intfloat/e5-base")
+    parser.add_argument(
+        "--candidates",
+        choices=CANDIDATE_GENERATION,
+        nargs="+",
+        default=["embedding"],
+        help="Candidate generation methods to compare",
+    )
+    parser.add_argument("--latency-median", type=float, default=0.3)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--straggler-rate", type=float, default=0.01)
+    parser.add_argument("--requests-per-second", type=float, default=None)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Compare through a fast model first, escalating UNSURE answers",
+    )
+    parser.add_argument(
+        "--llm-unsure-rate",
+        type=float,
+        default=0.1,
+        help="Share of pairs the fast model of a cascade is unsure about",
+    )
+    parser.add_argument(
+        "--rerank-model", help="Score candidate pairs with this cross-encoder first"
+    )
+    parser.add_argument("--rerank-min-score", type=float, default=0.1)
+    parser.add_argument("--rerank-accept-score", type=float, default=None)
+    parser.add_argument(
+        "--pair-classifier-dir",
+        help="Train the pair classifier here; repeat runs with other seeds to "
+        "see it take over pairs",
+    )
+    parser.add_argument(
+        "--llm-call-budget", type=int, default=None, help="Run in budgeted mode"
+    )
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds per size")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline logs")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--single-candidates", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    if args.single is not None:
+        result = run_single(args, args.single, args.single_candidates)
+        with open(args.result_file, "w") as f:
+            json.dump(result, f)
+        return
+
+    results = []
+    for rows in args.sizes:
+        for candidates in args.candidates:
+            print(
+                f"Running {args.kind} benchmark with {rows} rows ({candidates})",
+                file=sys.stderr,
+            )
+            results.append(run_subprocess(args, rows, candidates))
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "timestamp": time.time(),
+                    "git_commit": _git_commit(),
+                    "args": {k: v for k, v in vars(args).items() if k != "output"},
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
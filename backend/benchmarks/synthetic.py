@@ -0,0 +1,200 @@
+"""Synthetic person and company datasets with known duplicates."""
+
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+
+FIRST_NAMES = [
+    "Sarah", "Thomas", "Maria", "James", "Wei", "Priya", "John", "Elena", "Ahmed",
+    "Laura", "Daniel", "Yuki", "Carlos", "Fatima", "Michael", "Anna", "David",
+    "Olivia", "Robert", "Sofia", "William", "Chloe", "Kwame", "Ingrid",
+]  # fmt: skip
+LAST_NAMES = [
+    "Chen", "Taylor", "Garcia", "Smith", "Patel", "Johnson", "Kim", "Nguyen",
+    "Müller", "Rossi", "Okafor", "Silva", "Brown", "Novak", "Haddad", "Tanaka",
+    "Williams", "Jones", "Martin", "Lee", "Andersen", "Kowalski", "Dubois",
+]  # fmt: skip
+STREETS = [
+    "Maple Court", "Willow Drive", "Main Street", "Oak Avenue", "Pine Road",
+    "Cedar Lane", "Elm Street", "Lakeview Boulevard", "Hillcrest Drive",
+]  # fmt: skip
+CITIES = [
+    "Springfield", "Riverside", "Franklin", "Greenville", "Bristol", "Salem",
+    "Fairview", "Madison", "Georgetown", "Arlington",
+]  # fmt: skip
+EMAIL_DOMAINS = ["gmail.com", "yahoo.com", "outlook.com", "company.com", "email.com"]
+COMPANY_WORDS = [
+    "Acme", "Globex", "Initech", "Umbrella", "Stark", "Wayne", "Hooli", "Vandelay",
+    "Wonka", "Cyberdyne", "Soylent", "Tyrell", "Massive", "Dynamic", "Blue",
+    "Northwind", "Contoso", "Fabrikam", "Pied", "Piper", "Aperture", "Oscorp",
+]  # fmt: skip
+COMPANY_SUFFIXES = ["Inc", "Corporation", "LLC", "Ltd", "Company", "Group"]
+INDUSTRIES = ["Technology", "Retail", "Finance", "Healthcare", "Energy", "Media"]
+UTM_SOURCES = ["google", "linkedin", "newsletter", "partner"]
+UTM_MEDIUMS = ["cpc", "email", "social"]
+LEAD_STATUSES = ["new", "contacted", "qualified"]
+RECORD_OWNERS = ["alice", "bob", "carol"]
+
+ABBREVIATIONS = {
+    "Street": "St",
+    "Avenue": "Ave",
+    "Drive": "Dr",
+    "Road": "Rd",
+    "Boulevard": "Blvd",
+    "Lane": "Ln",
+    "Court": "Ct",
+    "Corporation": "Corp",
+    "Incorporated": "Inc",
+    "Company": "Co",
+    "Limited": "Ltd",
+}
+
+
+@dataclass
+class SyntheticDataset:
+    records: List[Dict[str, str]]
+    # Ground-truth entity id for each record, aligned with ``records``
+    entity_ids: List[int]
+
+
+def _typo(rng: np.random.Generator, value: str) -> str:
+    if len(value) < 3:
+        return value
+    i = int(rng.integers(1, len(value) - 1))
+    kind = rng.integers(3)
+    if kind == 0:  # swap adjacent characters
+        return value[: i - 1] + value[i] + value[i - 1] + value[i + 1 :]
+    if kind == 1:  # drop a character
+        return value[:i] + value[i + 1 :]
+    return value[:i] + value[i] + value[i:]  # double a character
+
+
+def _abbreviate(value: str) -> str:
+    for full, short in ABBREVIATIONS.items():
+        value = value.replace(full, short)
+    return value
+
+
+def _email_variant(rng: np.random.Generator, record: Dict[str, str]) -> str:
+    first = record.get("first_name", "info").lower()
+    last = record.get("last_name", "").lower()
+    local = [f"{first}.{last}", f"{first[0]}{last}", f"{first}{last}", first][
+        rng.integers(4)
+    ]
+    return f"{local}@{EMAIL_DOMAINS[rng.integers(len(EMAIL_DOMAINS))]}"
+
+
+def _perturb(
+    rng: np.random.Generator, record: Dict[str, str], strength: float
+) -> Dict[str, str]:
+    variant = dict(record)
+    for key, value in record.items():
+        if rng.random() >= strength:
+            continue
+        choice = rng.integers(4)
+        if choice == 0:
+            variant[key] = _typo(rng, value)
+        elif choice == 1:
+            variant[key] = _abbreviate(value)
+        elif choice == 2 and "email" in key:
+            variant[key] = _email_variant(rng, record)
+        else:
+            variant[key] = value.lower() if rng.random() < 0.5 else value.upper()
+    return variant
+
+
+def _person(rng: np.random.Generator, entity_id: int) -> Dict[str, str]:
+    first = FIRST_NAMES[rng.integers(len(FIRST_NAMES))]
+    last = LAST_NAMES[rng.integers(len(LAST_NAMES))]
+    record = {"first_name": first, "last_name": last}
+    record["email"] = _email_variant(rng, record)
+    record["phone"] = f"555-{entity_id % 10000:04d}"
+    record["address"] = (
+        f"{rng.integers(1, 9999)} {STREETS[rng.integers(len(STREETS))]}, "
+        f"{CITIES[rng.integers(len(CITIES))]}"
+    )
+    return record
+
+
+def _company(rng: np.random.Generator, entity_id: int) -> Dict[str, str]:
+    words = rng.choice(COMPANY_WORDS, size=2, replace=False)
+    name = f"{words[0]} {words[1]}"
+    return {
+        "company_name": f"{name} {COMPANY_SUFFIXES[rng.integers(len(COMPANY_SUFFIXES))]}",
+        "industry": INDUSTRIES[rng.integers(len(INDUSTRIES))],
+        "address": (
+            f"{rng.integers(1, 9999)} {STREETS[rng.integers(len(STREETS))]}, "
+            f"{CITIES[rng.integers(len(CITIES))]}"
+        ),
+        "website": f"{name.lower().replace(' ', '')}{entity_id}.com",
+        "contact_email": f"info@{name.lower().replace(' ', '')}{entity_id}.com",
+    }
+
+
+def _crm_fields(rng: np.random.Generator) -> Dict[str, str]:
+    """Low-signal columns of a CRM export, drawn afresh for every record."""
+    created = np.datetime64("2020-01-01T00:00:00") + int(rng.integers(0, 10**8))
+    updated = created + int(rng.integers(0, 10**7))
+    return {
+        "created_at": str(created),
+        "updated_at": str(updated),
+        "is_active": str(rng.random() < 0.8).lower(),
+        "email_opt_in": str(rng.random() < 0.5).lower(),
+        "utm_source": UTM_SOURCES[rng.integers(len(UTM_SOURCES))],
+        "utm_medium": UTM_MEDIUMS[rng.integers(len(UTM_MEDIUMS))],
+        "lead_status": LEAD_STATUSES[rng.integers(len(LEAD_STATUSES))],
+        "record_owner": RECORD_OWNERS[rng.integers(len(RECORD_OWNERS))],
+        "country": "US",
+        "notes": "Called, left voicemail" if rng.random() < 0.02 else "",
+    }
+
+
+def generate(
+    kind: str,
+    rows: int,
+    duplicate_rate: float = 0.2,
+    max_duplicates: int = 3,
+    perturbation: float = 0.3,
+    seed: int = 0,
+    wide: bool = False,
+) -> SyntheticDataset:
+    """Generate ``rows`` records of ``kind`` ("person" or "company").
+
+    Roughly ``duplicate_rate`` of the rows are perturbed copies of another row,
+    with up to ``max_duplicates`` copies per entity. ``perturbation`` is the chance
+    that each field of a copy is altered (typo, abbreviation, email variant or case).
+    ``wide`` adds the low-signal columns of a CRM export: timestamps, flags and
+    campaign tags.
+    """
+    make = {"person": _person, "company": _company}[kind]
+    rng = np.random.default_rng(seed)
+
+    # An entity gets copies with probability p, (max_duplicates + 1) / 2 on average;
+    # solve copies / (originals + copies) = duplicate_rate for p
+    mean_copies = (max_duplicates + 1) / 2
+    p_duplicate = min(1.0, duplicate_rate / ((1 - duplicate_rate) * mean_copies))
+
+    records: List[Dict[str, str]] = []
+    entity_ids: List[int] = []
+    entity_id = 0
+    while len(records) < rows:
+        original = make(rng, entity_id)
+        records.append(original)
+        entity_ids.append(entity_id)
+        if rng.random() < p_duplicate:
+            copies = int(rng.integers(1, max_duplicates + 1))
+            for _ in range(min(copies, rows - len(records))):
+                records.append(_perturb(rng, original, perturbation))
+                entity_ids.append(entity_id)
+        entity_id += 1
+
+    if wide:
+        records = [{**record, **_crm_fields(rng)} for record in records]
+
+    # Shuffle so duplicates are not adjacent
+    order = rng.permutation(len(records))
+    return SyntheticDataset(
+        records=[records[i] for i in order],
+        entity_ids=[entity_ids[i] for i in order],
+    )
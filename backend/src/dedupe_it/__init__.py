@@ -1,4 +1,13 @@
-from .grouper import Grouper
 from .config import Config
 
 __all__ = ["Grouper", "Config"]
+
+
+def __getattr__(name: str):
+    # Grouper pulls in the whole pipeline, so it is only imported when asked for;
+    # importing a light submodule such as dedupe_it.config stays cheap
+    if name == "Grouper":
+        from .grouper import Grouper
+
+        return Grouper
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
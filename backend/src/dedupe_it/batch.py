@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Dict, List
+
+from .llm import get_anthropic_client
+from .logger import logger
+from .metrics import llm_requests, record_llm_usage
+from .tracing import traced
+
+# Message Batches accept at most 100,000 requests per batch; we stay well below it
+# so that a single failed submission does not cost a whole night's work.
+MAX_BATCH_REQUESTS = 10_000
+
+BATCH_BETAS = ["message-batches-2024-09-24", "prompt-caching-2024-07-31"]
+
+
+def request_custom_id(params: Dict[str, Any]) -> str:
+    """Derive a stable custom_id from the message parameters of a request."""
+    payload = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:64]
+
+
+class MessageBatchRunner:
+    """Run many Messages API requests through the Message Batches API.
+
+    Each chunk of requests is keyed by a digest of its custom_ids. The submitted
+    batch id, and later its results, are written to ``state_dir`` under that key,
+    so a process restarted mid-batch resumes polling the existing batch instead of
+    submitting (and paying for) the same requests again. With ``merges`` the
+    answers are charged to the job's budget as merges.
+    """
+
+    def __init__(
+        self,
+        state_dir: str,
+        poll_interval: float = 10.0,
+        max_batch_requests: int = MAX_BATCH_REQUESTS,
+        merges: bool = False,
+    ):
+        self.state_dir = state_dir
+        self.poll_interval = poll_interval
+        self.max_batch_requests = max_batch_requests
+        self.merges = merges
+        self.anthropic_client = get_anthropic_client()
+        os.makedirs(state_dir, exist_ok=True)
+
+    @traced
+    async def run(self, requests: List[Dict[str, Any]]) -> List[str | None]:
+        """Return the text answer for each request, or None if it did not succeed."""
+        params_by_id = {request_custom_id(params): params for params in requests}
+        custom_ids = sorted(params_by_id)
+        chunks = [
+            custom_ids[i : i + self.max_batch_requests]
+            for i in range(0, len(custom_ids), self.max_batch_requests)
+        ]
+        logger.info(
+            f"Running {len(requests)} requests ({len(custom_ids)} unique) "
+            f"in {len(chunks)} message batches"
+        )
+
+        answers: Dict[str, str | None] = {}
+        chunk_results = await asyncio.gather(
+            *[
+                self._run_chunk({cid: params_by_id[cid] for cid in chunk})
+                for chunk in chunks
+            ]
+        )
+        for results in chunk_results:
+            answers.update(results)
+
+        return [answers.get(request_custom_id(params)) for params in requests]
+
+    async def _run_chunk(
+        self, requests: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, str | None]:
+        key = hashlib.sha256("".join(requests).encode()).hexdigest()[:32]
+        state = self._load_state(key)
+
+        if "results" in state:
+            logger.info(f"Reusing stored results for message batch {state['batch_id']}")
+            return state["results"]
+
+        if "batch_id" in state:
+            logger.info(f"Resuming message batch {state['batch_id']}")
+        else:
+            batch = await self.anthropic_client.beta.messages.batches.create(
+                requests=[
+                    {"custom_id": custom_id, "params": params}
+                    for custom_id, params in requests.items()
+                ],
+                betas=BATCH_BETAS,
+            )
+            llm_requests.labels("batch").inc(len(requests))
+            state = {"batch_id": batch.id}
+            self._save_state(key, state)
+            logger.info(
+                f"Submitted message batch {batch.id} ({len(requests)} requests)"
+            )
+
+        await self._wait_for_batch(state["batch_id"])
+
+        results: Dict[str, str | None] = {custom_id: None for custom_id in requests}
+        async for entry in await self.anthropic_client.beta.messages.batches.results(
+            state["batch_id"], betas=BATCH_BETAS
+        ):
+            if entry.result.type == "succeeded":
+                record_llm_usage("batch", entry.result.message.usage, merge=self.merges)
+                results[entry.custom_id] = entry.result.message.content[0].text.strip()
+            else:
+                logger.warning(
+                    f"Batch request {entry.custom_id} did not succeed: {entry.result.type}"
+                )
+
+        state["results"] = results
+        self._save_state(key, state)
+        return results
+
+    async def _wait_for_batch(self, batch_id: str) -> None:
+        while True:
+            batch = await self.anthropic_client.beta.messages.batches.retrieve(
+                batch_id, betas=BATCH_BETAS
+            )
+            if batch.processing_status == "ended":
+                counts = batch.request_counts
+                logger.info(
+                    f"Message batch {batch_id} ended: {counts.succeeded} succeeded, "
+                    f"{counts.errored} errored, {counts.expired} expired, "
+                    f"{counts.canceled} canceled"
+                )
+                return
+            logger.debug(
+                f"Message batch {batch_id} is {batch.processing_status}, "
+                f"{batch.request_counts.processing} requests processing"
+            )
+            await asyncio.sleep(self.poll_interval)
+
+    def _state_path(self, key: str) -> str:
+        return os.path.join(self.state_dir, f"{key}.json")
+
+    def _load_state(self, key: str) -> Dict[str, Any]:
+        try:
+            with open(self._state_path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save_state(self, key: str, state: Dict[str, Any]) -> None:
+        # Write to a temporary file first so a crash never leaves a torn state file
+        tmp_path = self._state_path(key) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path(key))
@@ -0,0 +1,83 @@
+"""LLM spend limits for a single dedupe job.
+
+The budget of the running job lives in a context variable, so every LLM call made
+on its behalf is charged through ``record_llm_usage`` without the budget being
+passed down to the comparator and merger.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+_current_budget: ContextVar["Budget | None"] = ContextVar(
+    "current_budget", default=None
+)
+
+
+class Budget:
+    """A cap on the LLM calls and/or tokens a job may spend."""
+
+    def __init__(self, max_calls: int | None = None, max_tokens: int | None = None):
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.calls = 0
+        self.tokens = 0
+        # Spent on merges, which send whole groups and cost more than comparisons
+        self.merge_calls = 0
+        self.merge_tokens = 0
+
+    def charge(self, usage: Any, merge: bool = False) -> None:
+        tokens = sum(
+            getattr(usage, kind, None) or 0
+            for kind in (
+                "input_tokens",
+                "output_tokens",
+                "cache_read_input_tokens",
+                "cache_creation_input_tokens",
+            )
+        )
+        self.calls += 1
+        self.tokens += tokens
+        if merge:
+            self.merge_calls += 1
+            self.merge_tokens += tokens
+
+    def remaining_calls(self, reserve: float = 0.0, merges: bool = False) -> int | None:
+        """How many more calls fit, keeping back a share ``reserve`` of the budget.
+
+        A token cap is turned into calls at the average cost so far of merges,
+        with ``merges``, or else of comparisons; of all calls while there have
+        been none of that kind, or a single call while nothing has been spent
+        yet. None means unlimited.
+        """
+        remaining = None
+        if self.max_calls is not None:
+            remaining = int(self.max_calls * (1 - reserve)) - self.calls
+        if self.max_tokens is not None:
+            tokens_left = int(self.max_tokens * (1 - reserve)) - self.tokens
+            if merges:
+                calls, tokens = self.merge_calls, self.merge_tokens
+            else:
+                calls = self.calls - self.merge_calls
+                tokens = self.tokens - self.merge_tokens
+            if not tokens:
+                calls, tokens = self.calls, self.tokens
+            calls_left = (
+                tokens_left * calls // tokens if tokens else min(tokens_left, 1)
+            )
+            remaining = calls_left if remaining is None else min(remaining, calls_left)
+        return None if remaining is None else max(remaining, 0)
+
+
+def current_budget() -> Budget | None:
+    return _current_budget.get()
+
+
+@contextmanager
+def spending(budget: Budget | None) -> Iterator[Budget | None]:
+    """Charge LLM calls made within the block to ``budget``."""
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
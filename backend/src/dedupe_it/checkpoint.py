@@ -0,0 +1,308 @@
+"""Durable checkpoints for long-running dedupe jobs.
+
+A job's checkpoint is a directory under ``checkpoint_dir`` named after its job id.
+Records, embeddings and the matched groups are written whole at stage boundaries,
+while pair verdicts and finished merges are appended as they complete, so a
+restarted job with the same id and records skips every LLM call it already paid
+for. The same state lets a finished job take record updates and deletes without
+starting over (see ``service.update_records``). Updates are appended too: changed
+records and their embeddings as deltas, and the verdicts and merges they void
+as ``forget`` entries, all replayed when the checkpoint is opened.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Set, Tuple
+
+import numpy as np
+
+from .errors import InvalidInputError
+from .logger import logger
+from .models import Record
+
+_JOB_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def _write_atomic(path: str, write) -> None:
+    """Write a file through a temporary sibling so readers never see half of it."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_lines(path: str) -> List[Any]:
+    """Read a JSON-lines file, dropping a final line cut short by a crash.
+
+    The partial line is truncated away so that later appends start on a fresh
+    line.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb+") as f:
+        content = f.read()
+        complete = content.rfind(b"\n") + 1
+        if complete < len(content):
+            logger.warning(f"Dropping truncated checkpoint entry in {path}")
+            f.truncate(complete)
+    return [json.loads(line) for line in content[:complete].splitlines()]
+
+
+def _records_digest(record_ids: Sequence[str]) -> str:
+    return hashlib.sha256("\0".join(record_ids).encode()).hexdigest()
+
+
+class Checkpoint:
+    """Completed work of one job, read on open and extended as the job runs.
+
+    Without ``record_ids`` an existing job is opened whatever its records are.
+    """
+
+    def __init__(
+        self,
+        checkpoint_dir: str,
+        job_id: str,
+        record_ids: Sequence[str] | None = None,
+    ):
+        if not _JOB_ID.match(job_id):
+            raise InvalidInputError(f"Invalid job id: {job_id!r}")
+        self.job_id = job_id
+        self.path = os.path.join(checkpoint_dir, job_id)
+        manifest_path = self._file("job.json")
+        if record_ids is None and not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"Job not found: {job_id}")
+        os.makedirs(self.path, exist_ok=True)
+
+        # A job id may only be resumed with the records it was started with,
+        # since row ids and verdicts refer to them
+        if record_ids is None:
+            pass
+        elif os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                if json.load(f)["records_digest"] != _records_digest(record_ids):
+                    raise InvalidInputError(
+                        f"Checkpoint for job {job_id} was written for different records"
+                    )
+        else:
+            self._write_manifest(record_ids)
+
+        self.verdicts: Dict[Tuple[str, str], bool] = {}
+        # Pairs with a verdict per record id, so a record's verdicts are dropped
+        # without a scan of all of them
+        self._pairs: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        for entry in _read_lines(self._file("verdicts.jsonl")):
+            if isinstance(entry, dict):
+                self._forget_verdicts(entry["forget"])
+            else:
+                id1, id2, verdict = entry
+                self._set_verdict((id1, id2), verdict)
+        self.merges: Dict[Tuple[str, ...], Dict] = {}
+        for entry in _read_lines(self._file("merges.jsonl")):
+            if "forget" in entry:
+                self._forget_merges(set(entry["forget"]))
+            else:
+                self.merges[tuple(sorted(entry["record_ids"]))] = entry["merged_data"]
+        self._groups: List[List[str]] | None = None
+        logger.info(
+            f"Opened checkpoint for job {job_id}: {len(self.verdicts)} verdicts, "
+            f"{len(self.merges)} merges"
+            + (", embeddings" if os.path.exists(self._file("embeddings.npy")) else "")
+            + (", groups" if os.path.exists(self._file("groups.json")) else "")
+        )
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _write_manifest(self, record_ids: Sequence[str]) -> None:
+        manifest = {"records_digest": _records_digest(record_ids)}
+        _write_atomic(
+            self._file("job.json"), lambda f: f.write(json.dumps(manifest).encode())
+        )
+
+    @property
+    def has_records(self) -> bool:
+        return os.path.exists(self._file("records.jsonl"))
+
+    @property
+    def records(self) -> List[Record] | None:
+        """The job's records, once they have been saved, with later changes
+        applied: updated records keep their place and new ones go last."""
+        path = self._file("records.jsonl")
+        if not os.path.exists(path):
+            return None
+        records: Dict[str, Record] = {}
+        for entry in _read_lines(path):
+            if entry.get("deleted"):
+                del records[entry["id"]]
+            else:
+                records[entry["id"]] = Record(**entry)
+        return list(records.values())
+
+    def save_records(self, records: Sequence[Record]) -> None:
+        """Store the job's records and make them the ones it resumes with."""
+
+        def write(f) -> None:
+            for record in records:
+                line = json.dumps({"id": record.id, "data": record.data}, default=str)
+                f.write(line.encode() + b"\n")
+
+        _write_atomic(self._file("records.jsonl"), write)
+        self._write_manifest([record.id for record in records])
+
+    def save_record_changes(
+        self,
+        upserts: Sequence[Record],
+        deletes: Sequence[str],
+        record_ids: Sequence[str],
+    ) -> None:
+        """Append upserts and deletes to the stored records; ``record_ids`` are
+        the job's record ids after them, which it resumes with."""
+        with open(self._file("records.jsonl"), "a") as f:
+            for record_id in deletes:
+                f.write(json.dumps({"id": record_id, "deleted": True}) + "\n")
+            for record in upserts:
+                f.write(
+                    json.dumps({"id": record.id, "data": record.data}, default=str)
+                    + "\n"
+                )
+        self._write_manifest(record_ids)
+
+    @property
+    def embeddings(self) -> np.ndarray | None:
+        """Stored embeddings, followed by those added since. A record embedded
+        more than once appears more than once; its last embedding is current."""
+        path = self._file("embeddings.npy")
+        if not os.path.exists(path):
+            return None
+        deltas = [np.load(path)["embeddings"] for path in self._embedding_deltas()]
+        return np.concatenate([np.load(path), *deltas])
+
+    @property
+    def embedding_ids(self) -> List[str] | None:
+        """Ids of the records embedded, in the order of ``embeddings``."""
+        path = self._file("embedding_ids.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            ids = json.load(f)
+        for path in self._embedding_deltas():
+            ids.extend(np.load(path)["ids"].tolist())
+        return ids
+
+    def _embedding_deltas(self) -> List[str]:
+        return sorted(glob.glob(self._file("embeddings-*.npz")))
+
+    def save_embeddings(
+        self, embeddings: np.ndarray, record_ids: Sequence[str]
+    ) -> None:
+        _write_atomic(self._file("embeddings.npy"), lambda f: np.save(f, embeddings))
+        _write_atomic(
+            self._file("embedding_ids.json"),
+            lambda f: f.write(json.dumps(list(record_ids)).encode()),
+        )
+        for path in self._embedding_deltas():
+            os.remove(path)
+
+    def add_embeddings(self, embeddings: np.ndarray, record_ids: Sequence[str]) -> None:
+        """Store the embeddings of changed records next to the stored ones."""
+        path = self._file(f"embeddings-{len(self._embedding_deltas()):06d}.npz")
+        _write_atomic(
+            path,
+            lambda f: np.savez(
+                f, embeddings=embeddings, ids=np.array(record_ids, dtype=str)
+            ),
+        )
+
+    @property
+    def match_columns(self) -> List[str] | None:
+        """The columns the job matches on, once chosen."""
+        path = self._file("match_columns.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def save_match_columns(self, columns: List[str]) -> None:
+        _write_atomic(
+            self._file("match_columns.json"),
+            lambda f: f.write(json.dumps(columns).encode()),
+        )
+
+    def record_verdicts(
+        self, id_pairs: Sequence[Tuple[str, str]], verdicts: Sequence[bool]
+    ) -> None:
+        """Append the verdicts of compared pairs."""
+        with open(self._file("verdicts.jsonl"), "a") as f:
+            for (id1, id2), verdict in zip(id_pairs, verdicts):
+                self._set_verdict((id1, id2), verdict)
+                f.write(json.dumps([id1, id2, verdict]) + "\n")
+
+    def pairs_with(self, record_id: str) -> List[Tuple[str, str]]:
+        """Pairs with a verdict that involve ``record_id``."""
+        return self._pairs.get(record_id, [])
+
+    def _set_verdict(self, pair: Tuple[str, str], verdict: bool) -> None:
+        if pair not in self.verdicts:
+            self._pairs[pair[0]].append(pair)
+            self._pairs[pair[1]].append(pair)
+        self.verdicts[pair] = verdict
+
+    @property
+    def groups(self) -> List[List[str]] | None:
+        """Groups of record ids once matching has finished, else None."""
+        if self._groups is not None:
+            return self._groups
+        path = self._file("groups.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            self._groups = json.load(f)
+        return self._groups
+
+    def save_groups(self, groups: List[List[str]]) -> None:
+        _write_atomic(
+            self._file("groups.json"), lambda f: f.write(json.dumps(groups).encode())
+        )
+        self._groups = groups
+
+    def merged(self, record_ids: Sequence[str]) -> Dict | None:
+        """The finished merge of a group, whatever order its ids come in."""
+        return self.merges.get(tuple(sorted(record_ids)))
+
+    def record_merge(self, record_ids: Sequence[str], merged_data: Dict) -> None:
+        self.merges[tuple(sorted(record_ids))] = merged_data
+        with open(self._file("merges.jsonl"), "a") as f:
+            f.write(
+                json.dumps({"record_ids": list(record_ids), "merged_data": merged_data})
+                + "\n"
+            )
+
+    def forget(self, record_ids: Set[str]) -> None:
+        """Drop the verdicts and merges that involve any of ``record_ids``, for
+        records whose data has changed or that are gone."""
+        if not record_ids:
+            return
+        self._forget_verdicts(record_ids)
+        self._forget_merges(record_ids)
+        line = json.dumps({"forget": sorted(record_ids)}) + "\n"
+        for name in ("verdicts.jsonl", "merges.jsonl"):
+            with open(self._file(name), "a") as f:
+                f.write(line)
+
+    def _forget_verdicts(self, record_ids: Sequence[str]) -> None:
+        for record_id in record_ids:
+            for pair in self._pairs.pop(record_id, []):
+                self.verdicts.pop(pair, None)
+
+    def _forget_merges(self, record_ids: Set[str]) -> None:
+        self.merges = {
+            ids: merged_data
+            for ids, merged_data in self.merges.items()
+            if record_ids.isdisjoint(ids)
+        }
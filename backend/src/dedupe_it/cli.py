@@ -0,0 +1,433 @@
+"""Offline batch dedupe of CSV, NDJSON and Parquet files: the ``dedupe-it`` command.
+
+The output has the layout of ``POST /dedupe/table`` results: one row per grouped
+record with its ``record_id``, ``group_id`` and ``merged`` record (flattened to
+``merged.<field>`` columns in CSV). Progress goes to stderr while the job runs,
+followed by a summary of the work done. Files over ``OUT_OF_CORE_BYTES``, or any
+file with ``--out-of-core``, are streamed through ``out_of_core.dedupe_parquet``
+instead of read into memory.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, TextIO
+
+import polars as pl
+
+from .config import Config
+from .logger import logger
+from .metrics import llm_requests, llm_tokens, queue_depth, stage_duration
+from .out_of_core import dedupe_parquet
+from .service import DedupeResult, dedupe_records
+from .tables import records_from_table, result_table
+
+FORMATS = ("csv", "ndjson", "parquet")
+_EXTENSIONS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+}
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1
+# Bad arguments, or an input file that cannot be read as records
+EXIT_USAGE = 2
+# The LLM budget ran out: some pairs went uncompared or some groups unmerged
+EXIT_INCOMPLETE = 3
+EXIT_INTERRUPTED = 130
+
+# Seconds between progress updates on a terminal, and in logs otherwise
+PROGRESS_INTERVAL = 0.5
+PROGRESS_LOG_INTERVAL = 10.0
+# Input files larger than this are streamed out of core unless --in-memory is
+# given; read whole, they take several times their size in memory
+OUT_OF_CORE_BYTES = 256 << 20
+
+
+def file_format(path: str, explicit: str | None = None) -> str:
+    """The format named explicitly, or else the one implied by the extension."""
+    if explicit is not None:
+        return explicit
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in _EXTENSIONS:
+        raise ValueError(
+            f"Cannot tell the format of {path}; pass one of {', '.join(FORMATS)}"
+        )
+    return _EXTENSIONS[extension]
+
+
+def scan(path: str, fmt: str) -> pl.LazyFrame:
+    if fmt == "csv":
+        return pl.scan_csv(path)
+    if fmt == "ndjson":
+        return pl.scan_ndjson(path)
+    return pl.scan_parquet(path)
+
+
+def write(result: pl.LazyFrame, path: str, fmt: str) -> None:
+    """Write a result table to ``path``; CSV gets flat, JSON-encoded columns."""
+    if fmt == "csv":
+        schema = result.collect_schema()
+        if isinstance(schema.get("merged"), pl.Struct):
+            result = result.with_columns(
+                pl.col("merged").name.prefix_fields("merged.")
+            ).unnest("merged")
+            schema = result.collect_schema()
+        nested = [
+            name
+            for name, dtype in schema.items()
+            if isinstance(dtype, (pl.List, pl.Array, pl.Struct))
+        ]
+        result = result.with_columns(
+            pl.col(name).map_elements(_to_json, return_dtype=pl.String)
+            for name in nested
+        )
+    sink(result, path, fmt)
+
+
+def sink(frame: pl.LazyFrame, path: str, fmt: str) -> None:
+    """Write ``frame`` to ``path``, streaming where the engine supports it."""
+    try:
+        getattr(frame, f"sink_{fmt}")(path)
+    except pl.exceptions.InvalidOperationError:
+        getattr(frame.collect(), f"write_{fmt}")(path)
+
+
+def _to_json(value) -> str:
+    return json.dumps(value.to_list() if isinstance(value, pl.Series) else value)
+
+
+class Progress:
+    """Report queue depths and LLM usage on stderr while a job runs."""
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self.live = stream.isatty()
+        self.start = time.time()
+
+    def line(self) -> str:
+        queues = queue_depth.totals()
+        calls = sum(llm_requests.totals().values())
+        tokens = sum(llm_tokens.totals().values())
+        pending = ", ".join(
+            f"{queue} {int(queues.get((queue,), 0))}"
+            for queue in ("embedding", "compare", "merge")
+        )
+        return (
+            f"[{time.time() - self.start:7.1f}s] queued: {pending} | "
+            f"LLM calls {int(calls)}, tokens {int(tokens)}"
+        )
+
+    async def run(self) -> None:
+        interval = PROGRESS_INTERVAL if self.live else PROGRESS_LOG_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            if self.live:
+                self.stream.write(f"\r\033[K{self.line()}")
+            else:
+                self.stream.write(f"{self.line()}\n")
+            self.stream.flush()
+
+    def close(self) -> None:
+        if self.live:
+            self.stream.write("\r\033[K")
+            self.stream.flush()
+
+
+async def _with_progress(job, stream: TextIO | None):
+    """Await ``job`` while a Progress reports on ``stream`` (if any)."""
+    if stream is None:
+        return await job
+    progress = Progress(stream)
+    reporter = asyncio.create_task(progress.run())
+    try:
+        return await job
+    finally:
+        reporter.cancel()
+        progress.close()
+
+
+def summary(
+    records: int, result: pl.LazyFrame, elapsed: float, dedupe: DedupeResult | None
+) -> str:
+    """Describe a finished job: its groups, LLM usage, stage times and coverage."""
+    sizes = (
+        result.group_by("group_id")
+        .len()
+        .select(grouped=pl.col("len").sum(), groups=pl.len())
+        .collect()
+        .row(0, named=True)
+    )
+    grouped = sizes["grouped"] or 0
+    calls = llm_requests.totals()
+    tokens = llm_tokens.totals()
+    lines = [
+        f"Records:    {records}",
+        f"Groups:     {sizes['groups']} of {grouped} records "
+        f"({grouped - sizes['groups']} duplicates)",
+        f"LLM calls:  {int(sum(calls.values()))} "
+        + _breakdown({component: n for (component,), n in calls.items()}),
+        f"LLM tokens: {int(sum(tokens.values()))} "
+        + _breakdown(
+            {
+                kind: sum(n for (_, k), n in tokens.items() if k == kind)
+                for _, kind in tokens
+            }
+        ),
+    ]
+    stages = stage_duration.totals()
+    if stages:
+        lines.append(
+            "Stages:     "
+            + ", ".join(
+                f"{stage} {seconds:.1f}s" for (stage,), seconds in stages.items()
+            )
+        )
+    coverage = dedupe.coverage if dedupe is not None else None
+    if coverage is not None:
+        lines.append(
+            f"Coverage:   {coverage.pairs_compared} of {coverage.pairs_total} pairs "
+            f"compared ({coverage.pairs_implied} implied, {coverage.pairs_reranked} "
+            f"reranked, {coverage.pairs_classified} classified, "
+            f"{coverage.pairs_skipped} skipped), {coverage.groups_merged} of "
+            f"{coverage.groups_total} groups merged"
+        )
+    lines.append(f"Elapsed:    {elapsed:.1f}s")
+    return "\n".join(lines)
+
+
+def _breakdown(counts: dict) -> str:
+    if not counts:
+        return ""
+    return "(" + ", ".join(f"{key} {int(n)}" for key, n in counts.items()) + ")"
+
+
+async def run(args: argparse.Namespace, config: Config) -> int:
+    """Dedupe ``args.input`` into ``args.output``; return the exit code."""
+    start = time.time()
+    input_format = file_format(args.input, args.input_format)
+    output_format = file_format(args.output, args.output_format)
+    stream = None if args.quiet else sys.stderr
+    dedupe = None
+
+    if config.work_dir is not None:
+        os.makedirs(config.work_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="dedupe-cli-", dir=config.work_dir)
+    try:
+        if args.out_of_core:
+            # Other formats are streamed into Parquet first
+            input_path = args.input
+            if input_format != "parquet":
+                input_path = os.path.join(work_dir, "input.parquet")
+                sink(scan(args.input, input_format), input_path, "parquet")
+            output_path = args.output
+            if output_format != "parquet":
+                output_path = os.path.join(work_dir, "output.parquet")
+            await _with_progress(
+                dedupe_parquet(input_path, output_path, config, args.id_column),
+                stream,
+            )
+            total = scan(input_path, "parquet").select(pl.len()).collect().item()
+            result = pl.scan_parquet(output_path)
+            if output_format != "parquet":
+                write(result, args.output, output_format)
+        else:
+            records = records_from_table(
+                scan(args.input, input_format).collect().to_arrow(), args.id_column
+            )
+            total = len(records)
+            logger.info(f"Read {total} records from {args.input}")
+            dedupe = await _with_progress(dedupe_records(records, config), stream)
+            result = pl.from_arrow(
+                result_table(dedupe.groups, records.frame.schema)
+            ).lazy()
+            write(result, args.output, output_format)
+
+        if not args.quiet:
+            print(summary(total, result, time.time() - start, dedupe), file=sys.stderr)
+            print(f"Wrote {args.output}", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if dedupe is not None and dedupe.coverage and dedupe.coverage.budget_exhausted:
+        return EXIT_INCOMPLETE
+    return EXIT_OK
+
+
+def parser() -> argparse.ArgumentParser:
+    defaults = Config()
+    parser = argparse.ArgumentParser(
+        prog="dedupe-it", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument("input", help="CSV, NDJSON or Parquet file of records")
+    parser.add_argument("output", help="File to write the groups to")
+    parser.add_argument(
+        "--input-format", choices=FORMATS, help="Default: from the file extension"
+    )
+    parser.add_argument(
+        "--output-format", choices=FORMATS, help="Default: from the file extension"
+    )
+    parser.add_argument("--id-column", default="id")
+
+    matching = parser.add_argument_group("matching")
+    matching.add_argument(
+        "--concurrency",
+        type=int,
+        default=defaults.llm_concurrency,
+        help="LLM requests in flight at once (default: %(default)s)",
+    )
+    matching.add_argument(
+        "--candidates",
+        choices=("embedding", "lsh", "lsh_rerank"),
+        default=defaults.candidate_generation,
+        help="Candidate generation (default: %(default)s)",
+    )
+    matching.add_argument("--max-neighbors", type=int, default=defaults.max_neighbors)
+    matching.add_argument(
+        "--compare-models",
+        nargs="+",
+        default=defaults.compare_models,
+        metavar="MODEL",
+        help="Comparison models, cheapest first; each may pass a pair it is "
+        "unsure about on to the next",
+    )
+    matching.add_argument(
+        "--rerank-model",
+        help="Local cross-encoder that scores candidate pairs before the LLM",
+    )
+    matching.add_argument(
+        "--rerank-min-score",
+        type=float,
+        default=defaults.rerank_min_score,
+        help="Pairs the rerank model scores lower are not matched",
+    )
+    matching.add_argument(
+        "--rerank-accept-score",
+        type=float,
+        help="Pairs the rerank model scores at least this high are matched",
+    )
+    matching.add_argument(
+        "--pair-classifier-dir",
+        help="Learn from LLM verdicts here and answer confident pairs locally",
+    )
+    matching.add_argument(
+        "--bulk", action="store_true", help="Use the Message Batches API"
+    )
+    matching.add_argument("--max-llm-calls", type=int, help="LLM call budget")
+    matching.add_argument("--max-llm-tokens", type=int, help="LLM token budget")
+    matching.add_argument(
+        "--shards", type=int, default=defaults.shards, help="Worker processes"
+    )
+
+    storage = parser.add_argument_group("storage")
+    storage.add_argument(
+        "--job-id", help="Checkpoint the job under this id; rerun it to resume"
+    )
+    storage.add_argument("--checkpoint-dir", default=defaults.checkpoint_dir)
+    storage.add_argument(
+        "--batch-state-dir",
+        default=defaults.batch_state_dir,
+        help="Where bulk mode keeps submitted batches",
+    )
+    storage.add_argument(
+        "--out-of-core",
+        action="store_const",
+        const=True,
+        help="Stream the file in chunks of --chunk-size records (the default for "
+        f"files over {OUT_OF_CORE_BYTES >> 20}MB)",
+    )
+    storage.add_argument(
+        "--in-memory",
+        dest="out_of_core",
+        action="store_const",
+        const=False,
+        help="Read the whole file into memory, whatever its size",
+    )
+    storage.add_argument("--chunk-size", type=int, default=defaults.chunk_size)
+    storage.add_argument("--memory-limit", help="DuckDB memory limit, e.g. 4GB")
+    storage.add_argument(
+        "--work-dir", help="Directory for converted input, embeddings and spills"
+    )
+
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument(
+        "-q", "--quiet", action="store_true", help="No progress or summary"
+    )
+    output.add_argument("-v", "--verbose", action="store_true", help="Log at INFO")
+    return parser
+
+
+def main(argv: List[str] | None = None) -> int:
+    arg_parser = parser()
+    args = arg_parser.parse_args(argv)
+    in_memory_only = (
+        args.job_id or args.max_llm_calls or args.max_llm_tokens or args.shards > 1
+    )
+    if args.out_of_core and in_memory_only:
+        arg_parser.error(
+            "--out-of-core does not support --job-id, LLM budgets or --shards"
+        )
+    if args.out_of_core is None:
+        large = (
+            os.path.isfile(args.input)
+            and os.path.getsize(args.input) > OUT_OF_CORE_BYTES
+        )
+        if large and in_memory_only:
+            logger.warning(
+                f"Reading {args.input} into memory, since --job-id, LLM budgets "
+                "and --shards need it"
+            )
+        args.out_of_core = large and not in_memory_only
+    if args.concurrency < 1:
+        arg_parser.error("--concurrency must be at least 1")
+    if args.verbose:
+        logger.setLevel("INFO")
+    elif "DEDUPE_LOG_LEVEL" not in os.environ:
+        logger.setLevel("WARNING")
+
+    config = Config(
+        max_neighbors=args.max_neighbors,
+        llm_concurrency=args.concurrency,
+        candidate_generation=args.candidates,
+        compare_models=args.compare_models,
+        rerank_model_name=args.rerank_model,
+        rerank_min_score=args.rerank_min_score,
+        rerank_accept_score=args.rerank_accept_score,
+        pair_classifier_dir=args.pair_classifier_dir,
+        llm_call_budget=args.max_llm_calls,
+        llm_token_budget=args.max_llm_tokens,
+        bulk_mode=args.bulk,
+        batch_state_dir=args.batch_state_dir,
+        chunk_size=args.chunk_size,
+        duckdb_memory_limit=args.memory_limit,
+        work_dir=args.work_dir,
+        job_id=args.job_id,
+        checkpoint_dir=args.checkpoint_dir,
+        shards=args.shards,
+    )
+    try:
+        return asyncio.run(run(args, config))
+    except KeyboardInterrupt:
+        hint = f"; rerun with --job-id {args.job_id} to resume" if args.job_id else ""
+        print(f"Interrupted{hint}", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    except (ValueError, FileNotFoundError, pl.exceptions.PolarsError) as e:
+        print(f"dedupe-it: error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    except Exception as e:
+        logger.exception("Dedupe failed")
+        print(f"dedupe-it: failed: {e}", file=sys.stderr)
+        return EXIT_FAILED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
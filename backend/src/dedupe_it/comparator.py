@@ -1,7 +1,19 @@
+import asyncio
 from .llm import get_anthropic_client
-from .logger import logger
-from typing import Dict, List
+from .logger import logger, sampled
+from typing import Any, Dict, List, Sequence, Tuple
 import json
+import time
+from .batch import MessageBatchRunner
+from .config import Config
+from .metrics import (
+    compare_tier_answers,
+    compare_tier_duration,
+    llm_in_flight,
+    llm_requests,
+    record_llm_usage,
+)
+from .tracing import traced
 from .utils import timing_decorator, with_anthropic_retry
 
 
@@ -33,19 +45,110 @@ system_prompt = """
     The user will also provide the two records to be compared.  Use your best judgement; remember that you are an expert at entity matching and deduplication.
 """
 
+# Earlier tiers of a model cascade may pass on a pair they cannot call
+_ANSWER_INSTRUCTIONS = (
+    "Respond with ONLY 'YES' or 'NO'.  Do not respond with anything else."
+)
+cascade_system_prompt = system_prompt.replace(
+    _ANSWER_INSTRUCTIONS,
+    "If you cannot tell with confidence, respond with ONLY 'UNSURE'; "
+    "the pair will go to a more thorough reviewer.\n"
+    "    Respond with ONLY 'YES', 'NO' or 'UNSURE'.  "
+    "Do not respond with anything else.",
+)
+if cascade_system_prompt == system_prompt:
+    # Early tiers would never pass on a pair
+    raise RuntimeError("system_prompt no longer holds the answer instructions")
+
 
 class Comparator:
-    def __init__(self):
+    def __init__(self, config: Config):
+        self.config = config
         self.anthropic_client = get_anthropic_client()
 
+    @traced
+    @timing_decorator
+    async def are_duplicates(
+        self, data1: Dict, data2: Dict, similarity: float | None = None
+    ) -> bool:
+        """Async verification of a pair of records.
+
+        With a model cascade, the pair goes up the tiers until one of them
+        answers YES or NO; ``similarity`` routes hard pairs past the early tiers.
+        """
+        prompt = self._build_prompt(data1, data2, examples=[])
+        return await self._cascade(prompt, self._tiers(similarity))
+
+    async def _cascade(self, prompt: str, tiers: range) -> bool:
+        for tier in tiers:
+            model = self.config.compare_models[tier]
+            start = time.perf_counter()
+            completion = await self._anthropic_completion_async(prompt, tier)
+            compare_tier_duration.labels(model).observe(time.perf_counter() - start)
+            result = self._parse_answer(completion, tier)
+            if result is not None:
+                return result
+
+    def _tiers(self, similarity: float | None) -> range:
+        """The cascade tiers a pair may go through, cheapest first."""
+        last = len(self.config.compare_models) - 1
+        band = self.config.cascade_hard_band
+        if band is not None and similarity is not None:
+            if band[0] <= similarity <= band[1]:
+                return range(last, last + 1)
+        return range(last + 1)
+
+    @traced
     @timing_decorator
-    async def are_duplicates(self, data1: Dict, data2: Dict) -> bool:
-        """Async verification of a pair of records"""
-        completion = await self._anthropic_completion_async(
-            self._build_prompt(data1, data2, examples=[])
+    async def are_duplicates_bulk(
+        self,
+        pairs: List[Tuple[Dict, Dict]],
+        similarities: Sequence[float | None] | None = None,
+    ) -> List[bool]:
+        """Verify many pairs at once through the Message Batches API.
+
+        With a model cascade, each tier is one round of batches over the pairs
+        still undecided. Pairs whose batch request did not succeed fall back to a
+        real-time call.
+        """
+        runner = MessageBatchRunner(
+            self.config.batch_state_dir, self.config.batch_poll_interval
         )
-        result = self._parse_response(completion)
-        return result
+        similarities = similarities or [None] * len(pairs)
+        prompts = [
+            self._build_prompt(data1, data2, examples=[]) for data1, data2 in pairs
+        ]
+        tiers = [self._tiers(similarity) for similarity in similarities]
+        results: List[bool | None] = [None] * len(pairs)
+        # Tier at which each pair's batch request did not succeed
+        failed: Dict[int, int] = {}
+        for tier in range(len(self.config.compare_models)):
+            undecided = [
+                i
+                for i in range(len(pairs))
+                if results[i] is None and i not in failed and tier in tiers[i]
+            ]
+            if not undecided:
+                continue
+            answers = await runner.run(
+                [self._message_params(prompts[i], tier) for i in undecided]
+            )
+            for i, answer in zip(undecided, answers):
+                if answer is None:
+                    failed[i] = tier
+                else:
+                    results[i] = self._parse_answer(answer, tier)
+
+        tier_count = len(self.config.compare_models)
+        fallbacks = await asyncio.gather(
+            *[
+                self._cascade(prompts[i], range(tier, tier_count))
+                for i, tier in failed.items()
+            ]
+        )
+        for i, result in zip(failed, fallbacks):
+            results[i] = result
+        return results
 
     def _build_prompt(self, data1: Dict, data2: Dict, examples: List[str]) -> str:
         user_guidelines = """
@@ -61,37 +164,76 @@ Consider the following guidelines:
 
 Are the records referring to the same entity?
 
-Record 1: {json.dumps(data1, indent=2)}
-Record 2: {json.dumps(data2, indent=2)}
+Record 1: {json.dumps(self._project(data1), indent=2)}
+Record 2: {json.dumps(self._project(data2), indent=2)}
 """
         return base_prompt.strip()
 
+    def _project(self, data: Dict) -> Dict:
+        """Only the fields records are matched on, when the config names them."""
+        columns = self.config.match_columns
+        if columns is None:
+            return data
+        return {name: data[name] for name in columns if name in data}
+
     @timing_decorator
-    @with_anthropic_retry(max_retries=5, initial_delay=1.0)
-    async def _anthropic_completion_async(self, user_prompt: str) -> str:
+    @with_anthropic_retry(
+        max_retries=5, initial_delay=1.0, call_timeout=20.0, deadline=120.0, hedge=True
+    )
+    @traced
+    async def _anthropic_completion_async(
+        self, user_prompt: str, tier: int | None = None
+    ) -> str:
+        llm_requests.labels("comparator").inc()
+        llm_in_flight.labels("comparator").inc()
         try:
             message = await self.anthropic_client.beta.prompt_caching.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                # model="claude-3-haiku-20240307",
-                max_tokens=1,
-                system=[
-                    {
-                        "type": "text",
-                        "text": system_prompt,
-                        "cache_control": {"type": "ephemeral"},
-                    }
-                ],
-                messages=[
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=0,
+                **self._message_params(user_prompt, tier)
             )
+            record_llm_usage("comparator", message.usage)
             answer = message.content[0].text.strip()
-            logger.info(f"Anthropic answer: {answer}")
+            if sampled():
+                logger.debug("Anthropic answer: %s", answer)
             return answer
         except Exception as e:
             logger.error(f"Error in anthropic completion: {e}")
             raise
+        finally:
+            llm_in_flight.labels("comparator").dec()
+
+    def _message_params(
+        self, user_prompt: str, tier: int | None = None
+    ) -> Dict[str, Any]:
+        """Request parameters for a cascade tier; by default the last one."""
+        models = self.config.compare_models
+        final = tier is None or tier == len(models) - 1
+        return {
+            "model": models[-1 if tier is None else tier],
+            # UNSURE can take more than one token
+            "max_tokens": 1 if final else 3,
+            "system": [
+                {
+                    "type": "text",
+                    "text": system_prompt if final else cascade_system_prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+            "messages": [
+                {"role": "user", "content": user_prompt},
+            ],
+            "temperature": 0,
+        }
 
     def _parse_response(self, response: str) -> bool:
         return response.strip().upper() == "YES"
+
+    def _parse_answer(self, response: str, tier: int) -> bool | None:
+        """The verdict of a cascade tier, or None if it escalates the pair."""
+        model = self.config.compare_models[tier]
+        answer = response.strip().upper()
+        if tier < len(self.config.compare_models) - 1 and answer.startswith("UN"):
+            compare_tier_answers.labels(model, "unsure").inc()
+            return None
+        result = answer == "YES"
+        compare_tier_answers.labels(model, "yes" if result else "no").inc()
+        return result
@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import List, Tuple
 
 RECORD_ID_FIELD = "_dedupit_record_id"
 GROUP_ID_FIELD = "_dedupit_group_id"
@@ -8,6 +9,108 @@ GROUP_ID_FIELD = "_dedupit_group_id"
 class Config:
     # Embedding settings
     embedding_model_name: str = "intfloat/e5-base"
+    # Concurrent requests share forward passes: their texts are batched up to
+    # embedding_batch_size, waiting at most embedding_max_wait_ms for more to come
+    embedding_batch_size: int = 64
+    embedding_max_wait_ms: float = 5.0
 
     # Processing settings
     max_neighbors: int = 3
+    # LLM requests in flight at once in real-time mode; adjust based on your API
+    # limits and performance needs
+    llm_concurrency: int = 200
+    # Collapse records identical up to case and whitespace before matching; the
+    # copies join their first copy's group in the result
+    collapse_exact_duplicates: bool = True
+    # Columns embedded and shown to the comparator (merges always see every
+    # column). By default the records are profiled and columns unlikely to tell
+    # entities apart, such as timestamps, flags, tags and mostly empty columns,
+    # are left out; set match_columns to choose them yourself, or turn
+    # profile_columns off to match on every column
+    match_columns: List[str] | None = None
+    profile_columns: bool = True
+
+    # Comparison model cascade, cheapest first: a pair goes to the first model,
+    # which may answer UNSURE to pass it on to the next; the last model always
+    # answers YES or NO. Pairs whose embedding similarity falls within
+    # cascade_hard_band, (low, high), go straight to the last model, as the
+    # earlier ones would mostly pass them on
+    compare_models: List[str] = field(
+        default_factory=lambda: ["claude-3-5-sonnet-20241022"]
+    )
+    cascade_hard_band: Tuple[float, float] | None = None
+
+    # Candidate generation: "embedding" (nearest neighbors by embedding), "lsh"
+    # (MinHash LSH over character shingles, nothing is embedded) or "lsh_rerank"
+    # (LSH candidates ranked by embedding similarity, embedding only records that
+    # have candidates)
+    candidate_generation: str = "embedding"
+    lsh_num_perm: int = 128
+    lsh_bands: int = 16
+    lsh_shingle_size: int = 3
+    lsh_max_bucket_size: int = 100
+
+    # Rerank: score candidate pairs with a local cross-encoder (e.g.
+    # "cross-encoder/stsb-TinyBERT-L-4") on CPU before they reach the LLM. Pairs
+    # scoring below rerank_min_score are not matched, and pairs scoring at least
+    # rerank_accept_score, when set, are matched, neither with an LLM call
+    rerank_model_name: str | None = None
+    rerank_min_score: float = 0.1
+    rerank_accept_score: float | None = None
+
+    # Pair classifier: with pair_classifier_dir set, LLM verdicts are logged
+    # there with cheap pair features, and a logistic regression is refit every
+    # classifier_retrain_examples new verdicts. Once its confident answers agree
+    # with held-out verdicts at least classifier_min_agreement of the time, pairs
+    # it scores at least classifier_confidence either way are answered without
+    # an LLM call, except a classifier_audit_rate share that is sent anyway to
+    # keep checking it
+    pair_classifier_dir: str | None = None
+    classifier_confidence: float = 0.98
+    classifier_min_agreement: float = 0.99
+    classifier_audit_rate: float = 0.05
+    classifier_retrain_examples: int = 1000
+
+    # Budgeted mode: cap the LLM calls and/or tokens a job may spend. Comparisons
+    # go closest pairs first and merges largest groups first; whatever does not
+    # fit is skipped and reported in the result's coverage
+    llm_call_budget: int | None = None
+    llm_token_budget: int | None = None
+    # Share of the budget held back for merges while comparing
+    llm_budget_merge_share: float = 0.1
+
+    # Bulk mode: route comparisons and merges through the Message Batches API
+    bulk_mode: bool = False
+    batch_state_dir: str = ".dedupe_batches"
+    batch_poll_interval: float = 10.0
+
+    # Out-of-core mode (out_of_core.dedupe_parquet): records are read, embedded,
+    # matched and merged chunk_size at a time. Records, embeddings and union-find
+    # state are memory-mapped from work_dir, DuckDB spills groups there past
+    # duckdb_memory_limit (e.g. "4GB"), and neighbors are searched within
+    # k-means clusters of about out_of_core_cluster_size records, plus records
+    # within shard_boundary_margin of a neighboring cluster
+    chunk_size: int = 100_000
+    out_of_core_cluster_size: int = 10_000
+    duckdb_memory_limit: str | None = None
+    work_dir: str | None = None
+
+    # Checkpointing: with a job_id, completed work is written under
+    # checkpoint_dir/<job_id> and skipped when the same job is run again
+    job_id: str | None = None
+    checkpoint_dir: str = ".dedupe_checkpoints"
+    # Finished jobs kept open in memory for updates, least recently used first
+    # to be closed; each holds the vectors of all of its records
+    max_open_jobs: int = 4
+
+    # Record linkage: persisted reference indexes, one DuckDB file per reference
+    reference_dir: str = ".dedupe_references"
+
+    # Sharded mode: match across worker processes, then reconcile across shards.
+    # Records are partitioned by k-means over their embeddings, or by the value
+    # of shard_blocking_key when set (records with different values never match).
+    shards: int = 1
+    shard_blocking_key: str | None = None
+    # Records whose two nearest centroids are within this cosine similarity of
+    # each other are also searched across shards during reconciliation
+    shard_boundary_margin: float = 0.05
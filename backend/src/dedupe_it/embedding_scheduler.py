@@ -0,0 +1,208 @@
+"""Shared embedding inference for concurrent requests.
+
+Each request hands its texts to the scheduler of its model instead of calling
+``encode`` itself. The scheduler collects texts from every waiting request into
+batches of up to ``max_batch_size``, waiting at most ``max_wait_ms`` after the
+oldest text arrived, and runs each batch as a single forward pass on a worker
+thread. Many small concurrent requests then share full batches, while a large
+request is split across batches that it shares with everyone else, so no caller
+waits behind another's whole job.
+
+Rerank models score record pairs on the same worker thread, a batch at a time,
+so reranking and embedding take turns on the CPU instead of competing for it.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from .logger import logger
+from .metrics import embedding_batch_size, queue_depth
+from .vector_store import get_embedding_model, get_rerank_model
+
+# Texts per forward pass within a scheduled batch. The model sorts a batch's texts
+# by length before splitting it, so each pass pads only to its own longest text
+ENCODE_BATCH_SIZE = 32
+
+
+class _Request:
+    """The texts of one caller and the embeddings computed for them so far."""
+
+    def __init__(self, texts: List[str], future: asyncio.Future, arrived: float):
+        self.texts = texts
+        self.future = future
+        self.arrived = arrived
+        self.embeddings: np.ndarray | None = None
+        # Texts handed to a batch, and texts embedded
+        self.taken = 0
+        self.done = 0
+
+
+class EmbeddingScheduler:
+    """Dynamic micro-batching of embedding requests for one model."""
+
+    def __init__(self, model_name: str, max_batch_size: int, max_wait_ms: float):
+        self.embedding_model = get_embedding_model(model_name)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # One forward pass at a time; the model parallelizes within a batch
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="embedding"
+        )
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pending: List[_Request] = []
+        self._wakeup: asyncio.Event | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed ``texts`` as an (n, dimension) float32 matrix of unit vectors."""
+        if not texts:
+            return np.empty(
+                (0, self.embedding_model.get_sentence_embedding_dimension()),
+                dtype=np.float32,
+            )
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Event loop primitives cannot be shared across loops, e.g. between
+            # successive asyncio.run calls
+            self._loop = loop
+            self._pending = []
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+        request = _Request(list(texts), loop.create_future(), loop.time())
+        self._pending.append(request)
+        queue_depth.labels("embedding").inc(len(texts))
+        self._wakeup.set()
+        try:
+            return await request.future
+        finally:
+            queue_depth.labels("embedding").dec(len(texts))
+            if request in self._pending:
+                # Cancelled before all of its texts were batched
+                self._pending.remove(request)
+
+    def _pending_texts(self) -> int:
+        return sum(len(request.texts) - request.taken for request in self._pending)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._pending:
+                continue
+
+            # Fill the batch until it is full or the oldest text has waited long
+            # enough
+            deadline = self._pending[0].arrived + self.max_wait
+            while self._pending_texts() < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except TimeoutError:
+                    break
+                self._wakeup.clear()
+
+            batch = self._take_batch()
+            if self._pending:
+                self._wakeup.set()
+            if batch:
+                await self._encode_batch(batch)
+
+    def _take_batch(self) -> List[Tuple[_Request, int, int]]:
+        """Slices of pending requests filling one batch.
+
+        The batch is shared evenly among the waiting requests, so a small request
+        goes out in the next batch even while a large one is being worked through.
+        """
+        batch = []
+        room = self.max_batch_size
+        while self._pending and room:
+            share = max(1, room // len(self._pending))
+            for request in list(self._pending):
+                end = min(
+                    len(request.texts), request.taken + share, request.taken + room
+                )
+                batch.append((request, request.taken, end))
+                room -= end - request.taken
+                request.taken = end
+                if end == len(request.texts):
+                    self._pending.remove(request)
+                if not room:
+                    break
+        return batch
+
+    async def _encode_batch(self, batch: List[Tuple[_Request, int, int]]) -> None:
+        texts = [
+            text for request, start, end in batch for text in request.texts[start:end]
+        ]
+        embedding_batch_size.observe(len(texts))
+        try:
+            embeddings = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._encode, texts
+            )
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(texts)} texts failed: {e}")
+            for request, _, _ in batch:
+                if request in self._pending:
+                    self._pending.remove(request)
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        offset = 0
+        for request, start, end in batch:
+            if request.embeddings is None:
+                request.embeddings = np.empty(
+                    (len(request.texts), embeddings.shape[1]), dtype=embeddings.dtype
+                )
+            request.embeddings[start:end] = embeddings[offset : offset + end - start]
+            offset += end - start
+            request.done += end - start
+            if request.done == len(request.texts) and not request.future.done():
+                request.future.set_result(request.embeddings)
+
+    async def score_pairs(
+        self, model_name: str, pairs: Sequence[Tuple[str, str]]
+    ) -> np.ndarray:
+        """Score text pairs with the cross-encoder ``model_name``, in [0, 1]."""
+        loop = asyncio.get_running_loop()
+        scores = []
+        for start in range(0, len(pairs), self.max_batch_size):
+            batch = list(pairs[start : start + self.max_batch_size])
+            scores.append(
+                await loop.run_in_executor(
+                    self._executor, self._score, model_name, batch
+                )
+            )
+        return np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+
+    def _score(self, model_name: str, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        return np.asarray(
+            get_rerank_model(model_name).predict(
+                pairs, batch_size=len(pairs), show_progress_bar=False
+            ),
+            dtype=np.float32,
+        )
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.embedding_model.encode(
+            texts,
+            batch_size=ENCODE_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        )
+
+
+@lru_cache(maxsize=None)
+def get_embedding_scheduler(
+    model_name: str, max_batch_size: int, max_wait_ms: float
+) -> EmbeddingScheduler:
+    """The scheduler shared by every request embedding with these settings."""
+    return EmbeddingScheduler(model_name, max_batch_size, max_wait_ms)
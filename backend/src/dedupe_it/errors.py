@@ -0,0 +1,4 @@
+class InvalidInputError(ValueError):
+    """Input the caller has to fix, such as an invalid job id or records that do
+    not fit a job's checkpoint. The API answers it with a 400; any other error is
+    a fault of the service, including malformed LLM output."""
@@ -0,0 +1,72 @@
+"""DuckDB connections with the extensions the stores need, loaded offline.
+
+Set ``DEDUPE_DUCKDB_EXTENSION_DIR`` to a directory the extensions were installed
+into ahead of time (``python -m src.dedupe_it.extensions <dir>``, run when the
+image is built), and connections load them from there without ever reaching
+the network. Without it, extensions come from DuckDB's default directory and
+are installed there the first time they are missing.
+"""
+
+import argparse
+import os
+
+import duckdb
+
+from .logger import logger
+from .startup import startup_phase
+
+EXTENSION_DIR = os.getenv("DEDUPE_DUCKDB_EXTENSION_DIR")
+# Loaded into every store connection
+EXTENSIONS = ("vss",)
+
+
+def connect(
+    database: str = ":memory:", read_only: bool = False
+) -> duckdb.DuckDBPyConnection:
+    """Connect to ``database`` with the extensions loaded."""
+    config = {}
+    if EXTENSION_DIR is not None:
+        config = {
+            "extension_directory": EXTENSION_DIR,
+            "autoinstall_known_extensions": False,
+        }
+    con = duckdb.connect(database, read_only=read_only, config=config)
+    for name in EXTENSIONS:
+        _load(con, name)
+    return con
+
+
+def _load(con: duckdb.DuckDBPyConnection, name: str) -> None:
+    try:
+        con.load_extension(name)
+    except duckdb.IOException:
+        if EXTENSION_DIR is not None:
+            raise RuntimeError(
+                f"DuckDB extension {name} is missing from {EXTENSION_DIR}; install "
+                f"it with python -m src.dedupe_it.extensions {EXTENSION_DIR}"
+            )
+        logger.info(f"Installing DuckDB extension {name}")
+        with startup_phase(f"install_{name}"):
+            con.install_extension(name)
+        con.load_extension(name)
+
+
+def install(directory: str) -> None:
+    """Download the extensions into ``directory`` for offline use."""
+    os.makedirs(directory, exist_ok=True)
+    with duckdb.connect(config={"extension_directory": directory}) as con:
+        for name in EXTENSIONS:
+            con.install_extension(name)
+            con.load_extension(name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=install.__doc__)
+    parser.add_argument("directory", help="Extension directory to install into")
+    args = parser.parse_args()
+    install(args.directory)
+    print(f"Installed {', '.join(EXTENSIONS)} into {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Local stand-in for the Anthropic Messages and Message Batches APIs.
+
+Lets bulk mode run end to end without network access or an API key:
+
+    uv run python -m uvicorn src.dedupe_it.fake_batch_server:app --port 8081
+    ANTHROPIC_BASE_URL=http://localhost:8081 ANTHROPIC_API_KEY=fake ...
+
+Answers are produced by simple deterministic heuristics, not a model. Batches end
+``FAKE_BATCH_PROCESSING_SECONDS`` after they are created.
+"""
+
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+app = FastAPI()
+
+# batch id -> {"created_at": float, "requests": [...], "canceled": bool}
+batches: Dict[str, Dict[str, Any]] = {}
+
+
+def _processing_seconds() -> float:
+    return float(os.getenv("FAKE_BATCH_PROCESSING_SECONDS", "2"))
+
+
+def _extract_json(text: str, marker: str) -> Any:
+    start = text.index(marker) + len(marker)
+    value, _ = json.JSONDecoder().raw_decode(text[start:].lstrip())
+    return value
+
+
+def _normalize(value: Any) -> str:
+    return " ".join(str(value).lower().replace(".", " ").replace(",", " ").split())
+
+
+def compare_answer(prompt: str) -> str:
+    """YES when at least half of the shared, non-empty fields match loosely."""
+    record1 = _extract_json(prompt, "Record 1:")
+    record2 = _extract_json(prompt, "Record 2:")
+    shared = [k for k in record1 if k in record2 and record1[k] and record2[k]]
+    if not shared:
+        return "NO"
+    matching = sum(_normalize(record1[k]) == _normalize(record2[k]) for k in shared)
+    return "YES" if matching * 2 >= len(shared) else "NO"
+
+
+def merge_answer(prompt: str) -> str:
+    """Keep the longest value seen for each field."""
+    records = _extract_json(prompt, "<duplicate_records>")
+    merged: Dict[str, Any] = {}
+    for record in records:
+        for key, value in record.items():
+            if key not in merged or len(str(value)) > len(str(merged[key])):
+                merged[key] = value
+    return json.dumps(merged)
+
+
+def answer(params: Dict[str, Any]) -> str:
+    prompt = params["messages"][-1]["content"]
+    if "<duplicate_records>" in prompt:
+        return merge_answer(prompt)
+    return compare_answer(prompt)
+
+
+def _message(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": params["model"],
+        "content": [{"type": "text", "text": answer(params)}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": 0, "output_tokens": 0},
+    }
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+def _batch_object(batch_id: str, request: Request) -> Dict[str, Any]:
+    batch = batches[batch_id]
+    ends_at = batch["created_at"] + _processing_seconds()
+    ended = batch["canceled"] or time.time() >= ends_at
+    count = len(batch["requests"])
+    return {
+        "id": batch_id,
+        "type": "message_batch",
+        "processing_status": "ended" if ended else "in_progress",
+        "request_counts": {
+            "processing": 0 if ended else count,
+            "succeeded": count if ended and not batch["canceled"] else 0,
+            "errored": 0,
+            "canceled": count if batch["canceled"] else 0,
+            "expired": 0,
+        },
+        "created_at": _isoformat(batch["created_at"]),
+        "expires_at": _isoformat(
+            batch["created_at"] + timedelta(days=1).total_seconds()
+        ),
+        "ended_at": _isoformat(ends_at) if ended else None,
+        "archived_at": None,
+        "cancel_initiated_at": None,
+        "results_url": (
+            f"{str(request.base_url).rstrip('/')}/v1/messages/batches/{batch_id}/results"
+            if ended
+            else None
+        ),
+    }
+
+
+def _get_batch_id(batch_id: str) -> str:
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail=f"Unknown batch {batch_id}")
+    return batch_id
+
+
+@app.post("/v1/messages")
+async def create_message(request: Request):
+    return _message(await request.json())
+
+
+@app.post("/v1/messages/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    batch_id = f"msgbatch_{uuid.uuid4().hex}"
+    batches[batch_id] = {
+        "created_at": time.time(),
+        "requests": body["requests"],
+        "canceled": False,
+    }
+    return _batch_object(batch_id, request)
+
+
+@app.get("/v1/messages/batches/{batch_id}")
+async def retrieve_batch(batch_id: str, request: Request):
+    return _batch_object(_get_batch_id(batch_id), request)
+
+
+@app.post("/v1/messages/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, request: Request):
+    batches[_get_batch_id(batch_id)]["canceled"] = True
+    return _batch_object(batch_id, request)
+
+
+@app.get("/v1/messages/batches/{batch_id}/results")
+async def batch_results(batch_id: str):
+    batch = batches[_get_batch_id(batch_id)]
+    lines: List[str] = []
+    for item in batch["requests"]:
+        if batch["canceled"]:
+            result = {"type": "canceled"}
+        else:
+            result = {"type": "succeeded", "message": _message(item["params"])}
+        lines.append(json.dumps({"custom_id": item["custom_id"], "result": result}))
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="application/x-jsonl")
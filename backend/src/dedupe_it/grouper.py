@@ -1,12 +1,28 @@
 import asyncio
+from collections import Counter
 from typing import AsyncIterator, Dict, List, Tuple
 
+import numpy as np
 import polars as pl
 
 from .models import Record
+from .checkpoint import Checkpoint
 from .config import Config
-from .vector_store import VectorStore
+from .logger import logger
+from .lsh import MinHashLSH, top_k_neighbors
+from .record_store import RecordBatch, record_ids
+from .vector_store import VectorStore, record_texts
+from .budget import current_budget
 from .comparator import Comparator
+from .embedding_scheduler import get_embedding_scheduler
+from .metrics import classifier_pairs, queue_depth, rerank_pairs
+from .pair_classifier import PairClassifier, pair_features
+from .utils import Timer
+from .tracing import traced
+
+
+# Candidate pairs materialized at a time by the rerank and classifier stages
+PAIR_CHUNK_SIZE = 10_000
 
 
 class Grouper:
@@ -14,81 +30,587 @@ class Grouper:
         self,
         config: Config,
         vector_store: VectorStore,
+        checkpoint: Checkpoint | None = None,
     ):
         self.config = config
         self.vector_store = vector_store
-        self.comparator = Comparator()
+        self.comparator = Comparator(config)
+        self.checkpoint = checkpoint
+        # Pair coverage: compared, implied by earlier matches, or skipped for
+        # lack of budget
+        self.pairs_total = 0
+        self.pairs_compared = 0
+        self.pairs_implied = 0
+        self.pairs_skipped = 0
+        # Decided by the rerank model or the pair classifier without an LLM call
+        self.pairs_reranked = 0
+        self.pairs_classified = 0
+        # Embedding similarity of pairs, kept when the comparison cascade or the
+        # pair classifier use it; None for pairs without vectors, as under LSH
+        self.similarities: Dict[Tuple[int, int], float | None] = {}
+        # With pair_classifier_dir set: a classifier for pairs with a similarity
+        # and one for pairs without (keyed by whether they have one), the
+        # features of pairs awaiting an LLM verdict, and the classifiers' answers
+        # for pairs sent to the LLM as audits
+        self.classifiers: Dict[bool, PairClassifier] = {}
+        self._pair_features: Dict[Tuple[int, int], np.ndarray] = {}
+        self._audited: Dict[Tuple[int, int], bool] = {}
 
-    async def process_records(self, records: List[Record]) -> None:
+    @traced
+    async def process_records(
+        self, records: List[Record], embeddings: np.ndarray | None = None
+    ) -> None:
         """Process multiple records in batch, finding and comparing neighbors."""
-        # Add all records to the store
-        store_entries = self.vector_store.add_records_batch(records)
-
-        # Find neighbors for all records
-        neighbors = await self.vector_store.find_neighbors_batch(
-            query_embeddings=[entry.vector for entry in store_entries],
-            k=self.config.max_neighbors,
-            exclude_record_ids=[entry.id for entry in store_entries],
+        if self.config.candidate_generation == "embedding":
+            if embeddings is None and self.checkpoint is not None:
+                ids = record_ids(records)
+                if self.checkpoint.embedding_ids == ids:
+                    embeddings = self.checkpoint.embeddings
+                if embeddings is None:
+                    embeddings = await self.embed(records)
+                    self.checkpoint.save_embeddings(embeddings, ids)
+            elif embeddings is None:
+                embeddings = await self.embed(records)
+
+            # Add all records to the store
+            batch = await self.vector_store.add_records_batch(records, embeddings)
+
+            # Find neighbors for all records
+            neighbors = await self.vector_store.find_neighbors_batch(
+                query_embeddings=batch.embeddings,
+                k=self.config.max_neighbors,
+                exclude_row_ids=batch.row_ids,
+            )
+        else:
+            batch = await self.vector_store.add_records_batch(
+                records, embeddings, embed=False
+            )
+            neighbors = self._lsh_neighbors(records, batch)
+
+        # Prepare all comparison pairs as row ids; data is materialized when prompted
+        row_pairs = [
+            (row_id, neighbor_row_id)
+            for row_id, record_neighbors in zip(batch.row_ids.tolist(), neighbors)
+            for neighbor_row_id in record_neighbors
+        ]
+        # Neighbors come nearest first, so a pair's rank orders it by distance
+        ranks = [
+            rank
+            for record_neighbors in neighbors
+            for rank in range(len(record_neighbors))
+        ]
+        if batch.embeddings is not None and self._uses_similarities:
+            self._keep_similarities(row_pairs, batch)
+        await self.compare_and_union(row_pairs, ranks)
+
+    @property
+    def _uses_similarities(self) -> bool:
+        return (
+            self.config.cascade_hard_band is not None
+            or self.config.pair_classifier_dir is not None
         )
 
-        # Prepare all comparison pairs
-        comparison_pairs = []
-        record_pairs = []  # Keep track of which records are being compared
-        for record, record_neighbors in zip(records, neighbors):
-            for neighbor in record_neighbors:
-                comparison_pairs.append((record.data, neighbor.data))
-                record_pairs.append((record.id, neighbor.id))
+    def _keep_similarities(
+        self, row_pairs: List[Tuple[int, int]], batch: RecordBatch
+    ) -> None:
+        """Remember the similarity of pairs whose records are both in ``batch``."""
+        if not row_pairs:
+            return
+        pairs = np.array(row_pairs, dtype=np.int64)
+        positions = np.searchsorted(batch.row_ids, pairs).clip(0, len(batch) - 1)
+        in_batch = (batch.row_ids[positions] == pairs).all(axis=1)
+        positions = positions[in_batch]
+        scores = np.einsum(
+            "ij,ij->i",
+            batch.embeddings[positions[:, 0]],
+            batch.embeddings[positions[:, 1]],
+        )
+        self.similarities.update(
+            zip(map(tuple, pairs[in_batch].tolist()), scores.tolist())
+        )
 
-        # Batch compare all pairs
-        batch_size = 200  # Adjust based on your API limits and performance needs
-        results = []
+    async def compare_and_union(
+        self,
+        row_pairs: List[Tuple[int, int]],
+        priorities: List[int] | None = None,
+        similarities: List[float] | None = None,
+    ) -> None:
+        """Compare pairs of stored records and union those that match.
+
+        ``similarities`` gives the embedding similarity of each pair when the
+        caller has it; otherwise it is looked up from the store's vectors when
+        the cascade or the pair classifier need it.
+
+        Pairs with a verdict in the checkpoint are not compared again, nor are
+        pairs the rerank model or the pair classifier decide. Under an LLM
+        budget, pairs are compared in order of ``priorities`` (lowest first)
+        until the budget runs out.
+        """
+        results = self._checkpointed_verdicts(row_pairs)
+        reused = sum(result is not None for result in results)
+        if reused:
+            logger.info(f"Reusing {reused} checkpointed verdicts")
+        if similarities is not None:
+            self.similarities.update(zip(row_pairs, similarities))
+        if self._uses_similarities:
+            await self._look_up_similarities(
+                [
+                    pair
+                    for pair, result in zip(row_pairs, results)
+                    if result is None and pair not in self.similarities
+                ]
+            )
+        if self.config.rerank_model_name is not None:
+            results = await self._rerank(row_pairs, results)
+        if self.config.pair_classifier_dir is not None:
+            results = await self._classify(row_pairs, results)
+        pending = [pair for pair, result in zip(row_pairs, results) if result is None]
+        self.pairs_total += len(row_pairs)
+
+        if current_budget() is None:
+            async with Timer("compare"):
+                pending_results = await self._compare(pending)
+            self.pairs_compared += len(pending)
+            pending_results = iter(pending_results)
+            results = [
+                next(pending_results) if result is None else result
+                for result in results
+            ]
+            matches = [pair for pair, is_match in zip(row_pairs, results) if is_match]
+        else:
+            priorities = priorities or [0] * len(row_pairs)
+            matches = [pair for pair, result in zip(row_pairs, results) if result]
+            matches += await self._compare_within_budget(
+                pending,
+                [p for p, result in zip(priorities, results) if result is None],
+                matches,
+            )
+
+        # Pairs the budget skipped never got a verdict to log
+        for pair in pending:
+            self._pair_features.pop(pair, None)
+            self._audited.pop(pair, None)
 
-        for i in range(0, len(comparison_pairs), batch_size):
-            batch = comparison_pairs[i : i + batch_size]
-            batch_results = await asyncio.gather(
-                *[self.comparator.are_duplicates(pair[0], pair[1]) for pair in batch]
+        with Timer("union"):
+            await self.vector_store.batch_union(matches)
+
+    async def _look_up_similarities(self, row_pairs: List[Tuple[int, int]]) -> None:
+        """Fill in the similarity of pairs from the store's vectors."""
+        for start in range(0, len(row_pairs), PAIR_CHUNK_SIZE):
+            chunk = row_pairs[start : start + PAIR_CHUNK_SIZE]
+            self.similarities.update(
+                zip(chunk, await self.vector_store.pair_similarities(chunk))
             )
-            results.extend(batch_results)
 
-        # Process all matches
+    async def _rerank(
+        self, row_pairs: List[Tuple[int, int]], results: List[bool | None]
+    ) -> List[bool | None]:
+        """Fill in verdicts for the undecided pairs the rerank model is sure of.
+
+        Scores run on the embedding worker thread. Rerank verdicts are not
+        checkpointed: they cost no LLM calls, and the checkpoint keeps LLM
+        verdicts only.
+        """
+        undecided = [i for i, result in enumerate(results) if result is None]
+        if not undecided:
+            return results
+        scheduler = get_embedding_scheduler(
+            self.config.embedding_model_name,
+            self.config.embedding_batch_size,
+            self.config.embedding_max_wait_ms,
+        )
+        columns = self.config.match_columns
+        min_score = self.config.rerank_min_score
+        accept_score = self.config.rerank_accept_score
+        results = list(results)
+        dropped = accepted = 0
+        async with Timer("rerank"):
+            for start in range(0, len(undecided), PAIR_CHUNK_SIZE):
+                chunk = undecided[start : start + PAIR_CHUNK_SIZE]
+                texts = [
+                    (
+                        VectorStore._format_record(data1, columns),
+                        VectorStore._format_record(data2, columns),
+                    )
+                    for data1, data2 in self._pair_data([row_pairs[i] for i in chunk])
+                ]
+                scores = await scheduler.score_pairs(
+                    self.config.rerank_model_name, texts
+                )
+                for i, score in zip(chunk, scores.tolist()):
+                    if score < min_score:
+                        results[i] = False
+                        dropped += 1
+                    elif accept_score is not None and score >= accept_score:
+                        results[i] = True
+                        accepted += 1
+
+        rerank_pairs.labels("dropped").inc(dropped)
+        rerank_pairs.labels("accepted").inc(accepted)
+        rerank_pairs.labels("kept").inc(len(undecided) - dropped - accepted)
+        self.pairs_reranked += dropped + accepted
+        logger.info(
+            f"Rerank dropped {dropped} and accepted {accepted} of "
+            f"{len(undecided)} pairs"
+        )
+        return results
+
+    async def _classify(
+        self, row_pairs: List[Tuple[int, int]], results: List[bool | None]
+    ) -> List[bool | None]:
+        """Fill in verdicts for the undecided pairs the pair classifier is sure of.
+
+        The features of pairs left to the LLM are kept, to be logged with their
+        verdicts.
+        """
+        undecided = [i for i, result in enumerate(results) if result is None]
+        if not undecided:
+            return results
+        results = list(results)
+        answered = audited = 0
+        async with Timer("classify"):
+            for start in range(0, len(undecided), PAIR_CHUNK_SIZE):
+                chunk = undecided[start : start + PAIR_CHUNK_SIZE]
+                pairs = [row_pairs[i] for i in chunk]
+                # Pairs with and without a similarity have different features,
+                # and each kind goes to a classifier trained on its own kind
+                for with_similarity in (True, False):
+                    positions = [
+                        i
+                        for i, pair in zip(chunk, pairs)
+                        if (self.similarities.get(pair) is not None) == with_similarity
+                    ]
+                    if not positions:
+                        continue
+                    kind_pairs = [row_pairs[i] for i in positions]
+                    classifier, features = await asyncio.to_thread(
+                        self._features, kind_pairs, with_similarity
+                    )
+                    probabilities, confident = classifier.decide(features)
+                    audit = confident & (
+                        classifier.rng.random(len(positions))
+                        < self.config.classifier_audit_rate
+                    )
+                    for i, pair, row, probability, is_confident, is_audit in zip(
+                        positions,
+                        kind_pairs,
+                        features,
+                        probabilities,
+                        confident,
+                        audit,
+                    ):
+                        if is_confident and not is_audit:
+                            results[i] = bool(probability >= 0.5)
+                            answered += 1
+                            continue
+                        self._pair_features[pair] = row
+                        if is_audit:
+                            self._audited[pair] = bool(probability >= 0.5)
+                            audited += 1
+
+        classifier_pairs.labels("answered").inc(answered)
+        classifier_pairs.labels("audited").inc(audited)
+        classifier_pairs.labels("deferred").inc(len(undecided) - answered - audited)
+        self.pairs_classified += answered
+        if answered or audited:
+            logger.info(
+                f"Pair classifier answered {answered} of {len(undecided)} pairs "
+                f"and sent {audited} of its answers to the LLM as audits"
+            )
+        return results
+
+    def _features(
+        self, row_pairs: List[Tuple[int, int]], with_similarity: bool
+    ) -> Tuple[PairClassifier, np.ndarray]:
+        """The classifier for pairs of this kind, and the pairs' features."""
+        pair_data = self._pair_data(row_pairs)
+        if with_similarity not in self.classifiers:
+            columns = self.config.match_columns or sorted(
+                name
+                for name in {**pair_data[0][0], **pair_data[0][1]}
+                if not name.startswith("_dedupit_")
+            )
+            self.classifiers[with_similarity] = PairClassifier(
+                self.config, columns, with_similarity
+            )
+        classifier = self.classifiers[with_similarity]
+        features = np.array(
+            [
+                pair_features(
+                    data1, data2, classifier.columns, self.similarities.get(pair)
+                )
+                for (data1, data2), pair in zip(pair_data, row_pairs)
+            ],
+            dtype=np.float32,
+        ).reshape(len(row_pairs), classifier.width)
+        return classifier, features
+
+    async def _learn(
+        self, row_pairs: List[Tuple[int, int]], results: List[bool]
+    ) -> None:
+        """Log LLM verdicts for the pair classifiers and retrain them when due."""
+        for with_similarity, classifier in self.classifiers.items():
+            logged = [
+                (pair, result)
+                for pair, result in zip(row_pairs, results)
+                if pair in self._pair_features
+                and (self.similarities.get(pair) is not None) == with_similarity
+            ]
+            if not logged:
+                continue
+            for pair, result in logged:
+                if pair in self._audited:
+                    classifier.audit(self._audited.pop(pair), result)
+            features = np.stack([self._pair_features.pop(pair) for pair, _ in logged])
+            await asyncio.to_thread(
+                classifier.log, features, [result for _, result in logged]
+            )
+            if classifier.needs_training():
+                await asyncio.to_thread(classifier.train)
+
+    async def _compare(self, row_pairs: List[Tuple[int, int]]) -> List[bool]:
+        if self.config.bulk_mode:
+            results = await self.comparator.are_duplicates_bulk(
+                self._pair_data(row_pairs),
+                [self.similarities.get(pair) for pair in row_pairs],
+            )
+            self._record_verdicts(row_pairs, results)
+        else:
+            results = await self._compare_pairs(row_pairs)
+        if self.classifiers:
+            await self._learn(row_pairs, results)
+        return results
+
+    async def _compare_within_budget(
+        self,
+        row_pairs: List[Tuple[int, int]],
+        priorities: List[int],
+        known_matches: List[Tuple[int, int]],
+    ) -> List[Tuple[int, int]]:
+        """Compare the most valuable pairs the budget allows; return the matches.
+
+        Pairs go closest first and, among equally close ones, those whose records
+        have the most candidates, which tend to join the largest groups. A pair
+        whose records are already connected is skipped, since its verdict could
+        not change the groups.
+        """
+        budget = current_budget()
+        parent: Dict[int, int] = {}
+
+        def find(row_id: int) -> int:
+            parent.setdefault(row_id, row_id)
+            while parent[row_id] != row_id:
+                parent[row_id] = parent[parent[row_id]]
+                row_id = parent[row_id]
+            return row_id
+
+        for row_id1, row_id2 in known_matches:
+            parent[find(row_id1)] = find(row_id2)
+
+        degree = Counter(row_id for pair in row_pairs for row_id in pair)
+        order = sorted(
+            range(len(row_pairs)),
+            key=lambda i: (
+                priorities[i],
+                -(degree[row_pairs[i][0]] + degree[row_pairs[i][1]]),
+            ),
+        )
+
         matches = []
-        for (record_id, neighbor_id), is_match in zip(record_pairs, results):
-            if is_match:
-                matches.append((record_id, neighbor_id))
+        position = 0
+        async with Timer("compare"):
+            while position < len(order):
+                remaining = budget.remaining_calls(self.config.llm_budget_merge_share)
+                # A pair may take a call at every tier of the model cascade
+                if remaining is not None:
+                    remaining //= len(self.config.compare_models)
+                if remaining == 0:
+                    logger.info("LLM budget for comparisons exhausted")
+                    break
+                # Rounds stay small in real-time mode so that the verdicts of one
+                # round can make pairs of the next redundant
+                round_size = len(order) if remaining is None else remaining
+                if not self.config.bulk_mode:
+                    round_size = min(round_size, self.config.llm_concurrency)
 
-        self.vector_store.batch_union(matches)
+                round_pairs = []
+                while position < len(order) and len(round_pairs) < round_size:
+                    row_id1, row_id2 = row_pairs[order[position]]
+                    position += 1
+                    if find(row_id1) == find(row_id2):
+                        self.pairs_implied += 1
+                    else:
+                        round_pairs.append((row_id1, row_id2))
+
+                results = await self._compare(round_pairs)
+                self.pairs_compared += len(round_pairs)
+                for (row_id1, row_id2), is_match in zip(round_pairs, results):
+                    if is_match:
+                        parent[find(row_id1)] = find(row_id2)
+                        matches.append((row_id1, row_id2))
+
+        self.pairs_skipped += len(order) - position
+        return matches
+
+    async def union_groups(self, groups: List[List[str]]) -> None:
+        """Union each group of stored record ids, as a star around its first record."""
+        row_pairs = []
+        for group in groups:
+            row_ids = self.vector_store.records.row_ids(group).tolist()
+            row_pairs.extend((row_ids[0], row_id) for row_id in row_ids[1:])
+        with Timer("union"):
+            await self.vector_store.batch_union(row_pairs)
+
+    def _checkpointed_verdicts(
+        self, row_pairs: List[Tuple[int, int]]
+    ) -> List[bool | None]:
+        if self.checkpoint is None:
+            return [None] * len(row_pairs)
+        ids = self.vector_store.records.ids
+        return [
+            self.checkpoint.verdicts.get((ids[row_id1], ids[row_id2]))
+            for row_id1, row_id2 in row_pairs
+        ]
+
+    def _record_verdicts(
+        self, row_pairs: List[Tuple[int, int]], results: List[bool]
+    ) -> None:
+        if self.checkpoint is None:
+            return
+        ids = self.vector_store.records.ids
+        self.checkpoint.record_verdicts(
+            [(ids[row_id1], ids[row_id2]) for row_id1, row_id2 in row_pairs], results
+        )
+
+    @traced
+    def _lsh_neighbors(
+        self, records: List[Record], batch: RecordBatch
+    ) -> List[List[int]]:
+        """Find neighbors through MinHash LSH, optionally reranked by embeddings."""
+        lsh = MinHashLSH(
+            num_perm=self.config.lsh_num_perm,
+            bands=self.config.lsh_bands,
+            shingle_size=self.config.lsh_shingle_size,
+            max_bucket_size=self.config.lsh_max_bucket_size,
+        )
+        with Timer("candidates"):
+            pairs, scores = lsh.candidate_pairs(
+                record_texts(records, self.config.match_columns)
+            )
+        logger.info(f"LSH produced {len(pairs)} candidate pairs")
+
+        if self.config.candidate_generation == "lsh_rerank" and len(pairs):
+            # Only records that have candidates need an embedding
+            candidates = np.unique(pairs)
+            if batch.embeddings is not None:
+                embeddings = batch.embeddings[candidates]
+            else:
+                with Timer("embedding"):
+                    embeddings = self.vector_store._generate_embeddings_batch(
+                        [records[i] for i in candidates], self.config.match_columns
+                    )
+            positions = np.searchsorted(candidates, pairs)
+            scores = np.einsum(
+                "ij,ij->i", embeddings[positions[:, 0]], embeddings[positions[:, 1]]
+            )
+
+        neighbors = top_k_neighbors(
+            pairs, scores, len(records), self.config.max_neighbors
+        )
+        reranked = self.config.candidate_generation == "lsh_rerank" and len(pairs)
+        if reranked and self._uses_similarities:
+            # Reranked candidates have embeddings, so their pairs get a similarity
+            # like pairs found by embedding search
+            kept = np.array(
+                [
+                    (i, j)
+                    for i, row_neighbors in enumerate(neighbors)
+                    for j in row_neighbors
+                ],
+                dtype=np.int64,
+            ).reshape(-1, 2)
+            positions = np.searchsorted(candidates, kept)
+            kept_scores = np.einsum(
+                "ij,ij->i", embeddings[positions[:, 0]], embeddings[positions[:, 1]]
+            )
+            self.similarities.update(
+                zip(map(tuple, batch.row_ids[kept].tolist()), kept_scores.tolist())
+            )
+        return [batch.row_ids[row_neighbors].tolist() for row_neighbors in neighbors]
+
+    async def embed(self, records: List[Record]) -> np.ndarray:
+        """Embed records through the scheduler shared with concurrent requests."""
+        scheduler = get_embedding_scheduler(
+            self.config.embedding_model_name,
+            self.config.embedding_batch_size,
+            self.config.embedding_max_wait_ms,
+        )
+        async with Timer("embedding"):
+            return await scheduler.encode(
+                record_texts(records, self.config.match_columns)
+            )
+
+    def _pair_data(self, row_pairs: List[Tuple[int, int]]) -> List[Tuple[Dict, Dict]]:
+        """Materialize record data for comparison pairs, once per distinct row."""
+        row_ids = list({row_id for pair in row_pairs for row_id in pair})
+        data = dict(zip(row_ids, self.vector_store.records.get_many(row_ids)))
+        return [(data[row_id1], data[row_id2]) for row_id1, row_id2 in row_pairs]
+
+    async def _compare_pairs(self, row_pairs: List[Tuple[int, int]]) -> List[bool]:
+        # Batch compare all pairs
+        batch_size = self.config.llm_concurrency
+        results = []
+
+        queue_depth.labels("compare").inc(len(row_pairs))
+        try:
+            for i in range(0, len(row_pairs), batch_size):
+                batch_pairs = row_pairs[i : i + batch_size]
+                batch = self._pair_data(batch_pairs)
+                batch_results = await asyncio.gather(
+                    *[
+                        self.comparator.are_duplicates(
+                            data1, data2, self.similarities.get(pair)
+                        )
+                        for (data1, data2), pair in zip(batch, batch_pairs)
+                    ]
+                )
+                # Verdicts are checkpointed batch by batch, as they are paid for
+                self._record_verdicts(batch_pairs, batch_results)
+                results.extend(batch_results)
+                queue_depth.labels("compare").dec(len(batch))
+        finally:
+            queue_depth.labels("compare").dec(len(row_pairs) - len(results))
+        return results
 
     async def process_record(self, record: Record) -> None:
         async for match in self.identify_matches(record):
-            record_id1, record_id2 = match
-            self.vector_store.union(record_id1, record_id2)
+            row_id1, row_id2 = match
+            await self.vector_store.union(row_id1, row_id2)
 
-    async def identify_matches(self, record: Record) -> AsyncIterator[Tuple[str, str]]:
+    async def identify_matches(self, record: Record) -> AsyncIterator[Tuple[int, int]]:
         # Add record to vector store
-        store_entry = self.vector_store.add_record(record)
+        batch = await self.vector_store.add_record(record)
+        row_id = int(batch.row_ids[0])
 
         # Find neighbors
-        neighbor_records = await self.vector_store.find_neighbors(
-            store_entry.vector,
+        neighbor_row_ids = await self.vector_store.find_neighbors(
+            batch.embeddings[0],
             self.config.max_neighbors,
-            exclude_record_id=store_entry.id,  # Exclude self
+            exclude_row_id=row_id,  # Exclude self
         )
+        neighbor_data = self.vector_store.records.get_many(neighbor_row_ids)
 
         # Compare record to neighbors
         tasks = []
         async with asyncio.TaskGroup() as tg:
-            for neighbor_record in neighbor_records:
-                task = tg.create_task(
-                    self.comparator.are_duplicates(
-                        store_entry.data, neighbor_record.data
-                    )
-                )
-                tasks.append((task, neighbor_record))
+            for neighbor_row_id, data in zip(neighbor_row_ids, neighbor_data):
+                task = tg.create_task(self.comparator.are_duplicates(record.data, data))
+                tasks.append((task, neighbor_row_id))
 
         # Process results as they complete
-        for task, neighbor_record in tasks:
+        for task, neighbor_row_id in tasks:
             if task.result():
-                yield store_entry.id, neighbor_record.id
+                yield row_id, neighbor_row_id
 
-    def get_groups(self, include_records=False) -> pl.DataFrame:
-        return self.vector_store.get_groups(include_records)
+    async def get_groups(self, include_records=False) -> pl.DataFrame:
+        return await self.vector_store.get_groups(include_records)
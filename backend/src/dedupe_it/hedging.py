@@ -0,0 +1,87 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+import numpy as np
+
+from .logger import logger
+from .metrics import llm_hedges
+
+T = TypeVar("T")
+
+
+def _discard_result(task: asyncio.Future) -> None:
+    # A cancelled loser may still finish with an error; retrieve it so asyncio
+    # does not report it as never retrieved
+    if not task.cancelled():
+        task.exception()
+
+
+class Hedger:
+    """Issue a duplicate request when the first one is slower than usual.
+
+    The hedge delay is the ``quantile`` of recently observed latencies, so only the
+    slowest few percent of calls are duplicated. ``max_hedge_ratio`` caps the share
+    of calls that may be hedged, which bounds the extra load we put on the API.
+    """
+
+    def __init__(
+        self,
+        quantile: float = 0.95,
+        max_hedge_ratio: float = 0.1,
+        initial_delay: float = 5.0,
+        min_delay: float = 0.05,
+        window: int = 500,
+        min_samples: int = 20,
+    ):
+        self.quantile = quantile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.calls = 0
+        self.hedges = 0
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < self.min_samples:
+            return self.initial_delay
+        delay = float(np.quantile(self.latencies, self.quantile))
+        return max(delay, self.min_delay)
+
+    def _may_hedge(self) -> bool:
+        return self.hedges + 1 <= self.max_hedge_ratio * self.calls
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> T:
+        """Await ``call()``, racing it against a hedge if it outlives the delay."""
+        self.calls += 1
+        start = time.monotonic()
+        pending = {asyncio.ensure_future(call())}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay())
+            if not done and self._may_hedge():
+                self.hedges += 1
+                llm_hedges.inc()
+                logger.debug(
+                    f"Hedging request after {time.monotonic() - start:.2f}s "
+                    f"({self.hedges}/{self.calls} calls hedged)"
+                )
+                pending.add(asyncio.ensure_future(call()))
+
+            while not done:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                # Only give up on the race once every request has failed
+                if pending and all(task.exception() for task in done):
+                    done = set()
+
+            succeeded = [task for task in done if task.exception() is None]
+            result = (succeeded or list(done))[0].result()
+            self.latencies.append(time.monotonic() - start)
+            return result
+        finally:
+            for task in pending:
+                task.add_done_callback(_discard_result)
+                task.cancel()
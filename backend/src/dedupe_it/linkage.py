@@ -0,0 +1,356 @@
+"""Record linkage: match incoming records against an indexed reference dataset.
+
+A reference dataset is embedded and indexed once, into a DuckDB file holding its
+records, their vectors and an HNSW index over them. Linking a batch then embeds
+only the incoming records, searches only the reference, and compares each
+incoming record with its nearest reference records, so its cost scales with the
+batch rather than with the reference.
+"""
+
+import asyncio
+import json
+import os
+import re
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Tuple
+
+import duckdb
+import numpy as np
+import polars as pl
+from pydantic import BaseModel
+
+from .comparator import Comparator
+from .config import Config
+from .embedding_scheduler import get_embedding_scheduler
+from .errors import InvalidInputError
+from .extensions import connect
+from .logger import logger
+from .metrics import queue_depth
+from .models import Record
+from .tracing import traced
+from .utils import Timer
+from .vector_store import encode_records, get_embedding_model, record_texts
+
+# Reference records embedded and inserted at once while building an index
+BUILD_CHUNK_SIZE = 10_000
+
+_REFERENCE_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class LinkMatch(BaseModel):
+    record_id: str
+    # Matching reference record ids, nearest first; empty when nothing matched
+    reference_ids: List[str]
+
+
+class LinkResult(BaseModel):
+    matches: List[LinkMatch]
+
+
+def reference_path(reference_dir: str, name: str) -> str:
+    if not _REFERENCE_NAME.match(name):
+        raise InvalidInputError(f"Invalid reference name: {name!r}")
+    return os.path.join(reference_dir, f"{name}.duckdb")
+
+
+class ReferenceIndex:
+    """A persisted reference dataset: records, vectors and their HNSW index."""
+
+    def __init__(self, con: duckdb.DuckDBPyConnection):
+        self.con = con
+        metadata = dict(con.execute("SELECT key, value FROM metadata").fetchall())
+        self.embedding_model_name = metadata["embedding_model_name"]
+        self.dimension = int(metadata["dimension"])
+        self.size = int(metadata["size"])
+
+    @classmethod
+    def build(
+        cls,
+        reference_dir: str,
+        name: str,
+        records: List[Record],
+        embedding_model_name: str,
+    ) -> "ReferenceIndex":
+        """Embed and index ``records`` as the reference ``name``, replacing any
+        existing reference of that name once the new one is complete."""
+        building_path = cls.write(reference_dir, name, records, embedding_model_name)
+        os.replace(building_path, reference_path(reference_dir, name))
+        return cls.open(reference_dir, name)
+
+    @classmethod
+    @traced
+    def write(
+        cls,
+        reference_dir: str,
+        name: str,
+        records: List[Record],
+        embedding_model_name: str,
+    ) -> str:
+        """Embed and index ``records`` into a file beside the reference ``name``
+        and return its path, for the caller to move into place."""
+        path = reference_path(reference_dir, name)
+        if len({record.id for record in records}) != len(records):
+            raise InvalidInputError("Reference record ids must be unique")
+        os.makedirs(reference_dir, exist_ok=True)
+        building_path = f"{path}.building"
+        if os.path.exists(building_path):
+            os.remove(building_path)
+
+        embedding_model = get_embedding_model(embedding_model_name)
+        dimension = embedding_model.get_sentence_embedding_dimension()
+        logger.info(f"Building reference {name} from {len(records)} records")
+
+        con = cls._connect(building_path, read_only=False)
+        try:
+            con.execute(
+                "CREATE TABLE metadata (key VARCHAR PRIMARY KEY, value VARCHAR)"
+            )
+            con.execute(
+                """
+                CREATE TABLE records (
+                    row_id BIGINT PRIMARY KEY,
+                    id VARCHAR NOT NULL,
+                    data JSON NOT NULL
+                )
+                """
+            )
+            con.execute(
+                f"""
+                CREATE TABLE vectors (
+                    row_id BIGINT PRIMARY KEY,
+                    vector FLOAT[{dimension}] NOT NULL
+                )
+                """
+            )
+
+            for start in range(0, len(records), BUILD_CHUNK_SIZE):
+                chunk = records[start : start + BUILD_CHUNK_SIZE]
+                row_ids = np.arange(start, start + len(chunk), dtype=np.int64)
+                with Timer("embedding"):
+                    embeddings = encode_records(embedding_model, chunk)
+                records_df = pl.DataFrame(
+                    {
+                        "row_id": row_ids,
+                        "id": [record.id for record in chunk],
+                        "data": [
+                            json.dumps(record.data, default=str) for record in chunk
+                        ],
+                    }
+                )
+                vectors_df = pl.DataFrame(
+                    {
+                        "row_id": row_ids,
+                        "vector": np.asarray(embeddings, dtype=np.float32),
+                    }
+                )
+                with Timer("insert"):
+                    con.execute("INSERT INTO records SELECT * FROM records_df")
+                    con.execute("INSERT INTO vectors SELECT * FROM vectors_df")
+                logger.info(f"Indexed {start + len(chunk)}/{len(records)} records")
+
+            # Building the index once over the full table is cheaper than
+            # maintaining it through every insert
+            con.execute("CREATE INDEX vector_idx ON vectors USING HNSW (vector)")
+            con.executemany(
+                "INSERT INTO metadata VALUES (?, ?)",
+                [
+                    ["embedding_model_name", embedding_model_name],
+                    ["dimension", str(dimension)],
+                    ["size", str(len(records))],
+                ],
+            )
+            con.execute("CHECKPOINT")
+        finally:
+            con.close()
+        logger.info(f"Reference {name} written to {building_path}")
+        return building_path
+
+    @classmethod
+    def open(cls, reference_dir: str, name: str) -> "ReferenceIndex":
+        path = reference_path(reference_dir, name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Reference not found: {name}")
+        return cls(cls._connect(path, read_only=True))
+
+    @staticmethod
+    def _connect(path: str, read_only: bool) -> duckdb.DuckDBPyConnection:
+        con = connect(path, read_only=read_only)
+        # HNSW indexes in a database file are experimental in vss and must be
+        # enabled explicitly
+        con.execute("SET hnsw_enable_experimental_persistence = true")
+        return con
+
+    def close(self):
+        self.con.close()
+
+    def __len__(self) -> int:
+        return self.size
+
+    @traced
+    def search(self, query_embeddings: np.ndarray, k: int) -> List[List[int]]:
+        """Return the row ids of the ``k`` nearest reference records per query.
+
+        Each query is a separate top-k lookup, which is the shape the HNSW index
+        serves, so a query touches a handful of index nodes instead of every
+        reference vector.
+        """
+        query = f"""
+            SELECT row_id FROM vectors
+            ORDER BY array_distance(vector, ?::FLOAT[{self.dimension}])
+            LIMIT ?
+        """
+        embeddings = np.asarray(query_embeddings, dtype=np.float32).tolist()
+        # Requests share the index from several worker threads, and a connection
+        # is not thread-safe, so each lookup runs on a cursor of its own
+        with Timer("neighbor_search"), self.con.cursor() as cursor:
+            return [
+                [row[0] for row in cursor.execute(query, [embedding, k]).fetchall()]
+                for embedding in embeddings
+            ]
+
+    @traced
+    def get_records(self, row_ids: List[int]) -> Dict[int, Record]:
+        """Fetch reference records by row id."""
+        with self.con.cursor() as cursor:
+            rows = cursor.execute(
+                """
+                SELECT row_id, id, data FROM records
+                WHERE row_id IN (SELECT unnest(?::BIGINT[]))
+                """,
+                [list(row_ids)],
+            ).fetchall()
+        return {
+            row_id: Record(id=record_id, data=json.loads(data))
+            for row_id, record_id, data in rows
+        }
+
+
+class ReferenceIndexes:
+    """Reference indexes under ``reference_dir``, opened once and shared by the
+    requests that link against them.
+
+    A rebuild serves the old index while the new one is written, then swaps it
+    in. DuckDB hands a new connection to a path the database already open there,
+    so the file is only replaced once requests using the old index are done and
+    it is closed.
+    """
+
+    def __init__(self, reference_dir: str):
+        self.reference_dir = reference_dir
+        self._indexes: Dict[str, ReferenceIndex] = {}
+        # Requests using each open index
+        self._users: Dict[str, int] = defaultdict(int)
+        self._released: Dict[str, asyncio.Condition] = defaultdict(asyncio.Condition)
+        # Held while a name is opened or rebuilt, so builds of a name, which
+        # share the file they write to, run one at a time
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    @asynccontextmanager
+    async def use(self, name: str) -> AsyncIterator[ReferenceIndex]:
+        """The open index of reference ``name``, opening it on first use."""
+        index = self._indexes.get(name)
+        if index is None:
+            async with self._locks[name]:
+                index = self._indexes.get(name)
+                if index is None:
+                    index = await asyncio.to_thread(
+                        ReferenceIndex.open, self.reference_dir, name
+                    )
+                    self._indexes[name] = index
+        self._users[name] += 1
+        try:
+            yield index
+        finally:
+            self._users[name] -= 1
+            async with self._released[name]:
+                self._released[name].notify_all()
+
+    async def build(
+        self, name: str, records: List[Record], embedding_model_name: str
+    ) -> int:
+        """Build reference ``name`` on a worker thread and swap it in for the
+        index of that name. Returns its size."""
+        async with self._locks[name]:
+            building_path = await asyncio.to_thread(
+                ReferenceIndex.write,
+                self.reference_dir,
+                name,
+                records,
+                embedding_model_name,
+            )
+            old = self._indexes.pop(name, None)
+            if old is not None:
+                async with self._released[name]:
+                    await self._released[name].wait_for(lambda: self._users[name] == 0)
+                old.close()
+            os.replace(building_path, reference_path(self.reference_dir, name))
+            index = await asyncio.to_thread(
+                ReferenceIndex.open, self.reference_dir, name
+            )
+            self._indexes[name] = index
+            return len(index)
+
+
+@traced
+async def link_records(
+    records: List[Record], index: ReferenceIndex, config: Config | None = None
+) -> LinkResult:
+    """Match each incoming record against its nearest reference records."""
+    config = config or Config()
+    if not records:
+        return LinkResult(matches=[])
+
+    scheduler = get_embedding_scheduler(
+        index.embedding_model_name,
+        config.embedding_batch_size,
+        config.embedding_max_wait_ms,
+    )
+    async with Timer("embedding"):
+        embeddings = await scheduler.encode(record_texts(records))
+    # Index lookups block, so they run off the event loop
+    neighbors = await asyncio.to_thread(index.search, embeddings, config.max_neighbors)
+    reference = await asyncio.to_thread(
+        index.get_records,
+        list({row_id for row_ids in neighbors for row_id in row_ids}),
+    )
+
+    pairs: List[Tuple[int, int]] = [
+        (i, row_id) for i, row_ids in enumerate(neighbors) for row_id in row_ids
+    ]
+    logger.info(
+        f"Linking {len(records)} records against {len(index)} reference records "
+        f"({len(pairs)} pairs)"
+    )
+    comparator = Comparator(config)
+    pair_data = [(records[i].data, reference[row_id].data) for i, row_id in pairs]
+    async with Timer("compare"):
+        if config.bulk_mode:
+            results = await comparator.are_duplicates_bulk(pair_data)
+        else:
+            results = []
+            queue_depth.labels("compare").inc(len(pair_data))
+            try:
+                batch_size = config.llm_concurrency
+                for start in range(0, len(pair_data), batch_size):
+                    batch = pair_data[start : start + batch_size]
+                    results.extend(
+                        await asyncio.gather(
+                            *[comparator.are_duplicates(a, b) for a, b in batch]
+                        )
+                    )
+                    queue_depth.labels("compare").dec(len(batch))
+            finally:
+                queue_depth.labels("compare").dec(len(pair_data) - len(results))
+
+    # Pairs are in distance order per record, so matches stay nearest first
+    reference_ids: List[List[str]] = [[] for _ in records]
+    for (i, row_id), is_match in zip(pairs, results):
+        if is_match:
+            reference_ids[i].append(reference[row_id].id)
+    return LinkResult(
+        matches=[
+            LinkMatch(record_id=record.id, reference_ids=ids)
+            for record, ids in zip(records, reference_ids)
+        ]
+    )
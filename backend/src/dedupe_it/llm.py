@@ -1,7 +1,14 @@
 from functools import lru_cache
-import anthropic
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import anthropic
 
 
 @lru_cache(maxsize=1)
-def get_anthropic_client() -> anthropic.AsyncAnthropic:
-    return anthropic.AsyncAnthropic()
+def get_anthropic_client() -> "anthropic.AsyncAnthropic":
+    # Imported on first use, since anthropic is slow to import
+    import anthropic
+
+    # Retries, timeouts and hedging are handled by utils.with_anthropic_retry
+    return anthropic.AsyncAnthropic(max_retries=0)
@@ -1,5 +1,58 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
 import sys
+from typing import Any, Callable
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Render each record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _Lazy:
+    __slots__ = ("func", "args", "kwargs")
+
+    def __init__(self, func: Callable[..., Any], *args: Any, **kwargs: Any):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self) -> str:
+        return str(self.func(*self.args, **self.kwargs))
+
+
+def lazy(func: Callable[..., Any], *args: Any, **kwargs: Any) -> _Lazy:
+    """Defer an expensive log payload until the record is actually formatted.
+
+    Use with %-style arguments: ``logger.debug("Records: %s", lazy(json.dumps, r))``
+    """
+    return _Lazy(func, *args, **kwargs)
+
+
+def sampled() -> bool:
+    """Whether to emit a per-record log line, at ``DEDUPE_LOG_SAMPLE_RATE``."""
+    return random.random() < log_sample_rate
 
 
 def setup_logger(name: str = "dedupe_it") -> logging.Logger:
@@ -8,15 +61,25 @@ def setup_logger(name: str = "dedupe_it") -> logging.Logger:
 
     # Only add handlers if they haven't been added already
     if not logger.handlers:
-        # Console handler
+        # Console handler, fed from a queue so callers never block on stdout
         handler = logging.StreamHandler(sys.stdout)
-        handler.setFormatter(
-            logging.Formatter("%(asctime)s | %(levelname)s | %(module)s | %(message)s")
-        )
-        logger.addHandler(handler)
+        if os.getenv("DEDUPE_LOG_FORMAT", "json").lower() == "json":
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(
+                logging.Formatter(
+                    "%(asctime)s | %(levelname)s | %(module)s | %(message)s"
+                )
+            )
+
+        log_queue: queue.Queue = queue.Queue(-1)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        listener = logging.handlers.QueueListener(log_queue, handler)
+        listener.start()
+        atexit.register(listener.stop)
 
         # Set level
-        logger.setLevel(logging.DEBUG)
+        logger.setLevel(os.getenv("DEDUPE_LOG_LEVEL", "INFO").upper())
 
         # Prevent propagation to root logger
         logger.propagate = False
@@ -24,5 +87,7 @@ def setup_logger(name: str = "dedupe_it") -> logging.Logger:
     return logger
 
 
+log_sample_rate = float(os.getenv("DEDUPE_LOG_SAMPLE_RATE", "0.01"))
+
 # Create default logger instance
 logger = setup_logger()
@@ -0,0 +1,182 @@
+"""MinHash LSH candidate generation over character shingles.
+
+A cheap alternative to embedding every record. Each record's text is reduced to a
+MinHash signature over its character shingles, signatures are cut into bands,
+and records that share a bucket in any band become candidates. Candidates are
+ranked by estimated Jaccard similarity, the share of agreeing signature values.
+
+Everything is vectorized over the whole batch: shingles are hashed from one
+array of code points, and signatures are computed over chunks of records at once.
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+import polars as pl
+
+# Multiplier for the polynomial shingle hash
+_SHINGLE_BASE = np.uint64(1_000_003)
+# Records hashed at once when computing signatures
+_CHUNK_RECORDS = 4096
+# Candidate pairs compared at once when estimating similarity
+_CHUNK_PAIRS = 50_000
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer: a cheap, well-distributed 64-bit hash."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def shingle_hashes(texts: List[str], size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Hash the character shingles of each text.
+
+    Returns the hashes of all texts concatenated and, per text, its shingle count.
+    Texts are lowercased; non-empty texts shorter than ``size`` are padded so they
+    still get one shingle.
+    """
+    texts = [text.lower().ljust(size) if text else "" for text in texts]
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    codes = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+    codes = codes.astype(np.uint64)
+
+    counts = np.maximum(lengths - size + 1, 0)
+    text_starts = np.cumsum(lengths) - lengths
+    shingle_starts = np.cumsum(counts) - counts
+    positions = np.repeat(text_starts - shingle_starts, counts) + np.arange(
+        counts.sum()
+    )
+
+    with np.errstate(over="ignore"):
+        hashes = np.zeros(len(positions), dtype=np.uint64)
+        for offset in range(size):
+            hashes = hashes * _SHINGLE_BASE + codes[positions + offset]
+        return _mix(hashes), counts
+
+
+class MinHashLSH:
+    """Banded MinHash over character shingles.
+
+    With ``bands`` bands of ``num_perm // bands`` rows, two records become
+    candidates with probability 1 - (1 - s^rows)^bands for Jaccard similarity s,
+    an S-curve centred near (1 / bands)^(1 / rows).
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 3,
+        max_bucket_size: int = 100,
+        seed: int = 0,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        # Buckets this large are near-universal shingles, not near-duplicates, and
+        # would add a quadratic number of pairs
+        self.max_bucket_size = max_bucket_size
+        # Shingle hashes are already well mixed, so each permutation is a cheap
+        # multiply-add modulo 2^64 with an odd multiplier
+        rng = np.random.default_rng(seed)
+        max_value = np.iinfo(np.uint64).max
+        self.multipliers = rng.integers(
+            0, max_value, num_perm, dtype=np.uint64, endpoint=True
+        ) | np.uint64(1)
+        self.increments = rng.integers(
+            0, max_value, num_perm, dtype=np.uint64, endpoint=True
+        )
+
+    def signatures(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (n, num_perm) signatures and a mask of texts that had shingles."""
+        hashes, counts = shingle_hashes(texts, self.shingle_size)
+        signatures = np.full(
+            (len(texts), self.num_perm), np.iinfo(np.uint64).max, dtype=np.uint64
+        )
+        has_shingles = counts > 0
+        starts = np.cumsum(counts) - counts
+
+        # Records are taken in order of shingle count and padded to a rectangle by
+        # repeating their own shingles, which leaves the minimum unchanged
+        rows = np.flatnonzero(has_shingles)
+        rows = rows[np.argsort(counts[rows], kind="stable")]
+        for first in range(0, len(rows), _CHUNK_RECORDS):
+            chunk = rows[first : first + _CHUNK_RECORDS]
+            width = np.arange(counts[chunk].max())
+            padded = hashes[starts[chunk, None] + width[None, :] % counts[chunk, None]]
+            with np.errstate(over="ignore"):
+                for i in range(self.num_perm):
+                    signatures[chunk, i] = (
+                        padded * self.multipliers[i] + self.increments[i]
+                    ).min(axis=1)
+        return signatures, has_shingles
+
+    def candidate_pairs(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Return candidate pairs as an (m, 2) index array and their similarity."""
+        signatures, has_shingles = self.signatures(texts)
+        rows = np.flatnonzero(has_shingles)
+        band_rows = self.num_perm // self.bands
+
+        with np.errstate(over="ignore"):
+            band_hashes = np.zeros((len(rows), self.bands), dtype=np.uint64)
+            for offset in range(band_rows):
+                band_hashes = _mix(
+                    band_hashes ^ signatures[rows, offset::band_rows][:, : self.bands]
+                )
+
+        buckets = pl.DataFrame(
+            {
+                "row": np.repeat(rows, self.bands),
+                "band": np.tile(np.arange(self.bands, dtype=np.int32), len(rows)),
+                "hash": band_hashes.ravel(),
+            }
+        )
+        sizes = buckets.group_by("band", "hash").len()
+        keep = sizes.filter(pl.col("len").is_between(2, self.max_bucket_size))
+        buckets = buckets.join(keep.select("band", "hash"), on=["band", "hash"])
+        pairs = (
+            buckets.join(buckets, on=["band", "hash"], suffix="_other")
+            .filter(pl.col("row") < pl.col("row_other"))
+            .select("row", "row_other")
+            .unique()
+            .to_numpy()
+        )
+
+        similarity = np.empty(len(pairs), dtype=np.float32)
+        for start in range(0, len(pairs), _CHUNK_PAIRS):
+            chunk = pairs[start : start + _CHUNK_PAIRS]
+            similarity[start : start + _CHUNK_PAIRS] = (
+                signatures[chunk[:, 0]] == signatures[chunk[:, 1]]
+            ).mean(axis=1)
+        return pairs, similarity
+
+
+def top_k_neighbors(
+    pairs: np.ndarray, scores: np.ndarray, n: int, k: int
+) -> List[List[int]]:
+    """Turn scored pairs into the ``k`` best-scoring neighbors of each of ``n`` rows."""
+    neighbors: List[List[int]] = [[] for _ in range(n)]
+    if not len(pairs):
+        return neighbors
+    directed = pl.DataFrame(
+        {
+            "row": np.concatenate([pairs[:, 0], pairs[:, 1]]),
+            "neighbor": np.concatenate([pairs[:, 1], pairs[:, 0]]),
+            "score": np.concatenate([scores, scores]),
+        }
+    )
+    best = (
+        directed.sort(["row", "score"], descending=[False, True])
+        .group_by("row", maintain_order=True)
+        .head(k)
+        .group_by("row", maintain_order=True)
+        .agg(pl.col("neighbor"))
+    )
+    for row, row_neighbors in best.iter_rows():
+        neighbors[row] = row_neighbors
+    return neighbors
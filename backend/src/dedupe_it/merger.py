@@ -1,8 +1,12 @@
+import asyncio
 from typing import List, Dict, Any
 
 from .utils import timing_decorator, with_anthropic_retry
+from .batch import MessageBatchRunner
 from .config import Config
-from .logger import logger
+from .metrics import llm_in_flight, llm_requests, record_llm_usage
+from .tracing import traced
+from .logger import lazy, logger, sampled
 import json
 from .llm import get_anthropic_client
 
@@ -60,6 +64,7 @@ class Merger:
         self.anthropic_client = get_anthropic_client()
 
     # TODO: use structured outputs to ensure valid JSON conforming to the schema
+    @traced
     async def merge_records(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Merge multiple records with the same schema into a single record."""
         if not records:
@@ -67,8 +72,8 @@ class Merger:
         if len(records) == 1:
             return records[0]
 
-        logger.info(f"Merging {len(records)} records")
-        logger.info(f"Records: {json.dumps(records, indent=2)}")
+        logger.debug(f"Merging {len(records)} records")
+        logger.debug("Records: %s", lazy(json.dumps, records, indent=2))
 
         # Get the LLM to merge the records
         user_prompt = self._build_user_prompt(records)
@@ -76,32 +81,88 @@ class Merger:
         merged_record = json.loads(completion)
         return merged_record
 
+    @traced
     @timing_decorator
-    @with_anthropic_retry(max_retries=5, initial_delay=1.0)
+    async def merge_records_bulk(
+        self, groups: List[List[Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
+        """Merge many groups at once through the Message Batches API.
+
+        Groups whose batch request did not succeed, or whose answer is not valid
+        JSON, fall back to a real-time call.
+        """
+        if any(not records for records in groups):
+            raise ValueError("No records provided for merging")
+
+        merged = [records[0] for records in groups]
+        to_merge = [i for i, records in enumerate(groups) if len(records) > 1]
+        logger.info(f"Merging {len(to_merge)} groups in bulk")
+
+        runner = MessageBatchRunner(
+            self.config.batch_state_dir, self.config.batch_poll_interval, merges=True
+        )
+        answers = await runner.run(
+            [self._message_params(self._build_user_prompt(groups[i])) for i in to_merge]
+        )
+        missing = []
+        for i, answer in zip(to_merge, answers):
+            if answer is None:
+                missing.append(i)
+                continue
+            try:
+                merged[i] = json.loads(answer)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Invalid JSON in batch merge answer, retrying: {e}")
+                missing.append(i)
+
+        fallbacks = await asyncio.gather(
+            *[self.merge_records(groups[i]) for i in missing]
+        )
+        for i, merged_record in zip(missing, fallbacks):
+            merged[i] = merged_record
+
+        return merged
+
+    @timing_decorator
+    @with_anthropic_retry(
+        max_retries=5, initial_delay=1.0, call_timeout=60.0, deadline=300.0, hedge=True
+    )
+    @traced
     async def _anthropic_completion_async(self, user_prompt: str) -> str:
+        llm_requests.labels("merger").inc()
+        llm_in_flight.labels("merger").inc()
         try:
             message = await self.anthropic_client.beta.prompt_caching.messages.create(
-                # model="claude-3-5-sonnet-20241022",
-                model="claude-3-haiku-20240307",  # cheaper and faster
-                max_tokens=1024,
-                system=[
-                    {
-                        "type": "text",
-                        "text": system_prompt,
-                        "cache_control": {"type": "ephemeral"},
-                    }
-                ],
-                messages=[
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=0.1,
+                **self._message_params(user_prompt)
             )
+            record_llm_usage("merger", message.usage)
             answer = message.content[0].text.strip()
-            logger.info(f"Anthropic answer: {answer}")
+            if sampled():
+                logger.debug("Anthropic answer: %s", answer)
             return answer
         except Exception as e:
             logger.error(f"Error in anthropic completion: {e}")
             raise
+        finally:
+            llm_in_flight.labels("merger").dec()
+
+    def _message_params(self, user_prompt: str) -> Dict[str, Any]:
+        return {
+            # "model": "claude-3-5-sonnet-20241022",
+            "model": "claude-3-haiku-20240307",  # cheaper and faster
+            "max_tokens": 1024,
+            "system": [
+                {
+                    "type": "text",
+                    "text": system_prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+            "messages": [
+                {"role": "user", "content": user_prompt},
+            ],
+            "temperature": 0.1,
+        }
 
     def _build_user_prompt(self, records: List[Dict[str, Any]]) -> str:
         """Create a prompt for the LLM to merge the records."""
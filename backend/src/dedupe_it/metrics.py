@@ -0,0 +1,296 @@
+"""In-process metrics rendered in the Prometheus text exposition format."""
+
+import math
+import threading
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .budget import current_budget
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)  # fmt: skip
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric") -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        metrics_registry: MetricsRegistry = registry,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        metrics_registry.register(self)
+
+    def labels(self, *values: str, **kwvalues: str):
+        if kwvalues:
+            values = tuple(kwvalues[name] for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        with self._lock:
+            if key not in self._children:
+                self._children[key] = self._new_child()
+            return self._children[key]
+
+    def totals(self) -> Dict[Tuple[str, ...], float]:
+        """Current value per label set; for a histogram, the sum observed."""
+        with self._lock:
+            children = list(self._children.items())
+        return {
+            key: value
+            for key, child in children
+            for suffix, _, value in self._samples(child)
+            if suffix in ("", "_sum")
+        }
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def _samples(self, child: Any) -> List[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def collect(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            labels = dict(zip(self.labelnames, key))
+            for suffix, extra, value in self._samples(child):
+                lines.append(
+                    f"{self.name}{suffix}{_format_labels({**labels, **extra})} "
+                    f"{_format_value(value)}"
+                )
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def _samples(self, child: _Value):
+        return [("", {}, child.value)]
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def _samples(self, child: _Value):
+        return [("", {}, child.value)]
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(*args, **kwargs)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def _samples(self, child: _HistogramValue):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(child.buckets, child.counts):
+            cumulative += count
+            samples.append(("_bucket", {"le": _format_value(bound)}, cumulative))
+        samples.append(("_sum", {}, child.sum))
+        samples.append(("_count", {}, child.count))
+        return samples
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+
+stage_duration = Histogram(
+    "dedupe_stage_duration_seconds",
+    "Time spent in each pipeline stage",
+    ["stage"],
+)
+function_duration = Histogram(
+    "dedupe_function_duration_seconds",
+    "Time spent in functions decorated with timing_decorator",
+    ["function"],
+)
+llm_requests = Counter("dedupe_llm_requests_total", "LLM requests sent", ["component"])
+llm_tokens = Counter(
+    "dedupe_llm_tokens_total", "LLM tokens consumed", ["component", "kind"]
+)
+llm_retries = Counter(
+    "dedupe_llm_retries_total", "LLM request retries", ["component", "reason"]
+)
+llm_rate_limit_hits = Counter(
+    "dedupe_llm_rate_limit_hits_total", "LLM rate limit responses", ["component"]
+)
+llm_cache_hits = Counter(
+    "dedupe_llm_cache_hits_total",
+    "LLM responses that read the system prompt from the prompt cache",
+    ["component"],
+)
+llm_hedges = Counter(
+    "dedupe_llm_hedged_requests_total", "Duplicate requests sent by hedging"
+)
+llm_in_flight = Gauge(
+    "dedupe_llm_in_flight_requests", "LLM requests awaiting a response", ["component"]
+)
+compare_tier_answers = Counter(
+    "dedupe_compare_tier_answers_total",
+    "Comparator answers per cascade model; unsure answers are escalated",
+    ["model", "answer"],
+)
+compare_tier_duration = Histogram(
+    "dedupe_compare_tier_seconds",
+    "Time for a cascade model to answer a pair, retries included",
+    ["model"],
+)
+rerank_pairs = Counter(
+    "dedupe_rerank_pairs_total",
+    "Candidate pairs scored by the rerank model, by what became of them",
+    ["outcome"],
+)
+classifier_pairs = Counter(
+    "dedupe_classifier_pairs_total",
+    "Candidate pairs the pair classifier answered, deferred to the LLM or had audited",
+    ["outcome"],
+)
+classifier_agreement = Gauge(
+    "dedupe_classifier_heldout_agreement",
+    "Agreement of the pair classifier's confident answers with held-out LLM verdicts",
+)
+embedding_batch_size = Histogram(
+    "dedupe_embedding_batch_size",
+    "Texts embedded per forward pass of the shared embedding scheduler",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+queue_depth = Gauge(
+    "dedupe_queue_depth", "Work items waiting in each pipeline queue", ["queue"]
+)
+startup_seconds = Gauge(
+    "dedupe_startup_seconds",
+    "Time spent importing and initializing, per startup phase",
+    ["phase"],
+)
+records_processed = Counter(
+    "dedupe_records_processed_total", "Records processed by dedupe jobs"
+)
+records_per_second = Gauge(
+    "dedupe_records_per_second", "Throughput of the most recently finished job"
+)
+
+
+def record_llm_usage(component: str, usage: Any, merge: bool = False) -> None:
+    """Count the tokens reported in a Messages API ``usage`` block.
+
+    The merger's calls, and others with ``merge``, are charged to the running
+    job's budget as merges.
+    """
+    for kind in (
+        "input_tokens",
+        "output_tokens",
+        "cache_read_input_tokens",
+        "cache_creation_input_tokens",
+    ):
+        tokens = getattr(usage, kind, None) or 0
+        if tokens:
+            llm_tokens.labels(component, kind.removesuffix("_tokens")).inc(tokens)
+    if getattr(usage, "cache_read_input_tokens", None):
+        llm_cache_hits.labels(component).inc()
+    budget = current_budget()
+    if budget is not None:
+        budget.charge(usage, merge=merge or component == "merger")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 
 class Record(BaseModel):
@@ -12,3 +12,12 @@ class Record(BaseModel):
     @classmethod
     def from_dict(cls, data: Dict) -> "Record":
         return cls(**data)
+
+
+class RecordChanges(BaseModel):
+    upserts: List[Record] = Field(
+        default_factory=list, description="Records to add, or to replace by id"
+    )
+    deletes: List[str] = Field(
+        default_factory=list, description="Ids of records to remove"
+    )
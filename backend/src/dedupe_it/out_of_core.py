@@ -0,0 +1,554 @@
+"""Out-of-core deduplication of Parquet datasets larger than memory.
+
+Records are read from Parquet and embedded one chunk at a time. Record data
+goes to memory-mapped Arrow files and embeddings to memory-mapped ``.npy``
+shards in a work directory, so only the rows a prompt needs are paged in.
+Union-find state is a memory-mapped parent array, updated pair by pair. Neighbor
+search is an inverted-file search: embeddings are clustered with k-means, and
+each cluster is searched exactly against its own members plus the records near
+its boundary. Only one cluster's vectors are in memory at a time. Groups are
+collected in a file-backed DuckDB database that spills past its memory limit,
+then streamed out, merged and written to the output Parquet file in chunks.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import duckdb
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .config import Config
+from .grouper import Grouper
+from .logger import logger
+from .merger import Merger
+from .record_store import RecordFrame
+from .service import GroupResult, resolve_match_columns
+from .sharding import kmeans
+from .tables import records_from_table, result_table
+from .tracing import traced
+from .utils import Timer
+from .vector_store import encode_records, get_embedding_model
+
+# Query rows times candidate rows scored at once during neighbor search
+SCORE_BLOCK_ENTRIES = 1 << 24
+# Centroids are fitted on this many sampled embeddings per cluster
+KMEANS_SAMPLES_PER_CLUSTER = 50
+# Groups merged, and written to the output, at once
+MERGE_CHUNK_SIZE = 1000
+# Rows whose roots are looked up at once when groups are collected
+ROOT_BLOCK_SIZE = 1 << 20
+
+
+def _locate(
+    offsets: List[int], row_ids: np.ndarray
+) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+    """(shard index, positions in ``row_ids``, rows within the shard) for every
+    shard that ``row_ids`` touch."""
+    shard_indices = np.searchsorted(offsets, row_ids, side="right") - 1
+    located = []
+    for shard_index in np.unique(shard_indices):
+        positions = np.flatnonzero(shard_indices == shard_index)
+        located.append(
+            (shard_index, positions, row_ids[positions] - offsets[shard_index])
+        )
+    return located
+
+
+class EmbeddingShards:
+    """Embeddings appended chunk by chunk to .npy files and read back mapped."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.shards: List[np.ndarray] = []
+        self.offsets: List[int] = []
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, embeddings: np.ndarray) -> None:
+        path = os.path.join(self.directory, f"embeddings-{len(self.shards):05d}.npy")
+        np.save(path, np.asarray(embeddings, dtype=np.float32))
+        self.shards.append(np.load(path, mmap_mode="r"))
+        self.offsets.append(self.size)
+        self.size += len(embeddings)
+
+    def take(self, row_ids: np.ndarray) -> np.ndarray:
+        """Read the embeddings of ``row_ids`` into memory, in the order given."""
+        result = np.empty((len(row_ids), self.shards[0].shape[1]), dtype=np.float32)
+        for shard_index, positions, rows in _locate(self.offsets, row_ids):
+            result[positions] = self.shards[shard_index][rows]
+        return result
+
+
+class RecordShards:
+    """Record ids and data appended chunk by chunk to Arrow files and read back
+    mapped, so looking up a few rows does not load their chunk."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.ids: List[pa.Table] = []
+        self.data: List[pa.Table] = []
+        self.offsets: List[int] = []
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, records: RecordFrame) -> None:
+        shard = len(self.data)
+        self.ids.append(self._write(f"ids-{shard:05d}", pa.table({"id": records.ids})))
+        self.data.append(self._write(f"records-{shard:05d}", records.frame.to_arrow()))
+        self.offsets.append(self.size)
+        self.size += len(records)
+
+    def _write(self, name: str, table: pa.Table) -> pa.Table:
+        path = os.path.join(self.directory, f"{name}.arrow")
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as f:
+            f.write_table(table)
+        return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+    def get_many(self, row_ids: List[int] | np.ndarray) -> List[Dict[str, Any]]:
+        """Read the data of ``row_ids``, in the order given."""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        results: List[Dict[str, Any]] = [{}] * len(row_ids)
+        for shard_index, positions, rows in _locate(self.offsets, row_ids):
+            table = self.data[shard_index]
+            if not table.num_columns:
+                continue
+            for position, data in zip(
+                positions, pl.from_arrow(table.take(rows)).rows(named=True)
+            ):
+                results[position] = data
+        return results
+
+    def ids_of(self, row_ids: List[int] | np.ndarray) -> List[str]:
+        """Read the record ids of ``row_ids``, in the order given."""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        results: List[str] = [""] * len(row_ids)
+        for shard_index, positions, rows in _locate(self.offsets, row_ids):
+            for position, record_id in zip(
+                positions, self.ids[shard_index]["id"].take(rows).to_pylist()
+            ):
+                results[position] = record_id
+        return results
+
+
+class ParentArray:
+    """Union-find over row ids in memory-mapped parent and rank arrays.
+
+    A union touches only the rows on the paths to its two roots, so a round of
+    matches costs the same however many records there are.
+    """
+
+    def __init__(self, directory: str, size: int):
+        self.parent = np.lib.format.open_memmap(
+            os.path.join(directory, "parent.npy"),
+            mode="w+",
+            dtype=np.int64,
+            shape=(size,),
+        )
+        for start in range(0, size, ROOT_BLOCK_SIZE):
+            stop = min(start + ROOT_BLOCK_SIZE, size)
+            self.parent[start:stop] = np.arange(start, stop)
+        # Ranks start at zero, as a new file does
+        self.rank = np.lib.format.open_memmap(
+            os.path.join(directory, "rank.npy"),
+            mode="w+",
+            dtype=np.uint8,
+            shape=(size,),
+        )
+
+    def find(self, row_id: int) -> int:
+        parent = self.parent
+        while parent[row_id] != row_id:
+            parent[row_id] = parent[parent[row_id]]
+            row_id = int(parent[row_id])
+        return row_id
+
+    def union(self, row_pairs: List[Tuple[int, int]]) -> None:
+        for row_id1, row_id2 in row_pairs:
+            root1, root2 = self.find(row_id1), self.find(row_id2)
+            if root1 == root2:
+                continue
+            # Attach the shorter tree under the taller one
+            if self.rank[root1] < self.rank[root2]:
+                root1, root2 = root2, root1
+            self.parent[root2] = root1
+            if self.rank[root1] == self.rank[root2]:
+                self.rank[root1] += 1
+
+    def roots(self, start: int, stop: int) -> np.ndarray:
+        """The root of every row from ``start`` up to ``stop``."""
+        roots = np.array(self.parent[start:stop])
+        while True:
+            parents = self.parent[roots]
+            if (parents == roots).all():
+                return roots
+            roots = parents
+
+
+class DiskStore:
+    """What the grouper needs of a VectorStore, kept on disk under ``directory``:
+    record data, embeddings and union-find state."""
+
+    def __init__(self, directory: str, config: Config):
+        self.directory = directory
+        self.embedding_model = get_embedding_model(config.embedding_model_name)
+        self.records = RecordShards(directory)
+        self.embeddings = EmbeddingShards(directory)
+        self.union_find: ParentArray | None = None
+        self.con = duckdb.connect(os.path.join(directory, "store.duckdb"))
+        if config.duckdb_memory_limit is not None:
+            self.con.execute(f"SET memory_limit = '{config.duckdb_memory_limit}'")
+        self.con.execute(f"SET temp_directory = '{os.path.join(directory, 'spill')}'")
+        # Record ids, only to reject duplicates
+        self.con.execute("CREATE TABLE record_ids (id VARCHAR NOT NULL)")
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def close(self) -> None:
+        self.con.close()
+
+    def add(self, records: RecordFrame, embeddings: np.ndarray) -> None:
+        self.con.register("ids_df", pa.table({"id": records.ids}))
+        self.con.execute("INSERT INTO record_ids SELECT id FROM ids_df")
+        self.records.append(records)
+        self.embeddings.append(embeddings)
+
+    def check_ids(self) -> None:
+        duplicate = self.con.execute(
+            "SELECT id FROM record_ids GROUP BY id HAVING count(*) > 1 LIMIT 1"
+        ).fetchone()
+        if duplicate is not None:
+            raise ValueError(f"Duplicate record id: {duplicate[0]}")
+
+    async def batch_union(self, row_pairs: List[Tuple[int, int]]) -> None:
+        if self.union_find is None:
+            self.union_find = ParentArray(self.directory, len(self))
+        await asyncio.to_thread(self.union_find.union, row_pairs)
+
+    async def pair_similarities(
+        self, row_pairs: List[Tuple[int, int]]
+    ) -> List[float | None]:
+        """Cosine similarity of each pair's embeddings."""
+        if not row_pairs:
+            return []
+        pairs = np.array(row_pairs, dtype=np.int64).reshape(-1, 2)
+        return np.einsum(
+            "ij,ij->i",
+            self.embeddings.take(pairs[:, 0]),
+            self.embeddings.take(pairs[:, 1]),
+        ).tolist()
+
+    async def group_row_ids(
+        self, chunk_size: int
+    ) -> AsyncIterator[List[Tuple[int, List[int]]]]:
+        """(group row id, member row ids) of every group of more than one record,
+        ``chunk_size`` groups at a time."""
+        if self.union_find is None:
+            return
+
+        def collect() -> pa.RecordBatchReader:
+            self.con.execute(
+                """
+                CREATE TABLE members (
+                    row_id BIGINT NOT NULL,
+                    group_id BIGINT NOT NULL
+                )
+                """
+            )
+            for start in range(0, len(self), ROOT_BLOCK_SIZE):
+                stop = min(start + ROOT_BLOCK_SIZE, len(self))
+                rows = np.arange(start, stop)
+                roots = self.union_find.roots(start, stop)
+                grouped = roots != rows
+                self.con.register(
+                    "members_df",
+                    pa.table({"row_id": rows[grouped], "group_id": roots[grouped]}),
+                )
+                self.con.execute("INSERT INTO members SELECT * FROM members_df")
+            # Every root is a member of its own group
+            self.con.execute(
+                "INSERT INTO members SELECT DISTINCT group_id, group_id FROM members"
+            )
+            return self.con.execute(
+                """
+                SELECT group_id, list(row_id ORDER BY row_id) AS row_ids
+                FROM members
+                GROUP BY group_id
+                ORDER BY group_id
+                """
+            ).fetch_record_batch(chunk_size)
+
+        def read(reader: pa.RecordBatchReader) -> pa.RecordBatch | None:
+            # StopIteration cannot cross from a thread into a coroutine
+            try:
+                return reader.read_next_batch()
+            except StopIteration:
+                return None
+
+        reader = await asyncio.to_thread(collect)
+        while (batch := await asyncio.to_thread(read, reader)) is not None:
+            yield list(zip(batch["group_id"].to_pylist(), batch["row_ids"].to_pylist()))
+
+
+def assign_clusters(
+    shards: EmbeddingShards, centroids: np.ndarray, margin: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Assign each embedding its nearest centroid, and a second one if it sits
+    within ``margin`` of the boundary between them (-1 otherwise)."""
+    primary = np.empty(len(shards), dtype=np.int32)
+    secondary = np.full(len(shards), -1, dtype=np.int32)
+    block = max(1, SCORE_BLOCK_ENTRIES // len(centroids))
+    for offset, shard in zip(shards.offsets, shards.shards):
+        for start in range(0, len(shard), block):
+            rows = slice(offset + start, offset + min(start + block, len(shard)))
+            similarities = np.asarray(shard[start : start + block]) @ centroids.T
+            primary[rows] = np.argmax(similarities, axis=1)
+            if len(centroids) < 2:
+                continue
+            top_two = np.argpartition(similarities, -2, axis=1)[:, -2:]
+            top_scores = np.take_along_axis(similarities, top_two, axis=1)
+            second = np.where(
+                top_two[:, 0] == primary[rows], top_two[:, 1], top_two[:, 0]
+            )
+            near = np.abs(top_scores[:, 1] - top_scores[:, 0]) < margin
+            secondary[rows] = np.where(near, second, -1)
+    return primary, secondary
+
+
+def search_cluster(
+    shards: EmbeddingShards, queries: np.ndarray, candidates: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Exact top-``k`` search of ``queries`` among ``candidates``.
+
+    Both are sorted row ids and every query is also a candidate. Returns an
+    (m, 2) array of (query, neighbor) row pairs, each pair's neighbor rank and
+    each pair's cosine similarity.
+    """
+    k = min(k, len(candidates) - 1)
+    if k <= 0:
+        return (
+            np.empty((0, 2), dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.float32),
+        )
+    vectors = shards.take(candidates)
+    positions = np.searchsorted(candidates, queries)
+    block = max(1, SCORE_BLOCK_ENTRIES // len(candidates))
+    neighbors = []
+    similarities = []
+    for start in range(0, len(positions), block):
+        query_positions = positions[start : start + block]
+        scores = vectors[query_positions] @ vectors.T
+        scores[np.arange(len(query_positions)), query_positions] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        neighbors.append(candidates[np.take_along_axis(top, order, axis=1)])
+        similarities.append(np.take_along_axis(top_scores, order, axis=1))
+    neighbors = np.concatenate(neighbors)
+    pairs = np.column_stack([np.repeat(queries, k), neighbors.ravel()])
+    return (
+        pairs,
+        np.tile(np.arange(k), len(queries)),
+        np.concatenate(similarities).ravel(),
+    )
+
+
+def _cluster_members(labels: np.ndarray, clusters: int) -> List[np.ndarray]:
+    """Sorted row ids per cluster label."""
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(clusters + 1))
+    return [order[bounds[c] : bounds[c + 1]] for c in range(clusters)]
+
+
+@traced
+async def dedupe_parquet(
+    input_path: str,
+    output_path: str,
+    config: Config | None = None,
+    id_column: str = "id",
+) -> int:
+    """Dedupe a Parquet file in bounded memory and write the groups to Parquet.
+
+    The output has the layout of ``POST /dedupe/table`` results: one row per
+    grouped record with its ``record_id``, ``group_id`` and ``merged`` record.
+    Returns the number of groups.
+    """
+    config = config or Config()
+    if config.work_dir is not None:
+        os.makedirs(config.work_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="dedupe-", dir=config.work_dir)
+    try:
+        store = DiskStore(work_dir, config)
+        try:
+            # Read and embed chunk by chunk; row ids follow file order, so they
+            # index the record and embedding shards directly
+            schema = None
+            parquet = pq.ParquetFile(input_path)
+            for table_batch in parquet.iter_batches(batch_size=config.chunk_size):
+                records = records_from_table(
+                    pa.Table.from_batches([table_batch]), id_column
+                )
+                if schema is None:
+                    # Columns to match on are profiled from the first chunk
+                    config = resolve_match_columns(records, config, None)
+                    schema = records.frame.schema
+                with Timer("embedding"):
+                    embeddings = encode_records(
+                        store.embedding_model, records, config.match_columns
+                    )
+                await asyncio.to_thread(store.add, records, embeddings)
+                logger.info(f"Embedded {len(store)} records")
+            if not len(store):
+                schema = pl.Schema(
+                    {
+                        name: pl.String
+                        for name in parquet.schema_arrow.names
+                        if name != id_column
+                    }
+                )
+
+            if len(store):
+                await asyncio.to_thread(store.check_ids)
+                await _match(store.embeddings, Grouper(config, store), config)
+            return await _merge_and_write(store, config, output_path, schema)
+        finally:
+            store.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def _match(shards: EmbeddingShards, grouper: Grouper, config: Config) -> None:
+    """Find neighbors cluster by cluster and compare them in bounded rounds."""
+    clusters = max(1, len(shards) // config.out_of_core_cluster_size)
+    with Timer("neighbor_search"):
+        rng = np.random.default_rng(0)
+        sample_size = min(len(shards), clusters * KMEANS_SAMPLES_PER_CLUSTER)
+        sample = shards.take(np.sort(rng.choice(len(shards), sample_size, False)))
+        centroids = kmeans(sample, min(clusters, sample_size), sample_size=sample_size)
+        primary, secondary = assign_clusters(
+            shards, centroids, config.shard_boundary_margin
+        )
+    logger.info(
+        f"Searching {len(shards)} records in {len(centroids)} clusters, "
+        f"{int((secondary >= 0).sum())} near cluster boundaries"
+    )
+
+    queries_by_cluster = _cluster_members(primary, len(centroids))
+    boundary_rows = np.flatnonzero(secondary >= 0)
+    boundary_by_cluster = [
+        boundary_rows[members]
+        for members in _cluster_members(secondary[boundary_rows], len(centroids))
+    ]
+
+    pending_pairs: List[np.ndarray] = []
+    pending_ranks: List[np.ndarray] = []
+    pending_similarities: List[np.ndarray] = []
+    pending = 0
+    for cluster, queries in enumerate(queries_by_cluster):
+        if len(queries):
+            with Timer("neighbor_search"):
+                pairs, ranks, similarities = search_cluster(
+                    shards,
+                    queries,
+                    np.union1d(queries, boundary_by_cluster[cluster]),
+                    config.max_neighbors,
+                )
+            pending_pairs.append(pairs)
+            pending_ranks.append(ranks)
+            pending_similarities.append(similarities)
+            pending += len(pairs)
+        if pending and (
+            pending >= config.chunk_size or cluster == len(queries_by_cluster) - 1
+        ):
+            await grouper.compare_and_union(
+                [tuple(pair) for pair in np.concatenate(pending_pairs).tolist()],
+                np.concatenate(pending_ranks).tolist(),
+                np.concatenate(pending_similarities).tolist(),
+            )
+            pending_pairs, pending_ranks, pending_similarities = [], [], []
+            pending = 0
+
+
+async def _merge_and_write(
+    store: DiskStore, config: Config, output_path: str, schema: pl.Schema
+) -> int:
+    """Merge groups chunk by chunk, appending each chunk to the output file."""
+    merger = Merger(config)
+    in_flight = asyncio.Semaphore(config.llm_concurrency)
+
+    async def merge(group: List[Dict]) -> Dict:
+        async with in_flight:
+            return await merger.merge_records(group)
+
+    groups = 0
+    writer = None
+    try:
+        async for chunk in store.group_row_ids(MERGE_CHUNK_SIZE):
+            data = [store.records.get_many(row_ids) for _, row_ids in chunk]
+            async with Timer("merge"):
+                if not data:
+                    merged = []
+                elif config.bulk_mode:
+                    merged = await merger.merge_records_bulk(data)
+                else:
+                    merged = await asyncio.gather(*[merge(group) for group in data])
+            ids = iter(
+                store.records.ids_of(
+                    [row_id for _, row_ids in chunk for row_id in row_ids]
+                )
+            )
+            table = result_table(
+                [
+                    GroupResult(
+                        group_id=store.records.ids_of([group_id])[0],
+                        merged_data=merged_data,
+                        record_ids=[next(ids) for _ in row_ids],
+                    )
+                    for (group_id, row_ids), merged_data in zip(chunk, merged)
+                ],
+                schema,
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+            groups += len(chunk)
+            logger.info(f"Merged {groups} groups")
+        if writer is None:
+            table = result_table([], schema)
+            writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return groups
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="Parquet file of records")
+    parser.add_argument("output", help="Parquet file to write groups to")
+    parser.add_argument("--id-column", default="id")
+    parser.add_argument("--memory-limit", help="DuckDB memory limit, e.g. 4GB")
+    parser.add_argument("--work-dir", help="Directory for embeddings and spills")
+    args = parser.parse_args()
+    config = Config(duckdb_memory_limit=args.memory_limit, work_dir=args.work_dir)
+    groups = asyncio.run(
+        dedupe_parquet(args.input, args.output, config, args.id_column)
+    )
+    print(f"Wrote {groups} groups to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
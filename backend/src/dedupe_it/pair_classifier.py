@@ -0,0 +1,293 @@
+"""A local pair classifier that learns from the comparator's verdicts.
+
+Every LLM verdict is logged with cheap features of its pair: the embedding
+similarity and, per match column, whether both records have a value, whether
+the values are equal and how alike they are. Pairs without vectors, as under
+LSH candidate generation, have no similarity; they are logged apart and get a
+model of their own, so a model never sees features it was not trained on. Logs
+live under ``pair_classifier_dir``, one per set of match columns and kind of
+pair, so a recurring data source keeps accumulating examples across jobs.
+
+Each time enough new verdicts have come in, a logistic regression is refit on
+four fifths of them and checked against the rest. Once its confident answers
+agree with those held-out verdicts often enough, it answers the pairs it is
+confident about and leaves the others to the LLM. A share of its answers is
+still sent to the LLM, and if those audits disagree too often it stops
+answering for the rest of the job.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .config import Config
+from .logger import logger
+from .metrics import classifier_agreement
+
+# Every HOLD_OUT_EVERY-th logged verdict is held out from training
+HOLD_OUT_EVERY = 5
+# Confident answers on held-out verdicts needed before the classifier may answer
+MIN_HELD_OUT_ANSWERS = 100
+# The classifier is switched off as soon as its audits disagree with the LLM
+# more often than the agreement threshold allows over this many audits
+MIN_AUDITS = 50
+# Ridge penalty and Newton steps of the logistic regression fit
+L2_PENALTY = 1e-2
+FIT_ITERATIONS = 25
+_SHINGLE_SIZE = 3
+
+
+def pair_features(
+    data1: Dict[str, Any],
+    data2: Dict[str, Any],
+    columns: Sequence[str],
+    similarity: float | None,
+) -> List[float]:
+    """Features of a pair of records: its similarity, if it has one, then three
+    per column. The same columns and kind of pair give the same layout."""
+    features = [] if similarity is None else [similarity]
+    for name in columns:
+        value1 = _normalize(data1.get(name))
+        value2 = _normalize(data2.get(name))
+        both = bool(value1 and value2)
+        features += [
+            float(both),
+            float(both and value1 == value2),
+            _jaccard(value1, value2) if both else 0.0,
+        ]
+    return features
+
+
+def _normalize(value: Any) -> str:
+    return "" if value is None else " ".join(str(value).lower().split())
+
+
+def _shingles(text: str) -> set[str]:
+    return {
+        text[i : i + _SHINGLE_SIZE]
+        for i in range(max(1, len(text) - _SHINGLE_SIZE + 1))
+    }
+
+
+def _jaccard(text1: str, text2: str) -> float:
+    shingles1, shingles2 = _shingles(text1), _shingles(text2)
+    return len(shingles1 & shingles2) / len(shingles1 | shingles2)
+
+
+def fit_logistic(features: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """Weights of a ridge-penalized logistic regression, bias last.
+
+    There are few features, so Newton's method converges in a handful of steps.
+    """
+    x = np.hstack([features, np.ones((len(features), 1))])
+    weights = np.zeros(x.shape[1])
+    penalty = L2_PENALTY * np.eye(x.shape[1])
+    penalty[-1, -1] = 0.0
+    for _ in range(FIT_ITERATIONS):
+        p = _sigmoid(x @ weights)
+        gradient = x.T @ (p - labels) + penalty @ weights
+        hessian = (x * (p * (1 - p))[:, None]).T @ x + penalty
+        step = np.linalg.solve(hessian + 1e-9 * np.eye(x.shape[1]), gradient)
+        weights -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    return weights
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-np.clip(z, -30, 30)))
+
+
+def _parse_verdict(line: bytes, width: int) -> List[float] | None:
+    """A logged verdict as ``width`` features and the label, or None if the line
+    is malformed, e.g. cut short by a crash."""
+    if not line.endswith(b"\n"):
+        return None
+    try:
+        row = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(row, list) or len(row) != width + 1:
+        return None
+    if not all(isinstance(value, (int, float)) for value in row):
+        return None
+    return [float(value) for value in row]
+
+
+@dataclass
+class ClassifierModel:
+    # Logistic regression weights over standardized features, bias last
+    weights: List[float]
+    mean: List[float]
+    scale: List[float]
+    # Verdicts logged when the model was trained
+    examples: int
+    # Held-out verdicts the model was confident about, and the share of them it
+    # got right
+    held_out_answers: int
+    held_out_agreement: float
+    # Share of held-out pairs the model was confident about
+    held_out_coverage: float
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Probability that each pair is a match."""
+        x = (features - np.asarray(self.mean)) / np.asarray(self.scale)
+        weights = np.asarray(self.weights)
+        return _sigmoid(x @ weights[:-1] + weights[-1])
+
+
+class PairClassifier:
+    """Verdict log and model for pairs compared on one set of columns, with or
+    without an embedding similarity."""
+
+    def __init__(
+        self, config: Config, columns: Sequence[str], with_similarity: bool = True
+    ):
+        self.config = config
+        self.columns = list(columns)
+        self.with_similarity = with_similarity
+        # Features per pair
+        self.width = int(with_similarity) + 3 * len(self.columns)
+        layout = ["similarity"] if with_similarity else []
+        layout += self.columns
+        key = hashlib.sha256("\0".join(layout).encode()).hexdigest()[:16]
+        self.path = os.path.join(config.pair_classifier_dir, key)
+        os.makedirs(self.path, exist_ok=True)
+        columns_path = os.path.join(self.path, "columns.json")
+        if not os.path.exists(columns_path):
+            with open(columns_path, "w") as f:
+                json.dump(
+                    {"columns": self.columns, "with_similarity": with_similarity}, f
+                )
+        self.verdicts_path = os.path.join(self.path, "verdicts.jsonl")
+        self.model_path = os.path.join(self.path, "model.json")
+
+        self.model: ClassifierModel | None = None
+        if os.path.exists(self.model_path):
+            with open(self.model_path) as f:
+                self.model = ClassifierModel(**json.load(f))
+            if len(self.model.weights) != self.width + 1:
+                logger.warning(
+                    f"Ignoring pair classifier of another layout in {self.path}"
+                )
+                self.model = None
+        self.examples = 0
+        if os.path.exists(self.verdicts_path):
+            with open(self.verdicts_path, "rb") as f:
+                self.examples = sum(1 for _ in f)
+        self.audits = 0
+        self.audits_agreed = 0
+        self.disabled = False
+        self.rng = np.random.default_rng()
+        if self.model is not None:
+            classifier_agreement.set(self.model.held_out_agreement)
+
+    @property
+    def active(self) -> bool:
+        """Whether the model is trusted to answer pairs."""
+        return (
+            self.model is not None
+            and not self.disabled
+            and self.model.held_out_answers >= MIN_HELD_OUT_ANSWERS
+            and self.model.held_out_agreement >= self.config.classifier_min_agreement
+        )
+
+    def decide(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Match probabilities, and which pairs the model may answer itself."""
+        if not self.active or not len(features):
+            return np.full(len(features), 0.5), np.zeros(len(features), dtype=bool)
+        probabilities = self.model.predict(features)
+        confidence = self.config.classifier_confidence
+        confident = (probabilities >= confidence) | (probabilities <= 1 - confidence)
+        return probabilities, confident
+
+    def audit(self, predicted: bool, verdict: bool) -> None:
+        """Check an answer of the model against the LLM's verdict for the pair."""
+        self.audits += 1
+        self.audits_agreed += predicted == verdict
+        agreement = self.audits_agreed / self.audits
+        allowed = (1 - self.config.classifier_min_agreement) * max(
+            self.audits, MIN_AUDITS
+        )
+        if not self.disabled and self.audits - self.audits_agreed > allowed:
+            self.disabled = True
+            logger.warning(
+                f"Pair classifier agreed with {agreement:.1%} of {self.audits} "
+                "audited LLM verdicts; leaving the remaining pairs to the LLM"
+            )
+
+    def log(self, features: np.ndarray, verdicts: Sequence[bool]) -> None:
+        """Append LLM verdicts with the features of their pairs."""
+        lines = "".join(
+            json.dumps([*map(float, row), bool(verdict)]) + "\n"
+            for row, verdict in zip(features.tolist(), verdicts)
+        )
+        with open(self.verdicts_path, "a") as f:
+            f.write(lines)
+        self.examples += len(verdicts)
+
+    def needs_training(self) -> bool:
+        trained_on = self.model.examples if self.model is not None else 0
+        return self.examples - trained_on >= self.config.classifier_retrain_examples
+
+    def train(self) -> None:
+        """Refit the model on the logged verdicts and check it on held-out ones."""
+        rows = []
+        skipped = 0
+        with open(self.verdicts_path, "rb") as f:
+            for line in f:
+                row = _parse_verdict(line, self.width)
+                if row is None:
+                    skipped += 1
+                else:
+                    rows.append(row)
+        if skipped:
+            logger.warning(f"Skipped {skipped} malformed lines of {self.verdicts_path}")
+        data = np.array(rows, dtype=np.float64).reshape(-1, self.width + 1)
+        features, labels = data[:, :-1], data[:, -1]
+        held_out = np.arange(len(data)) % HOLD_OUT_EVERY == 0
+        if labels[~held_out].min(initial=1) == labels[~held_out].max(initial=0):
+            logger.info("Pair classifier needs both matches and non-matches to train")
+            return
+
+        train = features[~held_out]
+        mean = train.mean(axis=0)
+        scale = train.std(axis=0)
+        scale[scale == 0] = 1.0
+        weights = fit_logistic((train - mean) / scale, labels[~held_out])
+        model = ClassifierModel(
+            weights=weights.tolist(),
+            mean=mean.tolist(),
+            scale=scale.tolist(),
+            examples=self.examples,
+            held_out_answers=0,
+            held_out_agreement=0.0,
+            held_out_coverage=0.0,
+        )
+        probabilities = model.predict(features[held_out])
+        confidence = self.config.classifier_confidence
+        confident = (probabilities >= confidence) | (probabilities <= 1 - confidence)
+        if confident.any():
+            answers = probabilities[confident] >= 0.5
+            model.held_out_answers = int(confident.sum())
+            model.held_out_agreement = float(
+                (answers == labels[held_out][confident]).mean()
+            )
+            model.held_out_coverage = float(confident.mean())
+
+        tmp_path = f"{self.model_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(model), f)
+        os.replace(tmp_path, self.model_path)
+        self.model = model
+        classifier_agreement.set(model.held_out_agreement)
+        logger.info(
+            f"Trained pair classifier on {int((~held_out).sum())} verdicts: "
+            f"confident on {model.held_out_coverage:.1%} of held-out pairs, "
+            f"agreeing on {model.held_out_agreement:.1%} of those "
+            f"({'active' if self.active else 'not trusted yet'})"
+        )
@@ -0,0 +1,137 @@
+"""Schema profiling: which columns can tell records apart.
+
+Wide exports carry many columns that say little about which entity a record
+is: timestamps, flags, campaign tags, constants and mostly empty fields.
+Embedding them dilutes similarity, and showing them to the comparator costs
+prompt tokens. The profile measures each column's null rate, how often two
+random records agree on it, and its value lengths on a sample of the records,
+and keeps the columns likely to discriminate between entities.
+"""
+
+from dataclasses import dataclass
+from typing import List, Sequence
+
+import numpy as np
+import polars as pl
+
+from .logger import logger
+from .models import Record
+from .record_store import RecordFrame, take_records
+
+# Below this many records the statistics say too little to drop anything
+MIN_PROFILE_RECORDS = 100
+# Records profiled, sampled evenly from larger inputs
+PROFILE_SAMPLE_SIZE = 10_000
+# Columns null or blank in more records than this are dropped
+MAX_NULL_RATE = 0.95
+# Columns on which more random pairs of records agree than this are dropped, as
+# with flags, constants and campaign tags; a column of ten equally common values
+# has an agreement of 0.1
+MAX_AGREEMENT = 0.2
+# Columns holding timestamps in more of their values than this are dropped; they
+# differ between copies of a record more than they identify it
+MIN_TIMESTAMP_SHARE = 0.9
+_TIMESTAMP = (
+    r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?$"
+)
+
+
+@dataclass
+class ColumnProfile:
+    name: str
+    null_rate: float
+    # Chance that two random records with a value share it
+    agreement: float
+    timestamp_share: float
+    mean_length: float
+    # Why the column is left out of matching, or None if it is kept
+    dropped: str | None = None
+
+
+def profile_columns(
+    records: Sequence[Record], exclude_prefix: str
+) -> List[ColumnProfile]:
+    """Profile each column of ``records`` not starting with ``exclude_prefix``."""
+    if len(records) > PROFILE_SAMPLE_SIZE:
+        positions = np.linspace(0, len(records) - 1, PROFILE_SAMPLE_SIZE).astype(int)
+        records = take_records(records, positions.tolist())
+    frame = _string_frame(records, exclude_prefix)
+
+    profiles = []
+    for name in frame.columns:
+        values = frame[name].str.strip_chars().replace("", None).drop_nulls()
+        profile = ColumnProfile(
+            name=name,
+            null_rate=1 - len(values) / frame.height if frame.height else 0.0,
+            agreement=1.0,
+            timestamp_share=0.0,
+            mean_length=0.0,
+        )
+        if len(values):
+            shares = values.value_counts(sort=False)["count"] / len(values)
+            profile.agreement = float((shares**2).sum())
+            profile.timestamp_share = float(values.str.contains(_TIMESTAMP).mean())
+            profile.mean_length = float(values.str.len_chars().mean())
+        if profile.null_rate > MAX_NULL_RATE:
+            profile.dropped = "mostly empty"
+        elif profile.timestamp_share >= MIN_TIMESTAMP_SHARE:
+            profile.dropped = "timestamp"
+        elif profile.agreement > MAX_AGREEMENT:
+            profile.dropped = "few distinct values"
+        profiles.append(profile)
+    return profiles
+
+
+def select_columns(records: Sequence[Record], exclude_prefix: str) -> List[str]:
+    """The columns to embed and compare records on.
+
+    All columns are kept when there are too few records to judge, or when the
+    profile would drop every one of them.
+    """
+    columns = _columns(records, exclude_prefix)
+    if len(records) < MIN_PROFILE_RECORDS:
+        return columns
+    profiles = profile_columns(records, exclude_prefix)
+    kept = [profile.name for profile in profiles if profile.dropped is None]
+    dropped = [profile for profile in profiles if profile.dropped is not None]
+    if not kept:
+        logger.info("Profiling would drop every column; keeping them all")
+        return columns
+    if dropped:
+        logger.info(
+            f"Matching on {len(kept)} of {len(profiles)} columns; dropped "
+            + ", ".join(f"{profile.name} ({profile.dropped})" for profile in dropped),
+            extra={"kept_columns": kept},
+        )
+    return kept
+
+
+def _columns(records: Sequence[Record], exclude_prefix: str) -> List[str]:
+    if isinstance(records, RecordFrame):
+        names = records.frame.columns
+    else:
+        names = dict.fromkeys(name for record in records for name in record.data)
+    return [name for name in names if not name.startswith(exclude_prefix)]
+
+
+def _string_frame(records: Sequence[Record], exclude_prefix: str) -> pl.DataFrame:
+    """Each column's values as strings, nulls kept."""
+    names = _columns(records, exclude_prefix)
+    if isinstance(records, RecordFrame):
+        schema = records.frame.schema
+        return records.frame.select(
+            pl.col(name).cast(pl.String)
+            if schema[name] in (pl.String, pl.Boolean) or schema[name].is_numeric()
+            else pl.col(name).map_elements(str, return_dtype=pl.String)
+            for name in names
+        )
+    return pl.DataFrame(
+        {
+            name: [
+                None if record.data.get(name) is None else str(record.data[name])
+                for record in records
+            ]
+            for name in names
+        },
+        schema={name: pl.String for name in names},
+    )
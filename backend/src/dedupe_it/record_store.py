@@ -0,0 +1,344 @@
+"""Columnar side store for record data, addressed by dense integer row ids.
+
+Record data is kept once, column by column in Polars frames, so the vector
+index, neighbor search and union-find only ever handle integer row ids. Dicts are
+materialized on demand, when a prompt or a result actually needs them.
+"""
+
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import polars as pl
+
+from .errors import InvalidInputError
+from .models import Record
+
+_SCALAR_DTYPES = {str: pl.String, int: pl.Int64, float: pl.Float64, bool: pl.Boolean}
+
+
+def _column(name: str, values: List[Any]) -> pl.Series:
+    """Store scalar columns natively; anything else is kept as Python objects.
+
+    Nested or mixed-type values go into an Object column so that they come back
+    exactly as they were given, rather than coerced to a common Polars type.
+    """
+    types = {type(value) for value in values if value is not None}
+    dtype = _SCALAR_DTYPES.get(types.pop()) if len(types) == 1 else None
+    if dtype is not None:
+        try:
+            return pl.Series(name, values, dtype=dtype)
+        except (OverflowError, TypeError, pl.exceptions.PolarsError):
+            pass
+    return pl.Series(name, values, dtype=pl.Object)
+
+
+class _Chunk:
+    __slots__ = ("offset", "frame", "positions", "layouts")
+
+    def __init__(
+        self,
+        offset: int,
+        frame: pl.DataFrame,
+        layouts: np.ndarray,
+    ):
+        self.offset = offset
+        self.frame = frame
+        self.positions = {name: i for i, name in enumerate(frame.columns)}
+        self.layouts = layouts
+
+
+class RecordStore:
+    """Append-only store of record ids and data, one Polars frame per batch.
+
+    Row ids are assigned densely in insertion order. Each row also remembers its
+    key layout (which keys it had, in which order), so records with differing
+    schemas materialize with exactly their own keys.
+    """
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self._row_ids: Dict[str, int] = {}
+        self._chunks: List[_Chunk] = []
+        self._offsets: List[int] = []
+        self._layouts: List[Tuple[str, ...]] = []
+        self._layout_ids: Dict[Tuple[str, ...], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self._row_ids
+
+    def add(self, records: Sequence[Record]) -> np.ndarray:
+        """Append records and return their row ids."""
+        offset = len(self.ids)
+        ids = record_ids(records)
+        new_row_ids: Dict[str, int] = {}
+        for i, record_id in enumerate(ids):
+            if record_id in self._row_ids or record_id in new_row_ids:
+                raise InvalidInputError(f"Duplicate record id: {record_id}")
+            new_row_ids[record_id] = offset + i
+        self._row_ids.update(new_row_ids)
+        self.ids.extend(new_row_ids)
+
+        if isinstance(records, RecordFrame):
+            # Every row of a frame has all of its columns
+            frame = records.frame
+            layouts = np.full(
+                len(records), self._layout_id(tuple(frame.columns)), dtype=np.int32
+            )
+        else:
+            columns: Dict[str, List[Any]] = {}
+            layouts = np.empty(len(records), dtype=np.int32)
+            batch_layouts = set()
+            for i, record in enumerate(records):
+                layout = tuple(record.data)
+                if layout not in batch_layouts:
+                    batch_layouts.add(layout)
+                    # Keys first seen in this batch are backfilled for earlier rows
+                    for key in layout:
+                        columns.setdefault(key, [None] * i)
+                layouts[i] = self._layout_id(layout)
+                for key, values in columns.items():
+                    values.append(record.data.get(key))
+            frame = pl.DataFrame(
+                [_column(name, values) for name, values in columns.items()]
+            )
+
+        self._chunks.append(_Chunk(offset, frame, layouts))
+        self._offsets.append(offset)
+        return np.arange(offset, offset + len(records), dtype=np.int64)
+
+    def remove(self, record_ids: Sequence[str]) -> None:
+        """Forget records that are gone or replaced. Their rows stay behind,
+        unreachable by id, so row ids never move."""
+        for record_id in record_ids:
+            del self._row_ids[record_id]
+
+    def _layout_id(self, layout: Tuple[str, ...]) -> int:
+        layout_id = self._layout_ids.get(layout)
+        if layout_id is None:
+            layout_id = self._layout_ids[layout] = len(self._layouts)
+            self._layouts.append(layout)
+        return layout_id
+
+    def row_id(self, record_id: str) -> int:
+        return self._row_ids[record_id]
+
+    def row_ids(self, record_ids: Sequence[str]) -> np.ndarray:
+        return np.fromiter(
+            (self._row_ids[record_id] for record_id in record_ids),
+            dtype=np.int64,
+            count=len(record_ids),
+        )
+
+    def get(self, row_id: int) -> Dict[str, Any]:
+        """Materialize the data of a single row."""
+        return self.get_many([row_id])[0]
+
+    def get_many(self, row_ids: Sequence[int] | np.ndarray) -> List[Dict[str, Any]]:
+        """Materialize the data of many rows, in the order given."""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        results: List[Dict[str, Any]] = [None] * len(row_ids)
+        chunk_indices = np.searchsorted(self._offsets, row_ids, side="right") - 1
+        for chunk_index in np.unique(chunk_indices):
+            chunk = self._chunks[chunk_index]
+            positions = np.flatnonzero(chunk_indices == chunk_index)
+            local = row_ids[positions] - chunk.offset
+            if not chunk.frame.width:
+                for position in positions:
+                    results[position] = {}
+                continue
+            rows = chunk.frame[local].rows()
+            for position, local_id, row in zip(positions, local, rows):
+                layout = self._layouts[chunk.layouts[local_id]]
+                results[position] = {key: row[chunk.positions[key]] for key in layout}
+        return results
+
+    def records(self, row_ids: Sequence[int] | np.ndarray) -> List[Record]:
+        return [
+            Record(id=self.ids[row_id], data=data)
+            for row_id, data in zip(row_ids, self.get_many(row_ids))
+        ]
+
+
+class RecordBatch:
+    """Records added to the store together, with their embeddings.
+
+    Embeddings are one contiguous float32 matrix aligned with ``row_ids``, or None
+    when the batch was not embedded. Record data stays in ``store`` until it is
+    asked for, so a batch costs a few arrays rather than one Python object per
+    record.
+    """
+
+    __slots__ = ("ids", "row_ids", "embeddings", "store")
+
+    def __init__(
+        self,
+        ids: List[str],
+        row_ids: np.ndarray,
+        embeddings: np.ndarray | None,
+        store: RecordStore,
+    ):
+        self.ids = ids
+        self.row_ids = row_ids
+        self.embeddings = (
+            None
+            if embeddings is None
+            else np.ascontiguousarray(embeddings, dtype=np.float32)
+        )
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.row_ids)
+
+    def data(self) -> List[Dict[str, Any]]:
+        return self.store.get_many(self.row_ids)
+
+
+class RecordFrame(Sequence[Record]):
+    """Records held as one Polars frame, as they arrive from a table upload.
+
+    It reads as a list of Records, but the record store and the text fed to
+    embeddings and LSH come straight from the frame's columns, so bulk input is
+    never turned into one Python object per record unless a caller indexes it.
+    """
+
+    def __init__(self, ids: List[str], frame: pl.DataFrame):
+        if len(ids) != frame.height:
+            raise ValueError("Need exactly one id per row")
+        self.ids = ids
+        self.frame = frame
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RecordFrame(self.ids[index], self.frame[index])
+        return Record(id=self.ids[index], data=self.frame.row(index, named=True))
+
+    def __iter__(self) -> Iterator[Record]:
+        for record_id, data in zip(self.ids, self.frame.iter_rows(named=True)):
+            yield Record(id=record_id, data=data)
+
+    def take(self, positions: Sequence[int]) -> "RecordFrame":
+        return RecordFrame([self.ids[i] for i in positions], self.frame[positions])
+
+    def texts(self, exclude_prefix: str, columns: List[str] | None = None) -> List[str]:
+        """Join each row's values with spaces, as str() would print them.
+
+        With ``columns``, only the values of those columns are joined.
+        """
+        values = self._value_strings(exclude_prefix, columns)
+        if not values:
+            return [""] * len(self)
+        return self.frame.select(pl.concat_str(values, separator=" "))[:, 0].to_list()
+
+    def _value_strings(
+        self, exclude_prefix: str, columns: List[str] | None = None
+    ) -> List[pl.Expr]:
+        """Each column's values as str() would print them, None for nulls."""
+        values = []
+        schema = self.frame.schema
+        names = schema if columns is None else [c for c in columns if c in schema]
+        for name in names:
+            dtype = schema[name]
+            if name.startswith(exclude_prefix):
+                continue
+            column = pl.col(name)
+            if dtype == pl.String:
+                value = column
+            elif dtype == pl.Boolean:
+                value = (
+                    pl.when(column)
+                    .then(pl.lit("True"))
+                    .when(~column)
+                    .then(pl.lit("False"))
+                )
+            elif dtype.is_numeric():
+                value = column.cast(pl.String)
+            else:
+                value = column.map_elements(str, return_dtype=pl.String)
+            values.append(value.fill_null("None"))
+        return values
+
+
+def record_ids(records: Sequence[Record]) -> List[str]:
+    if isinstance(records, RecordFrame):
+        return records.ids
+    return [record.id for record in records]
+
+
+def take_records(
+    records: Sequence[Record], positions: Sequence[int]
+) -> Sequence[Record]:
+    if isinstance(records, RecordFrame):
+        return records.take(positions)
+    return [records[i] for i in positions]
+
+
+def exact_duplicates(
+    records: Sequence[Record], exclude_prefix: str
+) -> Tuple[List[int], Dict[str, List[str]]]:
+    """Find records whose data is identical up to case and whitespace.
+
+    Returns the position of one representative per distinct record, the first of
+    its copies, and for representatives with copies, the ids of all of them
+    keyed by the representative's id. Fields starting with ``exclude_prefix``
+    are ignored.
+    """
+    return collapse_keys(exact_keys(records, exclude_prefix), record_ids(records))
+
+
+def exact_keys(records: Sequence[Record], exclude_prefix: str) -> pl.Series:
+    """Each record's data as a string that is the same for exact copies, up to
+    case and whitespace; see ``exact_duplicates``."""
+    if isinstance(records, RecordFrame):
+        # Rows of a frame share their columns, so values alone identify them
+        values = records._value_strings(exclude_prefix)
+        keys = (
+            records.frame.select(pl.concat_str(values, separator="\x1f"))[:, 0]
+            if values
+            else pl.Series([""] * len(records))
+        )
+    else:
+        keys = pl.Series(
+            [
+                "\x1f".join(
+                    f"{name}\x1e{value}"
+                    for name, value in sorted(record.data.items())
+                    if not name.startswith(exclude_prefix)
+                )
+                for record in records
+            ],
+            dtype=pl.String,
+        )
+    # Whitespace runs count as one space, and none around values
+    return (
+        keys.str.to_lowercase()
+        .str.replace_all(r"\s+", " ")
+        .str.replace_all(r" ?([\x1e\x1f]) ?", "$1")
+        .str.strip_chars()
+    )
+
+
+def collapse_keys(
+    keys: pl.Series, ids: List[str]
+) -> Tuple[List[int], Dict[str, List[str]]]:
+    """``exact_duplicates`` over records' ``exact_keys``, in record order."""
+    grouped = (
+        pl.DataFrame(
+            {
+                "key": pl.Series(keys, dtype=pl.String),
+                "id": pl.Series(ids, dtype=pl.String),
+            }
+        )
+        .with_row_index("position")
+        .group_by("key", maintain_order=True)
+        .agg(pl.col("position").first(), pl.col("id"))
+    )
+    copies = grouped.filter(pl.col("id").list.len() > 1)
+    return grouped["position"].to_list(), dict(
+        zip(copies["id"].list.first().to_list(), copies["id"].to_list())
+    )
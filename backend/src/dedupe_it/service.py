@@ -1,12 +1,32 @@
-from typing import List, Dict
+from collections import OrderedDict, defaultdict
+from contextlib import nullcontext
+from typing import Dict, List, Set, Tuple
 import asyncio
+import dataclasses
+import time
+from .budget import Budget, spending
+from .checkpoint import Checkpoint
 from .config import Config
+from .errors import InvalidInputError
 from .grouper import Grouper
-from .vector_store import vector_store
+from .vector_store import VectorStore, vector_store
 from .merger import Merger
-from .logger import logger
+from .logger import lazy, logger
+from .metrics import queue_depth, records_per_second, records_processed
 from .models import Record
+from .profiling import select_columns
+from .record_store import (
+    collapse_keys,
+    exact_duplicates,
+    exact_keys,
+    record_ids,
+    take_records,
+)
+from .sharding import process_records_sharded
+from .utils import Timer
+from .tracing import traced
 from pydantic import BaseModel
+import numpy as np
 import polars as pl
 
 
@@ -14,69 +34,638 @@ class GroupResult(BaseModel):
     group_id: str
     merged_data: Dict
     record_ids: List[str]
+    # False when the LLM budget ran out before the group was merged, in which
+    # case merged_data is the data of its first record
+    merged: bool = True
+
+
+class Coverage(BaseModel):
+    """How much of the work a budgeted job got done."""
+
+    pairs_total: int
+    pairs_compared: int
+    # Not compared because earlier matches already connected the two records
+    pairs_implied: int
+    pairs_skipped: int
+    # Decided by the rerank model or the pair classifier without an LLM call
+    pairs_reranked: int = 0
+    pairs_classified: int = 0
+    groups_total: int
+    groups_merged: int
+    llm_calls: int
+    llm_tokens: int
+    budget_exhausted: bool
 
 
 class DedupeResult(BaseModel):
     groups: List[GroupResult]
+    # Only reported for budgeted jobs
+    coverage: Coverage | None = None
+
+
+# One lock per job id: a job's runs and updates read and write its checkpoint,
+# so they take turns
+_job_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+
+@dataclasses.dataclass
+class _Job:
+    """A finished job kept open between updates, so an update only touches the
+    records it changes."""
+
+    checkpoint: Checkpoint
+    config: Config
+    store: VectorStore
+    # Every record of the job by id, in order, and its exact-copy key
+    records: Dict[str, Record]
+    keys: Dict[str, str]
+    # Ids of the records in the store: first copies, or all records when exact
+    # copies are not collapsed
+    representatives: List[str]
+
 
+_jobs: "OrderedDict[str, _Job]" = OrderedDict()
 
-async def dedupe_records(records: List[Record]) -> DedupeResult:
+
+def close_jobs() -> None:
+    """Close every job kept open for updates."""
+    while _jobs:
+        _close_job(next(iter(_jobs)))
+
+
+def _close_job(job_id: str) -> None:
+    job = _jobs.pop(job_id, None)
+    if job is not None:
+        job.store.close()
+
+
+@traced
+async def dedupe_records(
+    records: List[Record], config: Config | None = None
+) -> DedupeResult:
     """Main deduplication service function that processes a list of records"""
-    config = Config()
+    config = config or Config()
+    lock = _job_locks[config.job_id] if config.job_id is not None else nullcontext()
+    async with lock:
+        if config.job_id is not None:
+            # The run may change what the job's updates start from
+            _close_job(config.job_id)
+        return await _dedupe_records(records, config)
+
+
+async def _dedupe_records(records: List[Record], config: Config) -> DedupeResult:
+    start = time.time()
+    total_records = len(records)
+    all_records = records
+    checkpoint = None
+    if config.job_id is not None:
+        checkpoint = Checkpoint(
+            config.checkpoint_dir, config.job_id, record_ids(all_records)
+        )
+        # Stored so that the job can take updates later
+        if not checkpoint.has_records:
+            checkpoint.save_records(all_records)
+    config = resolve_match_columns(records, config, checkpoint)
+    records, copies = _collapse(records, config)
+    budget = _budget(config)
+
+    with spending(budget):
+        logger.info(f"Preparing vector store for {config.embedding_model_name}")
+        async with vector_store(config.embedding_model_name) as store:
+            logger.info("Vector store prepared")
+            grouper = Grouper(config, store, checkpoint)
+
+            if checkpoint is not None and checkpoint.groups is not None:
+                logger.info(f"Restoring groups of job {config.job_id} from checkpoint")
+                await store.add_records_batch(records, embed=False)
+                await grouper.union_groups(checkpoint.groups)
+            elif config.shards > 1:
+                await process_records_sharded(records, config, grouper)
+            else:
+                await grouper.process_records(records)
+            result = await _build_result(
+                store, grouper, config, checkpoint, budget, copies
+            )
+
+    elapsed = time.time() - start
+    records_processed.inc(total_records)
+    records_per_second.set(total_records / elapsed if elapsed else 0.0)
+    return result
+
+
+@traced
+async def update_records(
+    job_id: str,
+    upserts: List[Record],
+    deletes: List[str],
+    config: Config | None = None,
+) -> DedupeResult:
+    """Apply record upserts and deletes to a finished checkpointed job.
+
+    Only upserted records are embedded, and only they are matched against all
+    records. A group that lost or changed a member is re-verified on its own:
+    the matches stored for it and its members' nearest neighbors within it are
+    compared again, reusing every stored verdict that does not involve a changed
+    record, so the group splits where its links are gone. Groups the changes do
+    not touch keep their merged records.
+
+    The job's records and vectors stay open after an update, so the next one
+    applies its changes to them instead of loading the job again.
+    """
+    config = config or Config()
+    async with _job_locks[job_id]:
+        job = await _open_job(job_id, config)
+        try:
+            return await _update_job(job, upserts, deletes, config)
+        except BaseException:
+            # The open job may be half updated; the next update reloads it
+            _close_job(job_id)
+            raise
+
+
+async def _open_job(job_id: str, config: Config) -> _Job:
+    """The job kept open for ``job_id``, loaded from its checkpoint if need be."""
+    job = _jobs.get(job_id)
+    if job is not None and job.config.embedding_model_name == (
+        config.embedding_model_name
+    ):
+        _jobs.move_to_end(job_id)
+        return job
+    _close_job(job_id)
+
+    start = time.time()
+    checkpoint = Checkpoint(config.checkpoint_dir, job_id)
+    records = checkpoint.records
+    groups = checkpoint.groups
+    if records is None or groups is None:
+        raise InvalidInputError(f"Job {job_id} has not finished matching")
+    config = resolve_match_columns(records, config, checkpoint)
+    keys = _exact_keys(records, config)
+    representatives = _representatives(record_ids(records), keys, config)[0]
+    by_id = {record.id: record for record in records}
+    representative_records = [by_id[record_id] for record_id in representatives]
+
+    store = await VectorStore.create(config.embedding_model_name)
+    try:
+        grouper = Grouper(config, store, checkpoint)
+        embeddings = await _update_embeddings(
+            grouper, checkpoint, representative_records, set()
+        )
+        await store.add_records_batch(representative_records, embeddings)
+        await grouper.union_groups(groups)
+    except BaseException:
+        store.close()
+        raise
+    # Folds the changes of earlier updates into the stored records
+    checkpoint.save_records(records)
+
+    job = _Job(
+        checkpoint=checkpoint,
+        config=config,
+        store=store,
+        records=by_id,
+        keys=dict(zip(record_ids(records), keys)),
+        representatives=representatives,
+    )
+    _jobs[job_id] = job
+    while len(_jobs) > max(config.max_open_jobs, 1):
+        _close_job(next(iter(_jobs)))
+    logger.info(f"Opened job {job_id} in {time.time() - start:.2f}s")
+    return job
+
+
+def _exact_keys(records: List[Record], config: Config) -> List[str | None]:
+    """Exact-copy keys of ``records``; None when copies are not collapsed."""
+    if not config.collapse_exact_duplicates:
+        return [None] * len(records)
+    return exact_keys(records, exclude_prefix="_dedupit_").to_list()
+
+
+def _representatives(
+    ids: List[str], keys: List[str | None], config: Config
+) -> Tuple[List[str], Dict[str, List[str]]]:
+    """Ids of the records to match and the copies of each, as in ``_collapse``."""
+    if not config.collapse_exact_duplicates:
+        return ids, {}
+    positions, copies = collapse_keys(pl.Series(keys, dtype=pl.String), ids)
+    return [ids[i] for i in positions], copies
 
-    logger.info(f"Preparing vector store for {config.embedding_model_name}")
-    async with vector_store(config.embedding_model_name) as store:
-        logger.info("Vector store prepared")
-        grouper = Grouper(config, store)
 
-        await grouper.process_records(records)
-        groups_df = grouper.get_groups(include_records=True)
-        logger.info(f"Found {len(groups_df)} records in groups")
+async def _update_job(
+    job: _Job, upserts: List[Record], deletes: List[str], config: Config
+) -> DedupeResult:
+    start = time.time()
+    checkpoint = job.checkpoint
+    store = job.store
+    config = dataclasses.replace(config, match_columns=job.config.match_columns)
 
-        logger.debug(f"Groups DataFrame: {groups_df.head(1)}")
+    upserted = {record.id: record for record in upserts}
+    deleted = set(deletes)
+    if len(upserted) != len(upserts):
+        raise InvalidInputError("Upserted record ids must be unique")
+    if not deleted.isdisjoint(upserted):
+        raise InvalidInputError("A record cannot be both upserted and deleted")
+    unknown = deleted.difference(job.records)
+    if unknown:
+        raise InvalidInputError(
+            f"Unknown record ids: {', '.join(sorted(unknown)[:10])}"
+        )
+    changed = deleted | upserted.keys()
+
+    # Updated records keep their place and new ones go last
+    for record_id in deleted:
+        del job.records[record_id]
+        del job.keys[record_id]
+    job.records.update(upserted)
+    job.keys.update(zip(upserted, _exact_keys(upserts, config)))
+    logger.info(
+        f"Updating job {checkpoint.job_id}: {len(upserts)} upserts, "
+        f"{len(deleted)} deletes, {len(job.records)} records"
+    )
 
-        groups_with_data = groups_df.group_by("group_id").agg(
-            [pl.col("data").alias("data"), pl.col("id").alias("id")]
+    old_ids = set(job.representatives)
+    ids, copies = _representatives(list(job.records), list(job.keys.values()), config)
+    # Records that must be matched from scratch: changed ones, and copies whose
+    # first copy changed or went away
+    pending = [
+        record_id
+        for record_id in ids
+        if record_id in changed or record_id not in old_ids
+    ]
+    stale = changed | old_ids.difference(ids)
+    kept_groups = 0
+    touched_groups = []
+    for group in checkpoint.groups:
+        if stale.isdisjoint(group):
+            kept_groups += 1
+        else:
+            touched_groups.append(group)
+    affected_groups = [
+        members
+        for members in (
+            [record_id for record_id in group if record_id not in stale]
+            for group in touched_groups
         )
+        if len(members) > 1
+    ]
+    logger.info(
+        f"{len(pending)} records to match, {len(affected_groups)} groups to re-verify, "
+        f"{kept_groups} groups unchanged"
+    )
+    checkpoint.forget(changed)
+
+    # Touched groups fall apart into their records, and records that changed or
+    # stopped being first copies leave the store
+    await store.reset_rows(
+        store.records.row_ids(
+            [record_id for group in touched_groups for record_id in group]
+        ).tolist()
+    )
+    removed = sorted(stale & old_ids)
+    await store.remove_rows(store.records.row_ids(removed).tolist())
+    store.records.remove(removed)
+
+    budget = _budget(config)
+    with spending(budget):
+        grouper = Grouper(config, store, checkpoint)
+        row_ids = store.records.ids
+        pairs: Dict[Tuple[int, int], int] = {}
+
+        def add_pair(row_id1: int, row_id2: int, rank: int) -> None:
+            # Stored verdicts are keyed in the order the pair was compared
+            if (row_ids[row_id2], row_ids[row_id1]) in checkpoint.verdicts:
+                row_id1, row_id2 = row_id2, row_id1
+            pairs[(row_id1, row_id2)] = min(rank, pairs.get((row_id1, row_id2), rank))
+
+        if pending:
+            pending_records = [job.records[record_id] for record_id in pending]
+            logger.info(f"Embedding {len(pending)} records")
+            embeddings = await grouper.embed(pending_records)
+            checkpoint.add_embeddings(embeddings, pending)
+            batch = await store.add_records_batch(pending_records, embeddings)
+            neighbors = await store.find_neighbors_batch(
+                query_embeddings=embeddings,
+                k=config.max_neighbors,
+                exclude_row_ids=batch.row_ids,
+            )
+            for row_id, record_neighbors in zip(batch.row_ids, neighbors):
+                for rank, neighbor in enumerate(record_neighbors):
+                    add_pair(int(row_id), neighbor, rank)
+
+        for members in affected_groups:
+            rows = store.records.row_ids(members)
+            position = dict(zip(members, rows.tolist()))
+            for record_id in members:
+                for id1, id2 in checkpoint.pairs_with(record_id):
+                    # Each pair is listed under both of its records
+                    if (
+                        id1 == record_id
+                        and id2 in position
+                        and checkpoint.verdicts[(id1, id2)]
+                    ):
+                        add_pair(position[id1], position[id2], 0)
+            for row_id1, row_id2, rank in _nearest_within(
+                await store.vectors(rows), rows, config.max_neighbors
+            ):
+                add_pair(row_id1, row_id2, rank)
+
+        await grouper.compare_and_union(list(pairs), list(pairs.values()))
+        result = await _build_result(store, grouper, config, checkpoint, budget, copies)
+    checkpoint.save_record_changes(upserts, deletes, list(job.records))
+    job.representatives = ids
+
+    elapsed = time.time() - start
+    records_processed.inc(len(upserts) + len(deleted))
+    logger.info(f"Updated job {checkpoint.job_id} in {elapsed:.2f}s")
+    return result
+
+
+def _collapse(
+    records: List[Record], config: Config
+) -> Tuple[List[Record], Dict[str, List[str]]]:
+    """Collapse exact copies into their first copy, when configured to.
+
+    Exact copies are matched without embeddings or LLM calls, so only one of
+    each goes through the pipeline. Records are copies only when they agree on
+    every field, not just the columns matched on, since copies are never merged
+    and a field they differ in would be lost.
+    """
+    if not config.collapse_exact_duplicates:
+        return records, {}
+    with Timer("exact_duplicates"):
+        positions, copies = exact_duplicates(records, exclude_prefix="_dedupit_")
+    if not copies:
+        return records, {}
+    logger.info(f"Collapsed {len(records)} records into {len(positions)} distinct ones")
+    return take_records(records, positions), copies
+
+
+def resolve_match_columns(
+    records: List[Record], config: Config, checkpoint: Checkpoint | None
+) -> Config:
+    """Config with the columns to match on, profiled from the records if unset.
+
+    A checkpointed job keeps the columns it was first run with, so that its
+    stored embeddings stay comparable with new ones.
+    """
+    if config.match_columns is not None or not config.profile_columns:
+        return config
+    columns = checkpoint.match_columns if checkpoint is not None else None
+    if columns is None:
+        with Timer("profile"):
+            columns = select_columns(records, exclude_prefix="_dedupit_")
+        if checkpoint is not None:
+            checkpoint.save_match_columns(columns)
+    return dataclasses.replace(config, match_columns=columns)
+
+
+def _budget(config: Config) -> Budget | None:
+    if config.llm_call_budget is None and config.llm_token_budget is None:
+        return None
+    if config.shards > 1:
+        raise InvalidInputError("LLM budgets are not supported in sharded mode")
+    return Budget(config.llm_call_budget, config.llm_token_budget)
 
-        logger.debug(f"Groups with data: {groups_with_data.head(1)}")
 
-        # Initialize merger for groups that need merging
-        merger = Merger(config)
+async def _update_embeddings(
+    grouper: Grouper,
+    checkpoint: Checkpoint,
+    records: List[Record],
+    changed: Set[str],
+) -> np.ndarray:
+    """Embeddings of ``records``, reusing stored ones for unchanged records."""
+    ids = record_ids(records)
+    stored_ids = checkpoint.embedding_ids or []
+    stored_position = {record_id: i for i, record_id in enumerate(stored_ids)}
+    reused = [
+        i
+        for i, record_id in enumerate(ids)
+        if record_id in stored_position and record_id not in changed
+    ]
+    missing = sorted(set(range(len(ids))).difference(reused))
+    logger.info(f"Embedding {len(missing)} records, reusing {len(reused)} embeddings")
 
-        # Process each group
-        group_info = []
-        merge_tasks = []
+    new_embeddings = await grouper.embed(take_records(records, missing))
+    if reused:
+        stored = checkpoint.embeddings[[stored_position[ids[i]] for i in reused]]
+    else:
+        stored = np.empty((0, new_embeddings.shape[1]), dtype=np.float32)
+    embeddings = np.empty((len(ids), stored.shape[1]), dtype=np.float32)
+    embeddings[reused] = stored
+    embeddings[missing] = new_embeddings
+    checkpoint.save_embeddings(embeddings, ids)
+    return embeddings
 
-        logger.debug(f"Will merge {len(groups_with_data)} groups")
 
-        for row in groups_with_data.iter_rows(named=True):
-            group_id = row["group_id"]
-            group_records = row["data"]
-            record_ids = row["id"]
+def _nearest_within(
+    embeddings: np.ndarray, row_ids: np.ndarray, k: int
+) -> List[Tuple[int, int, int]]:
+    """(row id, neighbor row id, rank) of each row's ``k`` nearest others among
+    ``row_ids``."""
+    k = min(k, len(row_ids) - 1)
+    similarities = embeddings @ embeddings.T
+    np.fill_diagonal(similarities, -np.inf)
+    nearest = np.argsort(-similarities, axis=1)[:, :k]
+    return [
+        (int(row_ids[i]), int(row_ids[j]), rank)
+        for i in range(len(row_ids))
+        for rank, j in enumerate(nearest[i])
+    ]
 
-            if len(group_records) == 1:
-                continue
 
-            group_info.append((group_id, record_ids))
-            merge_tasks.append(merger.merge_records(group_records))
+async def _build_result(
+    store: VectorStore,
+    grouper: Grouper,
+    config: Config,
+    checkpoint: Checkpoint | None,
+    budget: Budget | None,
+    copies: Dict[str, List[str]],
+) -> DedupeResult:
+    """Merge the matched groups and expand exact copies back into them."""
+    groups_df = await grouper.get_groups()
+    logger.info(f"Found {len(groups_df)} records in groups")
 
-        logger.debug(f"Merge tasks: {merge_tasks}")
-        merge_results = await asyncio.gather(*merge_tasks)
-        logger.debug(f"Merge results: {merge_results}")
+    logger.debug("Groups DataFrame: %s", lazy(groups_df.head, 1))
 
-        result_groups = []
-        # Add merged results to final output
-        for (group_id, record_ids), merged_data in zip(group_info, merge_results):
+    # Only groups with several records need merging, so singletons are
+    # dropped before any record data is materialized
+    groups_with_data = (
+        groups_df.group_by("group_id")
+        .agg(pl.col("row_id"), pl.col("id"))
+        .filter(pl.col("id").list.len() > 1)
+    )
+    if checkpoint is not None:
+        checkpoint.save_groups(groups_with_data["id"].to_list())
+
+    logger.debug("Groups with data: %s", lazy(groups_with_data.head, 1))
+
+    # Initialize merger for groups that need merging
+    merger = Merger(config)
+
+    # Process each group; merges finished by an earlier run are reused
+    group_info = []
+    merge_results = []
+    pending = []
+    pending_row_ids = []
+
+    logger.debug(f"Will merge {len(groups_with_data)} groups")
+
+    for row in groups_with_data.iter_rows(named=True):
+        group_id = row["group_id"]
+        member_ids = row["id"]
+
+        group_info.append((group_id, member_ids))
+        merged_data = checkpoint.merged(member_ids) if checkpoint is not None else None
+        merge_results.append(merged_data)
+        if merged_data is None:
+            pending.append(len(group_info) - 1)
+            pending_row_ids.append(row["row_id"])
+
+    # Under a budget, the largest groups are merged first
+    unmerged = set()
+    remaining = budget.remaining_calls(merges=True) if budget is not None else None
+    if budget is not None:
+        by_size = sorted(range(len(pending)), key=lambda j: -len(pending_row_ids[j]))
+        kept = by_size if remaining is None else by_size[:remaining]
+        for j in by_size[len(kept) :]:
+            unmerged.add(pending[j])
+            merge_results[pending[j]] = store.records.get(pending_row_ids[j][0])
+        pending = [pending[j] for j in kept]
+        pending_row_ids = [pending_row_ids[j] for j in kept]
+    groups_to_merge = [store.records.get_many(row_ids) for row_ids in pending_row_ids]
+
+    in_flight = asyncio.Semaphore(config.llm_concurrency)
+    # Merges started but not yet charged to the budget
+    merging = 0
+    # Under a token cap, merges cost an unknown amount until one has been
+    # charged, so the first one runs alone
+    priced = asyncio.Event()
+    if budget is None or budget.max_tokens is None or budget.merge_calls:
+        priced.set()
+
+    async def merge_group(record_ids: List[str], group: List[Dict]) -> Dict | None:
+        nonlocal merging
+        async with in_flight:
+            if merging and not priced.is_set():
+                await priced.wait()
+            # Checked against actual spend before each call, since the estimate
+            # above may rest on few merges, or on comparisons alone
+            if budget is not None:
+                remaining = budget.remaining_calls(merges=True)
+                if remaining is not None and remaining <= merging:
+                    return None
+            merging += 1
+            try:
+                merged_data = await merger.merge_records(group)
+            finally:
+                merging -= 1
+                priced.set()
+        if checkpoint is not None:
+            checkpoint.record_merge(record_ids, merged_data)
+        return merged_data
+
+    async def merge_bulk(
+        indices: List[int], groups: List[List[Dict]]
+    ) -> List[Dict | None]:
+        results: List[Dict | None] = [None] * len(groups)
+        start = 0
+        # A batch is sized before any of its answers are charged, so under a
+        # token cap one merge is priced in real time first
+        if groups and not priced.is_set():
+            results[0] = await merge_group(group_info[indices[0]][1], groups[0])
+            start = 1
+        count = len(groups) - start
+        if budget is not None:
+            remaining = budget.remaining_calls(merges=True)
+            if remaining is not None:
+                count = min(count, remaining)
+        merged = (
+            await merger.merge_records_bulk(groups[start : start + count])
+            if count
+            else []
+        )
+        results[start : start + count] = merged
+        if checkpoint is not None:
+            for i, merged_data in zip(indices[start:], merged):
+                checkpoint.record_merge(group_info[i][1], merged_data)
+        return results
+
+    queue_depth.labels("merge").inc(len(groups_to_merge))
+    try:
+        async with Timer("merge"):
+            if config.bulk_mode:
+                pending_results = await merge_bulk(pending, groups_to_merge)
+            else:
+                merge_tasks = [
+                    merge_group(group_info[i][1], group)
+                    for i, group in zip(pending, groups_to_merge)
+                ]
+                logger.debug("Merge tasks: %s", merge_tasks)
+                pending_results = await asyncio.gather(*merge_tasks)
+    finally:
+        queue_depth.labels("merge").dec(len(groups_to_merge))
+    for i, row_ids, merged_data in zip(pending, pending_row_ids, pending_results):
+        if merged_data is None:
+            unmerged.add(i)
+            merged_data = store.records.get(row_ids[0])
+        merge_results[i] = merged_data
+    if unmerged:
+        logger.info(f"LLM budget leaves {len(unmerged)} groups unmerged")
+    logger.debug("Merge results: %s", merge_results)
+
+    result_groups = []
+    # Add merged results to final output
+    for i, ((group_id, member_ids), merged_data) in enumerate(
+        zip(group_info, merge_results)
+    ):
+        result_groups.append(
+            GroupResult(
+                group_id=group_id,
+                merged_data=merged_data,
+                record_ids=member_ids,
+                merged=i not in unmerged,
+            )
+        )
+
+    # Copies join their representative's group; copies of a record that
+    # matched nothing else are a group of their own
+    grouped_ids = set()
+    for group in result_groups:
+        grouped_ids.update(group.record_ids)
+        group.record_ids = [
+            member_id
+            for record_id in group.record_ids
+            for member_id in copies.get(record_id, [record_id])
+        ]
+    for record_id, member_ids in copies.items():
+        if record_id not in grouped_ids:
             result_groups.append(
                 GroupResult(
-                    group_id=group_id,
-                    merged_data=merged_data,
-                    record_ids=record_ids,
+                    group_id=record_id,
+                    merged_data=store.records.get(
+                        store.records.row_ids([record_id])[0]
+                    ),
+                    record_ids=member_ids,
                 )
             )
 
-        logger.debug(f"Result groups: {result_groups}")
+    logger.debug("Result groups: %s", result_groups)
 
-        logger.info(f"Processed {len(result_groups)} groups")
-        return DedupeResult(groups=result_groups)
+    logger.info(f"Processed {len(result_groups)} groups")
+    coverage = None
+    if budget is not None:
+        coverage = Coverage(
+            pairs_total=grouper.pairs_total,
+            pairs_compared=grouper.pairs_compared,
+            pairs_implied=grouper.pairs_implied,
+            pairs_skipped=grouper.pairs_skipped,
+            pairs_reranked=grouper.pairs_reranked,
+            pairs_classified=grouper.pairs_classified,
+            groups_total=len(group_info),
+            groups_merged=len(group_info) - len(unmerged),
+            llm_calls=budget.calls,
+            llm_tokens=budget.tokens,
+            budget_exhausted=bool(grouper.pairs_skipped or unmerged),
+        )
+        logger.info(f"Budget coverage: {coverage}")
+    return DedupeResult(groups=result_groups, coverage=coverage)
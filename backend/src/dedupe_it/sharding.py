@@ -0,0 +1,223 @@
+"""Sharded deduplication across worker processes.
+
+Records are embedded in parallel, partitioned into shards, and each shard runs
+neighbor search and comparison in its own process with its own DuckDB connection
+and event loop. The shards' groups are then unioned into the caller's vector
+store, and records near a shard boundary are searched and compared across shards
+to reconcile the forests.
+
+A shard is a pure function of its records, their embeddings and the config that
+returns groups of record ids, so the same split can later be spread over several
+machines rather than processes.
+"""
+
+import asyncio
+import dataclasses
+import multiprocessing
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+import polars as pl
+
+from .checkpoint import Checkpoint
+from .config import Config
+from .grouper import Grouper
+from .logger import logger
+from .models import Record
+from .record_store import record_ids
+from .tracing import traced
+from .utils import Timer
+from .vector_store import encode_records, get_embedding_model, vector_store
+
+KMEANS_ITERATIONS = 10
+# Centroids are fitted on a sample; assigning the rest is a single matrix product
+KMEANS_SAMPLE_SIZE = 10_000
+
+
+def kmeans(
+    embeddings: np.ndarray,
+    k: int,
+    seed: int = 0,
+    sample_size: int = KMEANS_SAMPLE_SIZE,
+) -> np.ndarray:
+    """Fit ``k`` unit-length centroids to unit-length embeddings (spherical k-means)."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(embeddings), sample_size)
+    sample = embeddings[rng.choice(len(embeddings), sample_size, replace=False)]
+
+    # k-means++ initialisation; for unit vectors |a - b|^2 = 2 - 2 a.b
+    centroids = [sample[rng.integers(sample_size)]]
+    distances = np.maximum(2 - 2 * sample @ centroids[0], 0)
+    for _ in range(1, k):
+        total = distances.sum()
+        p = distances / total if total > 0 else None
+        centroids.append(sample[rng.choice(sample_size, p=p)])
+        distances = np.minimum(distances, np.maximum(2 - 2 * sample @ centroids[-1], 0))
+    centroids = np.stack(centroids)
+
+    for _ in range(KMEANS_ITERATIONS):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        for j in range(k):
+            members = sample[labels == j]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[j] = centroid / (np.linalg.norm(centroid) or 1.0)
+    return centroids
+
+
+def partition(
+    records: List[Record], embeddings: np.ndarray, config: Config
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Assign each record a shard, and flag records that sit near a shard boundary."""
+    if config.shard_blocking_key is not None:
+        keys = (
+            str(record.data.get(config.shard_blocking_key, "")).strip().lower()
+            for record in records
+        )
+        shard_ids = np.fromiter(
+            (zlib.crc32(key.encode()) % config.shards for key in keys),
+            dtype=np.int64,
+            count=len(records),
+        )
+        # Records with different blocking keys are taken to be distinct
+        return shard_ids, np.zeros(len(records), dtype=bool)
+
+    centroids = kmeans(embeddings, min(config.shards, len(embeddings)))
+    similarities = embeddings @ centroids.T
+    shard_ids = np.argmax(similarities, axis=1)
+    if similarities.shape[1] < 2:
+        return shard_ids, np.zeros(len(records), dtype=bool)
+    top_two = np.partition(similarities, -2, axis=1)[:, -2:]
+    boundary = top_two[:, 1] - top_two[:, 0] < config.shard_boundary_margin
+    return shard_ids, boundary
+
+
+def _embed_chunk(
+    model_name: str, records: List[Record], columns: List[str] | None
+) -> np.ndarray:
+    return encode_records(get_embedding_model(model_name), records, columns)
+
+
+def _match_shard(
+    records: List[Record], embeddings: np.ndarray, config: Config, shard: int
+) -> List[List[str]]:
+    """Worker entry point: match one shard and return its groups of record ids."""
+    return asyncio.run(_match_shard_async(records, embeddings, config, shard))
+
+
+async def _match_shard_async(
+    records: List[Record], embeddings: np.ndarray, config: Config, shard: int
+) -> List[List[str]]:
+    checkpoint = None
+    if config.job_id is not None:
+        # Workers cannot append to one log, so each shard checkpoints as a job
+        # of its own; the partition is deterministic, so a rerun finds it again
+        checkpoint = Checkpoint(
+            config.checkpoint_dir,
+            f"{config.job_id}-shard-{shard}",
+            record_ids(records),
+        )
+        if checkpoint.groups is not None:
+            return checkpoint.groups
+    async with vector_store(config.embedding_model_name) as store:
+        grouper = Grouper(config, store, checkpoint)
+        await grouper.process_records(records, embeddings)
+        groups = (
+            (await grouper.get_groups())
+            .group_by("group_id")
+            .agg(pl.col("id"))
+            .filter(pl.col("id").list.len() > 1)
+        )["id"].to_list()
+    if checkpoint is not None:
+        checkpoint.save_groups(groups)
+    return groups
+
+
+@traced
+async def process_records_sharded(
+    records: List[Record], config: Config, grouper: Grouper
+) -> None:
+    """Match ``records`` across ``config.shards`` worker processes.
+
+    Results are unioned into ``grouper``'s vector store, which must be empty, so
+    the caller reads groups back exactly as after ``Grouper.process_records``.
+    """
+    if not records:
+        return
+    store = grouper.vector_store
+    loop = asyncio.get_running_loop()
+    # Workers are spawned rather than forked: DuckDB and the tokenizers hold
+    # threads and locks that do not survive a fork
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=config.shards, mp_context=context) as pool:
+        async with Timer("embedding"):
+            chunks = [
+                chunk
+                for chunk in np.array_split(np.arange(len(records)), config.shards)
+                if len(chunk)
+            ]
+            embeddings = np.concatenate(
+                await asyncio.gather(
+                    *[
+                        loop.run_in_executor(
+                            pool,
+                            _embed_chunk,
+                            config.embedding_model_name,
+                            [records[i] for i in chunk],
+                            config.match_columns,
+                        )
+                        for chunk in chunks
+                    ]
+                )
+            )
+
+        shard_ids, boundary = partition(records, embeddings, config)
+        shards = [np.flatnonzero(shard_ids == shard) for shard in np.unique(shard_ids)]
+        logger.info(
+            f"Matching {len(records)} records in {len(shards)} shards "
+            f"(sizes {[len(shard) for shard in shards]}), "
+            f"{int(boundary.sum())} on shard boundaries"
+        )
+
+        shard_config = dataclasses.replace(config, shards=1)
+        shard_groups = await asyncio.gather(
+            *[
+                loop.run_in_executor(
+                    pool,
+                    _match_shard,
+                    [records[i] for i in shard],
+                    embeddings[shard],
+                    shard_config,
+                    n,
+                )
+                for n, shard in enumerate(shards)
+            ]
+        )
+
+    # Merge the shards' forests: each group becomes a star around its first record
+    batch = await store.add_records_batch(records, embeddings)
+    await grouper.union_groups([group for groups in shard_groups for group in groups])
+
+    # Reconcile: compare boundary records with their nearest neighbors elsewhere
+    boundary_indices = np.flatnonzero(boundary)
+    if not len(boundary_indices):
+        return
+    async with Timer("reconcile"):
+        neighbors = await store.find_neighbors_batch(
+            query_embeddings=embeddings[boundary_indices],
+            k=config.max_neighbors,
+            exclude_row_ids=batch.row_ids[boundary_indices],
+        )
+    offset = int(batch.row_ids[0])
+    cross_shard_pairs = {
+        (min(row_id, neighbor_row_id), max(row_id, neighbor_row_id))
+        for row_id, record_neighbors in zip(
+            batch.row_ids[boundary_indices].tolist(), neighbors
+        )
+        for neighbor_row_id in record_neighbors
+        if shard_ids[row_id - offset] != shard_ids[neighbor_row_id - offset]
+    }
+    logger.info(f"Comparing {len(cross_shard_pairs)} cross-shard pairs")
+    await grouper.compare_and_union(sorted(cross_shard_pairs))
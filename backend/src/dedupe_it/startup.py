@@ -0,0 +1,40 @@
+"""What starting the service costs: imports and one-time initialization.
+
+Phases are recorded as they complete. Some happen at boot (imports, loading
+DuckDB extensions) and others on first use (loading the embedding model, which
+pulls in torch). Each is logged and exported as the ``dedupe_startup_seconds``
+gauge, and ``report()`` gives all of them so far.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from .logger import logger
+from .metrics import startup_seconds
+
+_phases: Dict[str, float] = {}
+
+
+def record(phase: str, seconds: float) -> None:
+    _phases[phase] = seconds
+    startup_seconds.labels(phase).set(seconds)
+    logger.info(
+        f"Startup phase {phase} took {seconds:.2f} seconds",
+        extra={"phase": phase, "seconds": seconds},
+    )
+
+
+@contextmanager
+def startup_phase(phase: str):
+    """Time a one-time initialization step as a startup phase."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+
+def report() -> Dict[str, float]:
+    """Seconds taken by each startup phase recorded so far."""
+    return dict(_phases)
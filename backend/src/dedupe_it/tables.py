@@ -0,0 +1,139 @@
+"""Tabular input and output for bulk dedupe: Parquet and Arrow IPC streams.
+
+Tables are decoded from the request body into Arrow buffers and handed on as a
+RecordFrame, so the records are never parsed one by one. The result goes back
+as one table of group memberships carrying each group's merged record.
+"""
+
+import io
+from typing import Dict, List
+
+import polars as pl
+import polars.selectors as cs
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+from .record_store import RecordFrame
+from .service import GroupResult
+
+PARQUET = "application/vnd.apache.parquet"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+MEDIA_TYPES = (PARQUET, ARROW_STREAM)
+
+
+def response_media_type(accept: str | None, request_type: str) -> str | None:
+    """The media type to answer with: the one of MEDIA_TYPES the Accept header
+    ranks highest, the request's own on a tie, or None if it accepts neither.
+
+    Each type takes the quality of the most specific range that matches it, so
+    ``*/*`` does not override an explicit ``q=0``.
+    """
+    if not accept:
+        return request_type
+    qualities: Dict[str, float] = {}
+    for media_range in accept.split(","):
+        name, *params = (part.strip() for part in media_range.split(";"))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name.lower()] = quality
+
+    def quality(media_type: str) -> float:
+        kind = media_type.split("/")[0]
+        for name in (media_type, f"{kind}/*", "*/*"):
+            if name in qualities:
+                return qualities[name]
+        return 0.0
+
+    candidates = [request_type] + [t for t in MEDIA_TYPES if t != request_type]
+    best = max(candidates, key=quality)
+    return best if quality(best) > 0 else None
+
+
+def read_table(body: bytes, media_type: str) -> pa.Table:
+    """Decode a Parquet file or Arrow IPC stream without copying its buffers."""
+    buffer = pa.py_buffer(body)
+    if media_type == PARQUET:
+        return pq.read_table(pa.BufferReader(buffer))
+    if media_type == ARROW_STREAM:
+        return pa.ipc.open_stream(buffer).read_all()
+    raise ValueError(f"Unsupported media type: {media_type}")
+
+
+def write_table(table: pa.Table, media_type: str) -> bytes:
+    sink = io.BytesIO()
+    if media_type == PARQUET:
+        pq.write_table(table, sink)
+    elif media_type == ARROW_STREAM:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"Unsupported media type: {media_type}")
+    return sink.getvalue()
+
+
+def records_from_table(table: pa.Table, id_column: str) -> RecordFrame:
+    """Wrap a table as records; every column but ``id_column`` is data.
+
+    The table becomes a Polars frame over the same Arrow buffers. Dates, times
+    and decimals are turned into strings, since record data must survive being
+    written into JSON prompts.
+    """
+    if id_column not in table.column_names:
+        raise ValueError(f"Missing id column: {id_column}")
+    frame = pl.from_arrow(table)
+    ids = frame[id_column]
+    if ids.null_count():
+        raise ValueError(f"Id column {id_column} contains nulls")
+    frame = frame.drop(id_column).with_columns(
+        (cs.temporal() | cs.decimal()).cast(pl.String)
+    )
+    return RecordFrame(ids.cast(pl.String).to_list(), frame)
+
+
+def result_table(
+    groups: List[GroupResult], schema: pl.Schema | None = None
+) -> pa.Table:
+    """One row per record in a group: its id, its group id and the merged record.
+
+    The merged record is a struct column repeated across the group's members;
+    ``unique("group_id").unnest("merged")`` turns it into a merged-records table.
+    With ``schema``, merged records are cast to it (values that do not fit become
+    null), so tables written chunk by chunk all share one schema.
+    """
+    members = pl.DataFrame(
+        {
+            "record_id": [record_id for g in groups for record_id in g.record_ids],
+            "group_id": [g.group_id for g in groups for _ in g.record_ids],
+        },
+        schema={"record_id": pl.String, "group_id": pl.String},
+    )
+    if not groups:
+        merged = pl.DataFrame(schema=schema)
+    else:
+        merged = pl.from_dicts(
+            [g.merged_data for g in groups], infer_schema_length=None
+        )
+    if schema is not None and groups:
+        merged = merged.select(
+            (
+                pl.col(name).cast(dtype, strict=False)
+                if name in merged.columns
+                else pl.lit(None, dtype=dtype)
+            ).alias(name)
+            for name, dtype in schema.items()
+        )
+    if not merged.width:
+        return members.to_arrow()
+    merged = merged.select(pl.struct(pl.all()).alias("merged"))
+    merged = merged.with_columns(
+        pl.Series("group_id", [g.group_id for g in groups], dtype=pl.String)
+    )
+    return members.join(merged, on="group_id", how="left").to_arrow()
@@ -0,0 +1,224 @@
+"""Lightweight per-request span tracing and an on-demand sampling profiler.
+
+Tracing is off unless a trace is active in the current context, in which case
+``span`` and ``traced`` record timed spans into it. When no trace is active they
+cost one context variable lookup.
+"""
+
+import asyncio
+import functools
+import itertools
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List
+
+from .logger import logger
+
+# Bound memory for pathological jobs; spans beyond this are counted, not kept
+MAX_SPANS_PER_TRACE = 20_000
+MAX_STORED_TRACES = 100
+
+_current_trace: ContextVar["Trace | None"] = ContextVar("current_trace", default=None)
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("id", "parent_id", "name", "start", "end", "lane", "attributes")
+
+    def __init__(self, name: str, parent_id: int | None, lane: int, attributes: Dict):
+        self.id = 0
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: float | None = None
+        self.lane = lane
+        self.attributes = attributes
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+        self.profile: "SamplingProfiler | None" = None
+        self._span_ids = itertools.count(1)
+        self._lanes: Dict[int, int] = {}
+
+    def _lane(self) -> int:
+        # Concurrent tasks get their own lane so spans nest correctly in viewers
+        try:
+            key = id(asyncio.current_task())
+        except RuntimeError:
+            key = threading.get_ident()
+        return self._lanes.setdefault(key, len(self._lanes) + 1)
+
+    def start_span(self, name: str, attributes: Dict) -> Span | None:
+        if len(self.spans) >= MAX_SPANS_PER_TRACE:
+            self.dropped_spans += 1
+            return None
+        parent = _current_span.get()
+        span = Span(name, parent.id if parent else None, self._lane(), attributes)
+        span.id = next(self._span_ids)
+        self.spans.append(span)
+        return span
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "dropped_spans": self.dropped_spans,
+            "spans": [
+                {
+                    "id": span.id,
+                    "parent_id": span.parent_id,
+                    "name": span.name,
+                    "start_ms": (span.start - self.start) * 1000,
+                    "duration_ms": ((span.end or span.start) - span.start) * 1000,
+                    "attributes": span.attributes,
+                }
+                for span in self.spans
+            ],
+        }
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Chrome trace event format, viewable in chrome://tracing or Perfetto."""
+        events = [
+            {
+                "name": span.name,
+                "ph": "X",
+                "ts": (span.start - self.start) * 1e6,
+                "dur": ((span.end or span.start) - span.start) * 1e6,
+                "pid": 1,
+                "tid": span.lane,
+                "args": span.attributes,
+            }
+            for span in self.spans
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+class _NoopSpan:
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+_noop_span = _NoopSpan()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | _NoopSpan]:
+    """Record a span in the active trace, if any."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield _noop_span
+        return
+    current = trace.start_span(name, attributes)
+    if current is None:
+        yield _noop_span
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def traced(func: Callable) -> Callable:
+    """Record each call of ``func`` as a span named after its qualified name."""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    async def async_wrapper(*args, **kwargs):
+        if _current_trace.get() is None:
+            return await func(*args, **kwargs)
+        with span(name):
+            return await func(*args, **kwargs)
+
+    @functools.wraps(func)
+    def sync_wrapper(*args, **kwargs):
+        if _current_trace.get() is None:
+            return func(*args, **kwargs)
+        with span(name):
+            return func(*args, **kwargs)
+
+    return async_wrapper if asyncio.iscoroutinefunction(func) else sync_wrapper
+
+
+class SamplingProfiler:
+    """Sample the stack of one thread from a background thread.
+
+    The result is in collapsed-stack format (``frame;frame;frame count``), which
+    flamegraph.pl, speedscope and similar tools read directly. Note that with
+    asyncio every coroutine on the event loop thread is sampled, not only those of
+    the profiled request.
+    """
+
+    def __init__(self, thread_id: int | None = None, interval: float = 0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                    f":{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.items())
+
+
+recent_traces: "OrderedDict[str, Trace]" = OrderedDict()
+
+
+@contextmanager
+def start_trace(name: str, profile: bool = False) -> Iterator[Trace]:
+    """Activate a new trace for the current context and keep it for retrieval."""
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    if profile:
+        trace.profile = SamplingProfiler()
+        trace.profile.start()
+    try:
+        with span(name):
+            yield trace
+    finally:
+        if trace.profile is not None:
+            trace.profile.stop()
+        _current_trace.reset(token)
+        recent_traces[trace.id] = trace
+        while len(recent_traces) > MAX_STORED_TRACES:
+            recent_traces.popitem(last=False)
+        logger.info(
+            f"Recorded trace {trace.id} with {len(trace.spans)} spans",
+            extra={"trace_id": trace.id},
+        )
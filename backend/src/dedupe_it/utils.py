@@ -1,10 +1,12 @@
 import time
 import functools
 import asyncio
-from typing import Callable, TypeVar, ParamSpec
+import random
+from typing import Callable, Tuple, TypeVar, ParamSpec
 
-import anthropic
+from .hedging import Hedger
 from .logger import logger
+from .metrics import function_duration, llm_rate_limit_hits, llm_retries, stage_duration
 
 # For type hints
 T = TypeVar("T")
@@ -17,7 +19,8 @@ def timing_decorator(func: Callable) -> Callable:
         start = time.time()
         result = await func(*args, **kwargs)
         end = time.time()
-        logger.info(f"{func.__name__} took {end - start:.2f} seconds")
+        function_duration.labels(func.__qualname__).observe(end - start)
+        logger.debug("%s took %.2f seconds", func.__name__, end - start)
         return result
 
     @functools.wraps(func)
@@ -25,33 +28,105 @@ def timing_decorator(func: Callable) -> Callable:
         start = time.time()
         result = func(*args, **kwargs)
         end = time.time()
-        logger.info(f"{func.__name__} took {end - start:.2f} seconds")
+        function_duration.labels(func.__qualname__).observe(end - start)
+        logger.debug("%s took %.2f seconds", func.__name__, end - start)
         return result
 
     return async_wrapper if asyncio.iscoroutinefunction(func) else sync_wrapper
 
 
-def with_anthropic_retry(max_retries: int = 5, initial_delay: float = 1.0):
+@functools.lru_cache(maxsize=1)
+def transient_errors() -> Tuple[type[BaseException], ...]:
+    """Errors worth retrying: timeouts, dropped connections and 5xx responses
+    (which include 529 "overloaded"). Rate limits are handled separately.
+
+    anthropic is imported on the first call rather than with this module, which
+    keeps it off the import path of processes that never call the API.
+    """
+    import anthropic
+
+    return (anthropic.APIConnectionError, anthropic.InternalServerError, TimeoutError)
+
+
+class RetryBudget:
+    """Token bucket that limits retries of transient errors to a share of traffic.
+
+    Every first attempt deposits ``retry_ratio`` tokens and every retry spends one,
+    so when the API is degraded we stop amplifying load instead of multiplying it
+    by ``max_retries``. ``min_tokens`` lets a quiet process still retry.
+    """
+
+    def __init__(
+        self,
+        retry_ratio: float = 0.2,
+        min_tokens: float = 10.0,
+        max_tokens: float = 100.0,
+    ):
+        self.retry_ratio = retry_ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+
+    def record_request(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.retry_ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+anthropic_retry_budget = RetryBudget()
+
+
+def with_anthropic_retry(
+    max_retries: int = 5,
+    initial_delay: float = 1.0,
+    call_timeout: float | None = None,
+    deadline: float | None = None,
+    hedge: bool = False,
+):
     """
-    Decorator for handling Anthropic API rate limits with exponential backoff.
+    Decorator for handling Anthropic API rate limits and transient errors with
+    exponential backoff.
 
     Args:
         max_retries: Maximum number of retry attempts
         initial_delay: Initial delay in seconds before first retry
+        call_timeout: Timeout in seconds for a single attempt
+        deadline: Total time in seconds allowed across all attempts and backoff
+        hedge: Race a duplicate request against attempts slower than the recent p95
     """
 
     def decorator(func: Callable[P, T]) -> Callable[P, T]:
+        hedger = Hedger() if hedge else None
+        component = func.__qualname__.split(".")[0].lower()
+
         @functools.wraps(func)
         async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            import anthropic
+
             delay = initial_delay
+            give_up_at = time.monotonic() + deadline if deadline else None
             last_exception = None
 
-            for attempt in range(max_retries + 1):
+            async def attempt() -> T:
+                timeout = call_timeout
+                if give_up_at is not None:
+                    remaining = give_up_at - time.monotonic()
+                    timeout = min(timeout or remaining, remaining)
+                return await asyncio.wait_for(func(*args, **kwargs), timeout)
+
+            anthropic_retry_budget.record_request()
+            for attempt_number in range(max_retries + 1):
                 try:
-                    return await func(*args, **kwargs)
+                    if hedger is not None:
+                        return await hedger.run(attempt)
+                    return await attempt()
                 except anthropic.RateLimitError as e:
                     last_exception = e
-                    if attempt == max_retries:
+                    llm_rate_limit_hits.labels(component).inc()
+                    if attempt_number == max_retries:
                         logger.error(
                             f"Max retries ({max_retries}) exceeded for rate limit"
                         )
@@ -61,17 +136,42 @@ def with_anthropic_retry(max_retries: int = 5, initial_delay: float = 1.0):
                     retry_after = getattr(e, "retry_after", None)
                     wait_time = float(retry_after) if retry_after else delay
 
+                    llm_retries.labels(component, "rate_limit").inc()
                     logger.warning(
-                        f"Rate limit hit, attempt {attempt + 1}/{max_retries}. "
+                        f"Rate limit hit, attempt {attempt_number + 1}/{max_retries}. "
                         f"Waiting {wait_time:.2f}s before retry"
                     )
 
-                    await asyncio.sleep(wait_time)
-                    delay *= 2  # Exponential backoff
+                except transient_errors() as e:
+                    last_exception = e
+                    if attempt_number == max_retries:
+                        logger.error(
+                            f"Max retries ({max_retries}) exceeded for transient error"
+                        )
+                        raise
+                    if not anthropic_retry_budget.try_spend():
+                        logger.error("Retry budget exhausted, not retrying")
+                        raise
+
+                    # Full jitter keeps concurrent callers from retrying in lockstep
+                    wait_time = random.uniform(0, delay)
+
+                    llm_retries.labels(component, "transient").inc()
+                    logger.warning(
+                        f"Transient error ({type(e).__name__}), attempt "
+                        f"{attempt_number + 1}/{max_retries}. "
+                        f"Waiting {wait_time:.2f}s before retry"
+                    )
 
-                except Exception as e:
-                    # Don't retry other types of exceptions
-                    raise
+                if (
+                    give_up_at is not None
+                    and time.monotonic() + wait_time >= give_up_at
+                ):
+                    logger.error(f"Deadline of {deadline:.2f}s exceeded")
+                    raise last_exception
+
+                await asyncio.sleep(wait_time)
+                delay *= 2  # Exponential backoff
 
             raise last_exception
 
@@ -81,13 +181,25 @@ def with_anthropic_retry(max_retries: int = 5, initial_delay: float = 1.0):
 
 
 class Timer:
+    """Time a pipeline stage, usable with both ``with`` and ``async with``."""
+
     def __init__(self, name: str):
         self.name = name
 
-    async def __aenter__(self):
+    def __enter__(self):
         self.start = time.time()
         return self
 
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
+    def __exit__(self, exc_type, exc_val, exc_tb):
         end = time.time()
-        logger.info(f"{self.name} took {end - self.start:.2f} seconds")
+        stage_duration.labels(self.name).observe(end - self.start)
+        logger.info(
+            f"{self.name} took {end - self.start:.2f} seconds",
+            extra={"stage": self.name, "seconds": end - self.start},
+        )
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
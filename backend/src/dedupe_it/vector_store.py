@@ -1,47 +1,89 @@
+import asyncio
 from contextlib import asynccontextmanager
+import threading
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from typing import Dict, List
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple, TypeVar
 from functools import lru_cache
 import duckdb
 import polars as pl
-import json
 
+from .extensions import connect
 from .models import Record
+from .record_store import RecordBatch, RecordFrame, RecordStore, record_ids
 from .logger import logger
-from .utils import timing_decorator
-from pydantic import BaseModel, Field
+from .utils import Timer, timing_decorator
+from .startup import startup_phase
+from .tracing import traced
 
+if TYPE_CHECKING:
+    # Imports torch, which takes seconds; it is deferred until a model is loaded
+    from sentence_transformers import CrossEncoder, SentenceTransformer
 
-class StoreEntry(BaseModel):
-    vector: List[float] = Field(..., description="Embedding vector for the record")
-    id: str = Field(..., description="Unique identifier for the record")
-    data: Dict = Field(..., description="The actual record data")
-
-    def to_dict(self) -> Dict:
-        return self.model_dump()
-
-    @classmethod
-    def from_dict(cls, data: Dict) -> "StoreEntry":
-        return cls(**data)
+T = TypeVar("T")
 
 
 @asynccontextmanager
-async def vector_store(embedding_model_name: str):
+async def vector_store(embedding_model_name: str, **db_options):
     logger.info(f"Creating vector store for {embedding_model_name}")
-    vector_store = await VectorStore.create(embedding_model_name)
+    vector_store = await VectorStore.create(embedding_model_name, **db_options)
     try:
         yield vector_store
     finally:
         vector_store.close()
 
 
-duckdb.install_extension("vss")
+_model_lock = threading.Lock()
+
+
+def get_embedding_model(model_name: str) -> "SentenceTransformer":
+    # Loaded once, even when requests race to be the first to need it
+    with _model_lock:
+        return _load_embedding_model(model_name)
+
+
+@lru_cache(maxsize=1)
+def _load_embedding_model(model_name: str) -> "SentenceTransformer":
+    with startup_phase("embedding_model"):
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(model_name)
+
+
+def get_rerank_model(model_name: str) -> "CrossEncoder":
+    with _model_lock:
+        return _load_rerank_model(model_name)
 
 
 @lru_cache(maxsize=1)
-def get_embedding_model(model_name: str) -> SentenceTransformer:
-    return SentenceTransformer(model_name)
+def _load_rerank_model(model_name: str) -> "CrossEncoder":
+    with startup_phase("rerank_model"):
+        from sentence_transformers import CrossEncoder
+
+        return CrossEncoder(model_name, device="cpu")
+
+
+def encode_records(
+    embedding_model: "SentenceTransformer",
+    records: List[Record],
+    columns: List[str] | None = None,
+) -> np.ndarray:
+    """Embed records as an (n, dimension) float32 matrix of unit vectors."""
+    return embedding_model.encode(
+        record_texts(records, columns),
+        batch_size=32,  # Adjust based on your memory constraints
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+    )
+
+
+def record_texts(records: List[Record], columns: List[str] | None = None) -> List[str]:
+    """The text of each record that embeddings and LSH are computed from.
+
+    With ``columns``, only those fields make up the text.
+    """
+    if isinstance(records, RecordFrame):
+        return records.texts(exclude_prefix="_dedupit_", columns=columns)
+    return [VectorStore._format_record(record.data, columns) for record in records]
 
 
 class VectorStore:
@@ -52,37 +94,60 @@ class VectorStore:
     ):
         self.embedding_model = get_embedding_model(embedding_model_name)
         self.con = con
+        # Record data lives here; DuckDB only holds vectors and union-find state
+        self.records = RecordStore()
+        # Unions read roots and then repoint them, so they must not interleave
+        self._union_lock = threading.Lock()
         logger.info("Vector store initialized")
 
-    def union(self, record_id1: str, record_id2: str) -> None:
+    async def _run(self, operation: Callable[[duckdb.DuckDBPyConnection], T]) -> T:
+        """Run ``operation`` on a worker thread with a cursor of its own.
+
+        A cursor is a separate connection to the same database, so operations of
+        concurrent stages run in parallel without blocking the event loop, and
+        anything one registers is invisible to the others.
+        """
+
+        def run() -> T:
+            with self.con.cursor() as cursor:
+                return operation(cursor)
+
+        return await asyncio.to_thread(run)
+
+    @traced
+    async def union(self, row_id1: int, row_id2: int) -> None:
         """Merge two sets using union by rank.
 
         The rank-based union keeps the tree balanced by:
         1. Always attaching the shorter tree under the taller tree
         2. Increasing rank when combining trees of equal height
         """
-        self.con.execute(
-            f"""
+
+        def union(cursor: duckdb.DuckDBPyConnection) -> None:
+            with self._union_lock:
+                cursor.execute(query)
+
+        query = f"""
             WITH RECURSIVE find_root AS (
                 -- Base case: direct parent
-                SELECT id, parent_id, rank
+                SELECT row_id, parent_id, rank
                 FROM records
-                WHERE id IN ('{record_id1}', '{record_id2}')
+                WHERE row_id IN ({int(row_id1)}, {int(row_id2)})
                 
                 UNION ALL
                 
                 -- Recursive case: follow parent pointers
-                SELECT f.id, r.parent_id, r.rank
+                SELECT f.row_id, r.parent_id, r.rank
                 FROM find_root f
-                JOIN records r ON f.parent_id = r.id
-                WHERE r.id != r.parent_id
+                JOIN records r ON f.parent_id = r.row_id
+                WHERE r.row_id != r.parent_id
             ),
             roots AS (
                 -- Get the final roots and their ranks
-                SELECT id, parent_id, rank,
-                       ROW_NUMBER() OVER (ORDER BY rank DESC, id) as rn
+                SELECT row_id, parent_id, rank,
+                       ROW_NUMBER() OVER (ORDER BY rank DESC, row_id) as rn
                 FROM find_root
-                WHERE id = parent_id
+                WHERE row_id = parent_id
             ),
             new_rank AS (
                 -- Calculate new rank if ranks are equal
@@ -97,19 +162,19 @@ class VectorStore:
             SET parent_id = (SELECT parent_id FROM roots WHERE rn = 1),
                 rank = CASE 
                     -- Only update rank for the root of the larger tree if ranks were equal
-                    WHEN id = (SELECT parent_id FROM roots WHERE rn = 1)
+                    WHEN row_id = (SELECT parent_id FROM roots WHERE rn = 1)
                          AND (SELECT r1.rank FROM roots r1 JOIN roots r2 ON r1.rn = 1 AND r2.rn = 2 WHERE r1.rank = r2.rank)
                     THEN (SELECT rank FROM new_rank)
                     ELSE rank
                 END
-            WHERE id IN (
-                SELECT id 
+            WHERE row_id IN (
+                SELECT row_id 
                 FROM find_root 
                 WHERE parent_id = (SELECT parent_id FROM roots WHERE rn = 2)
             )
-            OR id = (SELECT parent_id FROM roots WHERE rn = 2)
+            OR row_id = (SELECT parent_id FROM roots WHERE rn = 2)
             """
-        )
+        await self._run(union)
 
     def close(self):
         try:
@@ -121,41 +186,80 @@ class VectorStore:
             raise
 
     @classmethod
-    async def create(cls, embedding_model_name: str) -> "VectorStore":
-        embedding_model = cls._init_embedding_model(embedding_model_name)
+    async def create(
+        cls,
+        embedding_model_name: str,
+        database: str = ":memory:",
+        memory_limit: str | None = None,
+        temp_directory: str | None = None,
+        index: bool = True,
+    ) -> "VectorStore":
+        """Create a store, in memory unless ``database`` names a file.
+
+        ``memory_limit`` and ``temp_directory`` bound DuckDB's memory and say where
+        it spills beyond that. Without ``index`` no HNSW index is built, for
+        callers that search vectors some other way.
+        """
+        embedding_model = get_embedding_model(embedding_model_name)
         logger.info(f"Embedding model initialized: {embedding_model_name}")
         dimension = embedding_model.get_sentence_embedding_dimension()
         logger.info(f"Embedding dimension: {dimension}")
-        con = await cls._init_db(dimension)
+        con = await cls._init_db(
+            dimension, database, memory_limit, temp_directory, index
+        )
         logger.info("DuckDB initialized")
         return cls(embedding_model_name, con)
 
     @classmethod
-    async def _init_db(cls, dimension: int) -> duckdb.DuckDBPyConnection:
+    async def _init_db(
+        cls,
+        dimension: int,
+        database: str = ":memory:",
+        memory_limit: str | None = None,
+        temp_directory: str | None = None,
+        index: bool = True,
+    ) -> duckdb.DuckDBPyConnection:
         # Initialize DuckDB connection with VSS extension
-        con = duckdb.connect()  # ":memory:"
-        con.load_extension("vss")
+        con = connect(database)
         logger.info("VSS extension loaded")
+        if memory_limit is not None:
+            con.execute(f"SET memory_limit = '{memory_limit}'")
+        if temp_directory is not None:
+            con.execute(f"SET temp_directory = '{temp_directory}'")
+        # Create tables and indexes - use execute instead of raw_sql. They are
+        # regular tables, since a TEMP table is only visible to the connection
+        # that created it and store operations each run on a cursor of their own
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                row_id BIGINT NOT NULL,
+                parent_id BIGINT NOT NULL,
+                rank INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (row_id)
+            )
+            """
+        )
+        logger.info("Records table created")
 
-        # Create tables and indexes - use execute instead of raw_sql
+        # Vectors are kept apart from union-find state, since records matched
+        # without embeddings (e.g. through LSH) have none
         con.execute(
             f"""
-            CREATE TEMP TABLE IF NOT EXISTS records (
+            CREATE TABLE IF NOT EXISTS vectors (
+                row_id BIGINT NOT NULL,
                 vector FLOAT[{dimension}] NOT NULL,
-                data JSON NOT NULL,
-                id STRING NOT NULL,
-                parent_id STRING NOT NULL,
-                rank INTEGER NOT NULL DEFAULT 0,
-                PRIMARY KEY (id)
+                PRIMARY KEY (row_id)
             )
             """
         )
-        logger.info("Records table created")
+        logger.info("Vectors table created")
 
         # Check if index exists
         indexes = con.execute("SELECT index_name FROM duckdb_indexes()").fetchall()
-        if not any(index[0] == "vector_idx" for index in indexes):
-            con.execute("CREATE INDEX vector_idx ON records USING HNSW (vector)")
+        if not index:
+            logger.info("Vector index skipped")
+        elif not any(row[0] == "vector_idx" for row in indexes):
+            con.execute("CREATE INDEX vector_idx ON vectors USING HNSW (vector)")
             logger.info("Vector index created")
         else:
             logger.info("Vector index already exists")
@@ -165,42 +269,33 @@ class VectorStore:
             CREATE VIEW IF NOT EXISTS record_groups AS
             WITH RECURSIVE find_roots AS (
                 -- Base case: all records
-                SELECT id, parent_id
+                SELECT row_id, parent_id
                 FROM records
                 
                 UNION ALL
                 
                 -- Recursive case: follow parent pointers to find roots
-                SELECT f.id, r.parent_id
+                SELECT f.row_id, r.parent_id
                 FROM find_roots f
-                JOIN records r ON f.parent_id = r.id
-                WHERE r.id != r.parent_id
+                JOIN records r ON f.parent_id = r.row_id
+                WHERE r.row_id != r.parent_id
             )
-            SELECT 
-                id,
-                LAST_VALUE(parent_id) OVER (
-                    PARTITION BY id 
-                    ORDER BY parent_id
-                    ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
-                ) as group_id
-            FROM find_roots
+            -- Each record has exactly one ancestor that is its own parent
+            SELECT f.row_id, f.parent_id AS group_id
+            FROM find_roots f
+            JOIN records r ON f.parent_id = r.row_id
+            WHERE r.row_id = r.parent_id
         """)
         logger.info("Record groups view created")
         return con
 
     @classmethod
-    def _init_embedding_model(cls, model_name: str) -> SentenceTransformer:
-        return SentenceTransformer(
-            model_name,
-            prompts={
-                "passage": "passage: ",
-            },
-            default_prompt_name="passage",
-        )
-
-    @classmethod
-    def _format_record(cls, record_data: Dict[str, str]) -> str:
+    def _format_record(
+        cls, record_data: Dict[str, str], columns: List[str] | None = None
+    ) -> str:
         """Combine record fields into a single string for embedding."""
+        if columns is not None:
+            record_data = {k: record_data[k] for k in columns if k in record_data}
         # Filter out internal fields
         text_fields = {
             k: v for k, v in record_data.items() if not k.startswith("_dedupit_")
@@ -226,213 +321,186 @@ class VectorStore:
             logger.error(f"Error generating embedding: {str(e)}")
             raise
 
+    @traced
     @timing_decorator
-    def add_record(self, record: Record) -> StoreEntry:
+    async def add_record(self, record: Record) -> RecordBatch:
         """Add a record and its embedding to the vector store."""
         try:
             logger.info(f"Adding record {record.id}")
             embedding = self._generate_embedding(record.data)
             logger.debug(f"Generated embedding of shape {embedding.shape}")
 
-            entry = StoreEntry(
-                vector=embedding.tolist(),
-                id=record.id,
-                data=record.data,
+            batch = RecordBatch(
+                [record.id],
+                self.records.add([record]),
+                embedding.reshape(1, -1),
+                self.records,
             )
-            logger.debug(f"Created StoreEntry for {record.id}")
-
-            entry_dict = entry.to_dict()
-            entry_dict["parent_id"] = record.id
-            entry_dict["rank"] = 0
-
-            # Convert to Polars DataFrame and insert
-            df = pl.DataFrame([entry_dict])
-            logger.debug(f"Created Polars DataFrame: {df.schema}")
-
-            self.con.execute("INSERT INTO records SELECT * FROM df")
+            await self._insert(batch)
             logger.info(f"Successfully inserted record {record.id}")
-            return entry
+            return batch
         except Exception as e:
             logger.error(f"Error adding record {record.id}: {str(e)}")
             raise
 
+    @traced
     @timing_decorator
     async def find_neighbors(
         self,
         query_embedding: np.ndarray | List[float],
         k: int,
-        exclude_record_id: str | None = None,
-    ) -> List[Record]:
+        exclude_row_id: int | None = None,
+    ) -> List[int]:
+        """Return the row ids of the ``k`` records nearest to the query."""
         try:
             logger.info(f"Finding {k} nearest neighbors")
             logger.debug(f"Query embedding shape/length: {len(query_embedding)}")
-            logger.debug(f"Excluding record: {exclude_record_id}")
+            logger.debug(f"Excluding row: {exclude_row_id}")
 
             query = f"""
-                SELECT id, data::TEXT as data FROM records
-                WHERE id != '{exclude_record_id}'
-                ORDER BY array_distance(vector, {query_embedding}::FLOAT[{len(query_embedding)}])
-                LIMIT {k}
+                SELECT row_id FROM vectors
+                WHERE row_id != ?
+                ORDER BY array_distance(vector, ?::FLOAT[{len(query_embedding)}])
+                LIMIT ?
             """
-            logger.debug("Executing neighbor search query")
-            result_df = self.con.execute(query).pl()
-            logger.debug(f"Found {len(result_df)} results")
-
-            results = result_df.to_dicts()
-            return [
-                Record.from_dict(
-                    {"id": result["id"], "data": json.loads(result["data"])}
-                )
-                for result in results
+            params = [
+                -1 if exclude_row_id is None else int(exclude_row_id),
+                list(map(float, query_embedding)),
+                k,
             ]
+            logger.debug("Executing neighbor search query")
+            rows = await self._run(
+                lambda cursor: cursor.execute(query, params).fetchall()
+            )
+            logger.debug(f"Found {len(rows)} results")
+            return [row[0] for row in rows]
         except Exception as e:
             logger.error(f"Error finding neighbors: {str(e)}")
             raise
 
+    @traced
     @timing_decorator
     async def find_neighbors_batch(
         self,
-        query_embeddings: List[np.ndarray | List[float]],
+        query_embeddings: np.ndarray,
         k: int,
-        exclude_record_ids: List[str | None],
-    ) -> List[List[Record]]:
+        exclude_row_ids: np.ndarray | List[int | None],
+    ) -> List[List[int]]:
+        """Return the row ids of the ``k`` nearest records for each query.
+
+        ``query_embeddings`` is an (n, dimension) matrix; ``exclude_row_ids`` gives
+        the row to leave out of each query's results, typically the query itself.
+        """
         try:
+            query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
             logger.info(
                 f"Finding {k} nearest neighbors for {len(query_embeddings)} queries"
             )
             logger.debug(f"First query embedding shape: {len(query_embeddings[0])}")
 
-            # Create temporary table
-            create_table_sql = f"""
-                CREATE TEMPORARY TABLE query_embeddings (
-                    query_id INTEGER,
-                    vector FLOAT[{len(query_embeddings[0])}],
-                    exclude_id STRING
+            # Queries go in as an Arrow view; the matrix becomes a fixed-size
+            # array column
+            if not isinstance(exclude_row_ids, np.ndarray):
+                exclude_row_ids = np.array(
+                    [-1 if row_id is None else row_id for row_id in exclude_row_ids],
+                    dtype=np.int64,
                 )
-            """
-            logger.debug("Creating temporary table with SQL: " + create_table_sql)
-            self.con.execute(create_table_sql)
-            logger.debug("Temporary table created")
-
-            # Prepare query data
-            query_data = [
+            query_df = pl.DataFrame(
                 {
-                    "query_id": i,
-                    "vector": embedding.tolist()
-                    if isinstance(embedding, np.ndarray)
-                    else embedding,
-                    "exclude_id": exclude_id if exclude_id else "",
+                    "query_id": np.arange(len(query_embeddings), dtype=np.int32),
+                    "vector": query_embeddings,
+                    "exclude_id": exclude_row_ids,
                 }
-                for i, (embedding, exclude_id) in enumerate(
-                    zip(query_embeddings, exclude_record_ids)
-                )
-            ]
-            logger.debug(f"Prepared {len(query_data)} query records")
-            logger.debug(f"Sample query data: {query_data[0]}")
-
-            # Insert using Polars
-            query_df = pl.DataFrame(query_data)
+            )
             logger.debug(f"Query DataFrame schema: {query_df.schema}")
 
-            self.con.execute("INSERT INTO query_embeddings SELECT * FROM query_df")
-            logger.debug("Inserted query data into temporary table")
-
             # Perform batch search
-            search_sql = """
+            search_sql = f"""
                 WITH neighbors AS (
                     SELECT 
                         q.query_id,
-                        r.id,
-                        r.data::TEXT as data,  -- Cast to TEXT to preserve the JSON string
+                        r.row_id,
                         array_distance(r.vector, q.vector) as distance,
                         ROW_NUMBER() OVER (
                             PARTITION BY q.query_id 
                             ORDER BY array_distance(r.vector, q.vector)
                         ) as rn
-                    FROM query_embeddings q
-                    CROSS JOIN records r
-                    WHERE (q.exclude_id = '' OR r.id != q.exclude_id)
+                    FROM (
+                        SELECT
+                            query_id,
+                            vector::FLOAT[{query_embeddings.shape[1]}] AS vector,
+                            exclude_id
+                        FROM query_embeddings
+                    ) q
+                    CROSS JOIN vectors r
+                    WHERE r.row_id != q.exclude_id
                 )
                 SELECT 
                     query_id,
-                    id,
-                    data,
+                    row_id,
                     distance
                 FROM neighbors
                 WHERE rn <= ?
                 ORDER BY query_id, distance
             """
-            logger.debug("Executing batch search query")
-            result_df = self.con.execute(search_sql, [k]).pl()
-            logger.debug(f"Search complete. Result shape: {result_df.shape}")
 
-            # Clean up
-            logger.debug("Dropping temporary table")
-            self.con.execute("DROP TABLE query_embeddings")
+            def search(cursor: duckdb.DuckDBPyConnection) -> pl.DataFrame:
+                # The view is registered on this operation's cursor only, so
+                # concurrent searches do not see each other's queries
+                cursor.register("query_embeddings", query_df.to_arrow())
+                with Timer("neighbor_search"):
+                    return cursor.execute(search_sql, [k]).pl()
 
-            # Convert to Polars and group results
-            results = []
-            for query_id in range(len(query_embeddings)):
-                group = result_df.filter(pl.col("query_id") == query_id)
-                logger.debug(
-                    f"Processing results for query {query_id}. Found {len(group)} matches"
-                )
+            logger.debug("Executing batch search query")
+            result_df = await self._run(search)
+            logger.debug(f"Search complete. Result shape: {result_df.shape}")
 
-                try:
-                    group_records = [
-                        Record.from_dict(
-                            {
-                                "id": row["id"],
-                                "data": json.loads(
-                                    row["data"]
-                                ),  # Parse the JSON string back to dict
-                            }
-                        )
-                        for row in group.to_dicts()
-                    ]
-                    results.append(group_records)
-                except Exception as e:
-                    logger.error(
-                        f"Error processing results for query {query_id}: {str(e)}"
-                    )
-                    logger.error(
-                        f"Sample row data: {group.head(1) if len(group) > 0 else 'No results'}"
-                    )
-                    raise
+            # Group neighbor row ids by query, keeping distance order
+            results: List[List[int]] = [[] for _ in query_embeddings]
+            grouped = result_df.group_by("query_id", maintain_order=True).agg(
+                pl.col("row_id")
+            )
+            for query_id, row_ids in grouped.iter_rows():
+                results[query_id] = row_ids
 
             logger.info(f"Successfully processed all {len(query_embeddings)} queries")
             return results
 
         except Exception as e:
             logger.error(f"Error in batch neighbor search: {str(e)}")
-            logger.error(
-                f"Query embeddings shape: {len(query_embeddings)}x{len(query_embeddings[0])}"
-            )
-            logger.error(f"Exclude record IDs: {exclude_record_ids}")
+            logger.error(f"Query embeddings shape: {np.shape(query_embeddings)}")
+            logger.error(f"Exclude row IDs: {exclude_row_ids}")
             raise
 
-    def get_groups(self, include_records: bool) -> pl.DataFrame:
-        """Return all records with their group (root) IDs."""
+    @traced
+    async def get_groups(self, include_records: bool) -> pl.DataFrame:
+        """Return all records with their group (root) IDs.
+
+        ``row_id`` and ``group_row_id`` address the record store; ``id`` and
+        ``group_id`` are the corresponding record ids. With ``include_records``
+        the record data is materialized into a ``data`` column.
+        """
         try:
             logger.info(f"Getting groups (include_records={include_records})")
 
-            if include_records:
-                query = """
-                    SELECT r.id, g.group_id, r.data::TEXT as data
-                    FROM records r
-                    JOIN record_groups g ON r.id = g.id
-                """
-            else:
-                query = "SELECT id, group_id FROM record_groups"
-
+            query = "SELECT row_id, group_id AS group_row_id FROM record_groups"
             logger.debug(f"Executing query: {query}")
-            result_df = self.con.execute(query).pl()
+            result_df = await self._run(lambda cursor: cursor.execute(query).pl())
             logger.debug(f"Got {len(result_df)} rows")
 
+            ids = pl.Series("id", self.records.ids, dtype=pl.String)
+            result_df = result_df.with_columns(
+                ids.gather(result_df["row_id"]).alias("id"),
+                ids.gather(result_df["group_row_id"]).alias("group_id"),
+            )
+
             if include_records:
-                # Convert the data to a list of dictionaries and process JSON
                 result_df = result_df.with_columns(
-                    [pl.col("data").str.json_decode().alias("data")]
+                    pl.Series(
+                        "data",
+                        self.records.get_many(result_df["row_id"].to_numpy()),
+                        dtype=pl.Object,
+                    )
                 )
 
             return result_df
@@ -447,207 +515,285 @@ class VectorStore:
                 )
             raise
 
-    def get_records(self, record_ids: List[str]) -> List[Record]:
-        try:
-            logger.info(f"Getting {len(record_ids)} records")
-            record_ids_str = ", ".join(f"'{id}'" for id in record_ids)
+    @traced
+    async def pair_similarities(
+        self, row_pairs: List[Tuple[int, int]]
+    ) -> List[float | None]:
+        """Cosine similarity of each pair's vectors; None where either has none."""
+        if not row_pairs:
+            return []
+        pairs = np.array(row_pairs, dtype=np.int64).reshape(-1, 2)
+        pairs_df = pl.DataFrame(
+            {
+                "position": np.arange(len(pairs), dtype=np.int64),
+                "row_id1": pairs[:, 0],
+                "row_id2": pairs[:, 1],
+            }
+        )
 
-            query = f"""
-                SELECT id, data::TEXT as data 
-                FROM records 
-                WHERE id IN ({record_ids_str})
-            """
-            logger.debug(f"Executing query: {query}")
+        def lookup(cursor: duckdb.DuckDBPyConnection) -> pl.DataFrame:
+            cursor.register("pairs_df", pairs_df.to_arrow())
+            return cursor.execute(
+                """
+                SELECT p.position, array_cosine_similarity(a.vector, b.vector)
+                FROM pairs_df p
+                JOIN vectors a ON a.row_id = p.row_id1
+                JOIN vectors b ON b.row_id = p.row_id2
+                """
+            ).pl()
+
+        found = await self._run(lookup)
+        similarities: List[float | None] = [None] * len(pairs)
+        for position, similarity in found.iter_rows():
+            similarities[position] = similarity
+        return similarities
+
+    @traced
+    async def vectors(self, row_ids: List[int] | np.ndarray) -> np.ndarray:
+        """The vectors of ``row_ids``, in the order given."""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        found = await self._run(
+            lambda cursor: cursor.execute(
+                """
+                SELECT row_id, vector FROM vectors
+                WHERE row_id IN (SELECT unnest(?::BIGINT[]))
+                """,
+                [row_ids.tolist()],
+            ).fetchnumpy()
+        )
+        order = np.argsort(found["row_id"])
+        positions = order[np.searchsorted(found["row_id"], row_ids, sorter=order)]
+        return np.stack(found["vector"][positions]).astype(np.float32)
+
+    @traced
+    async def remove_rows(self, row_ids: List[int]) -> None:
+        """Delete rows and their vectors. Nothing else may point at them, so
+        their groups are split with ``reset_rows`` first."""
+
+        def remove(cursor: duckdb.DuckDBPyConnection) -> None:
+            with self._union_lock:
+                for table in ("vectors", "records"):
+                    cursor.execute(
+                        f"""
+                        DELETE FROM {table}
+                        WHERE row_id IN (SELECT unnest(?::BIGINT[]))
+                        """,
+                        [list(row_ids)],
+                    )
 
-            result_df = self.con.execute(query).pl()
-            logger.debug(f"Got {len(result_df)} records")
+        await self._run(remove)
+
+    @traced
+    async def reset_rows(self, row_ids: List[int]) -> None:
+        """Make each row its own group again. ``row_ids`` must cover whole
+        groups, or rows outside them would be left pointing in."""
+
+        def reset(cursor: duckdb.DuckDBPyConnection) -> None:
+            with self._union_lock:
+                cursor.execute(
+                    """
+                    UPDATE records SET parent_id = row_id, rank = 0
+                    WHERE row_id IN (SELECT unnest(?::BIGINT[]))
+                    """,
+                    [list(row_ids)],
+                )
 
-            # Parse JSON strings to dictionaries
-            records = [
-                Record.from_dict({"id": row["id"], "data": json.loads(row["data"])})
-                for row in result_df.to_dicts()
-            ]
+        await self._run(reset)
+
+    @traced
+    async def group_row_ids(self) -> List[Tuple[int, List[int]]]:
+        """(group row id, member row ids) of every group of more than one record."""
+        return await self._run(
+            lambda cursor: cursor.execute(
+                """
+                SELECT group_id, list(row_id ORDER BY row_id)
+                FROM record_groups
+                GROUP BY group_id
+                HAVING count(*) > 1
+                """
+            ).fetchall()
+        )
 
+    @traced
+    def get_records(self, record_ids: List[str]) -> List[Record]:
+        try:
+            logger.info(f"Getting {len(record_ids)} records")
+            records = self.records.records(
+                self.records.row_ids(
+                    [record_id for record_id in record_ids if record_id in self.records]
+                )
+            )
             logger.info(f"Successfully retrieved {len(records)} records")
             return records
 
         except Exception as e:
             logger.error(f"Error getting records: {str(e)}")
             logger.error(f"Record IDs: {record_ids}")
-            if "result_df" in locals():
-                logger.error(f"Result DataFrame schema: {result_df.schema}")
-                logger.error(
-                    f"Sample row: {result_df.head(1) if len(result_df) > 0 else 'No results'}"
-                )
             raise
 
-    def _generate_embeddings_batch(self, records: List[Record]) -> List[np.ndarray]:
+    @traced
+    def _generate_embeddings_batch(
+        self, records: List[Record], columns: List[str] | None = None
+    ) -> np.ndarray:
         """Generate embeddings for multiple records in batch."""
-        texts = [self._format_record(record.data) for record in records]
-        embeddings = self.embedding_model.encode(
-            texts,
-            batch_size=32,  # Adjust based on your memory constraints
-            normalize_embeddings=True,
-            convert_to_numpy=True,
-        )
-        return embeddings
+        return encode_records(self.embedding_model, records, columns)
+
+    async def _insert(self, batch: RecordBatch) -> None:
+        """Insert a batch, each record starting as its own root."""
 
-    def add_records_batch(self, records: List[Record]) -> List[StoreEntry]:
-        """Add multiple records and their embeddings to the vector store in batch."""
+        def insert(cursor: duckdb.DuckDBPyConnection) -> None:
+            df = pl.DataFrame({"row_id": batch.row_ids})
+            with Timer("insert"):
+                cursor.execute(
+                    "INSERT INTO records (row_id, parent_id) SELECT row_id, row_id FROM df"
+                )
+                if batch.embeddings is not None:
+                    # The embedding matrix becomes a fixed-size array column
+                    # without going through per-row Python lists
+                    vectors_df = pl.DataFrame(
+                        {"row_id": batch.row_ids, "vector": batch.embeddings}
+                    )
+                    cursor.execute("INSERT INTO vectors SELECT * FROM vectors_df")
+
+        await self._run(insert)
+
+    @traced
+    async def add_records_batch(
+        self,
+        records: List[Record],
+        embeddings: np.ndarray | None = None,
+        embed: bool = True,
+    ) -> RecordBatch:
+        """Add multiple records and their embeddings to the vector store in batch.
+
+        Embeddings are generated unless already computed elsewhere and passed in,
+        or unless ``embed`` is False, in which case the records can be grouped but
+        are not indexed for neighbor search.
+        """
         try:
             logger.info(f"Adding batch of {len(records)} records")
-            embeddings = self._generate_embeddings_batch(records)
-            logger.debug(f"Generated {len(embeddings)} embeddings")
-
-            entries = []
-            records_data = []
-            for record, embedding in zip(records, embeddings):
-                try:
-                    entry = StoreEntry(
-                        vector=embedding.tolist(),
-                        id=record.id,
-                        data=record.data,
-                    )
-                    entries.append(entry)
-
-                    record_dict = entry.to_dict()
-                    # Ensure data is properly JSON serialized
-                    record_dict["data"] = json.dumps(record_dict["data"])
-                    record_dict["parent_id"] = record.id
-                    record_dict["rank"] = 0
-                    records_data.append(record_dict)
-
-                    logger.debug(f"Prepared record {record.id} for insertion")
-                    logger.debug(f"Record data type: {type(record_dict['data'])}")
-
-                except Exception as e:
-                    logger.error(f"Error processing record {record.id}: {str(e)}")
-                    logger.error(f"Record data: {record.data}")
-                    raise
-
-            # Use Polars for batch insert
-            df = pl.DataFrame(records_data)
-            logger.debug(f"Created Polars DataFrame with schema: {df.schema}")
-            logger.debug(f"First row sample: {df.head(1)}")
-
-            # Create a temporary view of the data
-            self.con.execute("CREATE TEMPORARY TABLE temp_records AS SELECT * FROM df")
-            self.con.execute("""
-                INSERT INTO records 
-                SELECT 
-                    vector,
-                    CAST(data AS JSON) as data,
-                    id,
-                    parent_id,
-                    rank
-                FROM temp_records
-            """)
-            self.con.execute("DROP TABLE temp_records")
+            if embeddings is None and embed:
+                with Timer("embedding"):
+                    embeddings = self._generate_embeddings_batch(records)
+                logger.debug(f"Generated {len(embeddings)} embeddings")
+
+            batch = RecordBatch(
+                record_ids(records),
+                self.records.add(records),
+                embeddings,
+                self.records,
+            )
+            await self._insert(batch)
 
             logger.info(f"Successfully inserted {len(records)} records")
-            return entries
+            return batch
         except Exception as e:
             logger.error(f"Error in batch insert: {str(e)}")
-            logger.error(
-                f"DataFrame schema: {df.schema if 'df' in locals() else 'Not created'}"
-            )
             raise
 
-    def batch_union(self, record_pairs: List[tuple[str, str]]) -> None:
+    @traced
+    async def batch_union(self, record_pairs: List[tuple[int, int]]) -> None:
         """Merge multiple pairs of sets using union by rank in batch.
 
+        The current roots of all records involved are looked up once and the pairs
+        are unioned over those roots in memory, so pairs that chain together or
+        touch non-root records are all honoured. Each absorbed root, and every
+        record pointing at it directly, is then repointed at its new root.
+
         Args:
-            record_pairs: List of (record_id1, record_id2) tuples to union
+            record_pairs: List of (row_id1, row_id2) tuples to union
         """
-        # Create a temporary table for the pairs
-        self.con.execute("""
-            CREATE TEMPORARY TABLE record_pairs (
-                record_id1 STRING,
-                record_id2 STRING
+        if not record_pairs:
+            return
+
+        def union(cursor: duckdb.DuckDBPyConnection) -> None:
+            with self._union_lock:
+                self._batch_union(cursor, record_pairs)
+
+        await self._run(union)
+
+    def _batch_union(
+        self,
+        cursor: duckdb.DuckDBPyConnection,
+        record_pairs: List[tuple[int, int]],
+    ) -> None:
+        # Roots are found by following parent pointers from the records involved
+        # only, level by level, rather than through the record_groups view,
+        # which resolves every record in the table
+        roots: Dict[int, int] = {}
+        ancestors = {row_id: row_id for pair in record_pairs for row_id in pair}
+        while ancestors:
+            parents = dict(
+                cursor.execute(
+                    """
+                    SELECT row_id, parent_id
+                    FROM records
+                    WHERE row_id IN (SELECT unnest(?::BIGINT[]))
+                    """,
+                    [list(set(ancestors.values()))],
+                ).fetchall()
             )
-        """)
+            next_ancestors = {}
+            for row_id, ancestor in ancestors.items():
+                if parents[ancestor] == ancestor:
+                    roots[row_id] = ancestor
+                else:
+                    next_ancestors[row_id] = parents[ancestor]
+            ancestors = next_ancestors
+        ranks = dict(
+            cursor.execute(
+                "SELECT row_id, rank FROM records WHERE row_id IN (SELECT unnest(?::BIGINT[]))",
+                [list(set(roots.values()))],
+            ).fetchall()
+        )
 
-        # Insert the pairs
-        pairs_df = pl.DataFrame(
+        parent = {root: root for root in ranks}
+
+        def find(row_id: int) -> int:
+            while parent[row_id] != row_id:
+                parent[row_id] = parent[parent[row_id]]
+                row_id = parent[row_id]
+            return row_id
+
+        for row_id1, row_id2 in record_pairs:
+            root1, root2 = find(roots[row_id1]), find(roots[row_id2])
+            if root1 == root2:
+                continue
+            # Attach the shorter tree under the taller one, using the id as tiebreaker
+            if (ranks[root1], -root1) < (ranks[root2], -root2):
+                root1, root2 = root2, root1
+            parent[root2] = root1
+            if ranks[root1] == ranks[root2]:
+                ranks[root1] += 1
+
+        moves = [(root, find(root)) for root in parent if find(root) != root]
+        if not moves:
+            return
+        new_roots = {new_root for _, new_root in moves}
+        moves_df = pl.DataFrame(
             {
-                "record_id1": [pair[0] for pair in record_pairs],
-                "record_id2": [pair[1] for pair in record_pairs],
-            }
+                "old_root": [old_root for old_root, _ in moves],
+                "new_root": [new_root for _, new_root in moves],
+            },
+            schema={"old_root": pl.Int64, "new_root": pl.Int64},
+        )
+        ranks_df = pl.DataFrame(
+            {
+                "row_id": list(new_roots),
+                "rank": [ranks[root] for root in new_roots],
+            },
+            schema={"row_id": pl.Int64, "rank": pl.Int32},
         )
-        self.con.execute("INSERT INTO record_pairs SELECT * FROM pairs_df")
 
-        # Perform batch union
-        self.con.execute("""
-            WITH RECURSIVE find_root AS (
-                -- Base case: direct parent for all pairs
-                SELECT id, parent_id, rank
-                FROM records
-                WHERE id IN (
-                    SELECT record_id1 FROM record_pairs
-                    UNION
-                    SELECT record_id2 FROM record_pairs
-                )
-                
-                UNION ALL
-                
-                -- Recursive case: follow parent pointers
-                SELECT f.id, r.parent_id, r.rank
-                FROM find_root f
-                JOIN records r ON f.parent_id = r.id
-                WHERE r.id != r.parent_id
-            ),
-            roots AS (
-                -- Get the final roots and their ranks for each pair
-                SELECT 
-                    p.record_id1,
-                    p.record_id2,
-                    r1.parent_id as root1,
-                    r2.parent_id as root2,
-                    r1.rank as rank1,
-                    r2.rank as rank2
-                FROM record_pairs p
-                JOIN find_root r1 ON r1.id = p.record_id1
-                JOIN find_root r2 ON r2.id = p.record_id2
-                WHERE r1.id = r1.parent_id  -- Only get roots
-                  AND r2.id = r2.parent_id
-            ),
-            updates AS (
-                -- Determine the new parent and rank for each pair
-                SELECT 
-                    CASE 
-                        WHEN rank1 > rank2 THEN root1
-                        WHEN rank2 > rank1 THEN root2
-                        WHEN root1 < root2 THEN root1  -- Use ID as tiebreaker
-                        ELSE root2
-                    END as new_parent,
-                    CASE 
-                        WHEN rank1 = rank2 THEN rank1 + 1
-                        ELSE GREATEST(rank1, rank2)
-                    END as new_rank,
-                    CASE 
-                        WHEN rank1 > rank2 THEN root2
-                        WHEN rank2 > rank1 THEN root1
-                        WHEN root1 < root2 THEN root2
-                        ELSE root1
-                    END as old_parent
-                FROM roots
-            )
-            UPDATE records 
-            SET 
-                parent_id = u.new_parent,
-                rank = CASE 
-                    WHEN id = u.new_parent AND EXISTS (
-                        SELECT 1 FROM roots r 
-                        WHERE r.rank1 = r.rank2 
-                        AND (r.root1 = u.new_parent OR r.root2 = u.new_parent)
-                    )
-                    THEN u.new_rank
-                    ELSE rank
-                END
-            FROM updates u
-            WHERE records.parent_id = u.old_parent
-               OR records.id = u.old_parent
+        cursor.execute("""
+            UPDATE records
+            SET parent_id = m.new_root
+            FROM moves_df m
+            WHERE records.parent_id = m.old_root
+        """)
+        cursor.execute("""
+            UPDATE records
+            SET rank = r.rank
+            FROM ranks_df r
+            WHERE records.row_id = r.row_id
         """)
-
-        # Clean up
-        self.con.execute("DROP TABLE record_pairs")
@@ -1,14 +1,61 @@
+# Imports are most of a cold start, so they are timed as a startup phase; the
+# rest are imported after the clock starts on purpose
+# ruff: noqa: E402
+import time
+
+_started = time.perf_counter()
+
+import asyncio
 import os
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Request
+import random
+from contextlib import asynccontextmanager, nullcontext
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from pydantic import TypeAdapter, ValidationError
 from typing import List
-from .dedupe_it.service import dedupe_records
-from .dedupe_it.models import Record
+from .dedupe_it.service import close_jobs, dedupe_records, update_records
+from .dedupe_it.config import Config
+from .dedupe_it.errors import InvalidInputError
+from .dedupe_it.extensions import connect
+from .dedupe_it.linkage import ReferenceIndexes, link_records
+from .dedupe_it.tables import (
+    MEDIA_TYPES,
+    read_table,
+    records_from_table,
+    response_media_type,
+    result_table,
+    write_table,
+)
+from .dedupe_it.models import Record, RecordChanges
 from .dedupe_it.logger import logger
+from .dedupe_it.metrics import registry
+from .dedupe_it.startup import record, report, startup_phase
+from .dedupe_it.tracing import recent_traces, start_trace
+from .dedupe_it.vector_store import get_embedding_model
 from dotenv import load_dotenv
 
 load_dotenv()
+record("import", time.perf_counter() - _started)
+
+# Share of /dedupe requests traced without being asked to via X-Dedupe-Trace
+TRACE_SAMPLE_RATE = float(os.getenv("DEDUPE_TRACE_SAMPLE_RATE", "0"))
+# Load the embedding model in the background at startup rather than on the first
+# request; the server takes requests meanwhile
+PRELOAD_EMBEDDING_MODEL = os.getenv("DEDUPE_PRELOAD_EMBEDDING_MODEL", "true") == "true"
+# Largest reference dataset /references/{name} indexes in one request
+MAX_REFERENCE_RECORDS = int(os.getenv("DEDUPE_MAX_REFERENCE_RECORDS", "100000"))
+MAX_REFERENCE_BYTES = int(os.getenv("DEDUPE_MAX_REFERENCE_BYTES", str(100 << 20)))
+# Largest table /dedupe/table takes. Its records are matched in memory, where
+# every record's neighbors are searched against every other record, so the cost
+# grows with the square of the rows
+MAX_TABLE_ROWS = int(os.getenv("DEDUPE_MAX_TABLE_ROWS", "1000"))
+MAX_TABLE_BYTES = int(os.getenv("DEDUPE_MAX_TABLE_BYTES", str(16 << 20)))
+
+# Reference indexes stay open between /link requests and are swapped on rebuild
+_references = ReferenceIndexes(Config().reference_dir)
+# Parses /references/{name} bodies, which are read before they are validated
+_RECORDS = TypeAdapter(List[Record])
 
 
 @asynccontextmanager
@@ -16,9 +63,25 @@ async def lifespan(app: FastAPI):
     # Startup
     port = os.getenv("PORT", "8080")
     logger.info(f"Starting server with PORT={port}")
+    # Fails fast if the vss extension is neither bundled nor installable
+    with startup_phase("duckdb_extensions"):
+        connect().close()
+    preload = None
+    if PRELOAD_EMBEDDING_MODEL:
+        preload = asyncio.create_task(
+            asyncio.to_thread(get_embedding_model, Config().embedding_model_name)
+        )
+    ready = time.perf_counter() - _started
+    logger.info(
+        f"Server ready {ready:.2f} seconds after imports began",
+        extra={"startup": report()},
+    )
     yield
+    if preload is not None:
+        preload.cancel()
     # Shutdown
     logger.info("Shutting down server")
+    close_jobs()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -34,7 +97,14 @@ app.add_middleware(
 
 
 @app.post("/dedupe")
-async def dedupe(records: List[Record], request: Request):
+async def dedupe(
+    records: List[Record],
+    request: Request,
+    response: Response,
+    job_id: str | None = None,
+    max_llm_calls: int | None = None,
+    max_llm_tokens: int | None = None,
+):
     try:
         # Check number of records
         if len(records) > 100:
@@ -51,10 +121,205 @@ async def dedupe(records: List[Record], request: Request):
                 detail="Request too large. Maximum allowed size is 100KB.",
             )
 
-        result = await dedupe_records(records)
+        profile = request.headers.get("x-dedupe-profile") == "1"
+        trace_requested = (
+            profile
+            or request.headers.get("x-dedupe-trace") == "1"
+            or random.random() < TRACE_SAMPLE_RATE
+        )
+        with (
+            start_trace("dedupe", profile)
+            if trace_requested
+            else nullcontext() as trace
+        ):
+            result = await dedupe_records(
+                records,
+                Config(
+                    job_id=job_id,
+                    llm_call_budget=max_llm_calls,
+                    llm_token_budget=max_llm_tokens,
+                ),
+            )
+        if trace is not None:
+            response.headers["X-Dedupe-Trace-Id"] = trace.id
         return result
     except HTTPException:
         raise
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _read_body(request: Request, max_bytes: int) -> bytes:
+    """The request body, read no further than ``max_bytes`` whatever
+    Content-Length claims."""
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Request too large. Maximum allowed size is {max_bytes} bytes.",
+            )
+    return bytes(body)
+
+
+@app.post("/dedupe/table")
+async def dedupe_table(
+    request: Request,
+    id_column: str = "id",
+    job_id: str | None = None,
+    max_llm_calls: int | None = None,
+    max_llm_tokens: int | None = None,
+):
+    """Dedupe a Parquet or Arrow IPC table in bulk.
+
+    The response is a table of (record_id, group_id, merged), in the format named
+    by the Accept header or else the request's own format.
+    """
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if media_type not in MEDIA_TYPES:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Content-Type must be one of {', '.join(MEDIA_TYPES)}",
+        )
+    response_type = response_media_type(request.headers.get("accept"), media_type)
+    if response_type is None:
+        raise HTTPException(
+            status_code=406,
+            detail=f"Accept must allow one of {', '.join(MEDIA_TYPES)}",
+        )
+
+    body = await _read_body(request, MAX_TABLE_BYTES)
+    try:
+        table = read_table(body, media_type)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid table: {e}")
+    if table.num_rows > MAX_TABLE_ROWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many records. Maximum allowed is {MAX_TABLE_ROWS} records; "
+            "dedupe larger tables out of core with the CLI's --out-of-core.",
+        )
+    try:
+        records = records_from_table(table, id_column)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid table: {e}")
+
+    try:
+        result = await dedupe_records(
+            records,
+            Config(
+                job_id=job_id,
+                llm_call_budget=max_llm_calls,
+                llm_token_budget=max_llm_tokens,
+            ),
+        )
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return Response(
+        write_table(result_table(result.groups), response_type),
+        media_type=response_type,
+    )
+
+
+@app.post("/dedupe/{job_id}/changes")
+async def dedupe_changes(job_id: str, changes: RecordChanges, request: Request):
+    """Upsert and delete records of a job run with ?job_id=, regrouping only what
+    the changes touch. Returns the job's groups after the changes."""
+    if len(changes.upserts) + len(changes.deletes) > 100:
+        raise HTTPException(
+            status_code=413,
+            detail="Too many changes. Maximum allowed is 100 records.",
+        )
+    body = await request.body()
+    if len(body) > 102400:
+        raise HTTPException(
+            status_code=413,
+            detail="Request too large. Maximum allowed size is 100KB.",
+        )
+
+    try:
+        return await update_records(job_id, changes.upserts, changes.deletes, Config())
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post(
+    "/references/{name}",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": Record.model_json_schema()}
+                }
+            },
+        }
+    },
+)
+async def create_reference(name: str, request: Request):
+    """Embed and index a reference dataset for record linkage.
+
+    The body is a JSON list of records. It is read up to the size cap before
+    anything is parsed, so an oversized upload is refused without being held
+    in memory as records.
+    """
+    body = await _read_body(request, MAX_REFERENCE_BYTES)
+    try:
+        records = _RECORDS.validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=e.errors(
+                include_url=False, include_input=False, include_context=False
+            ),
+        )
+    if len(records) > MAX_REFERENCE_RECORDS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many records. Maximum allowed is {MAX_REFERENCE_RECORDS} "
+            "records.",
+        )
+
+    try:
+        size = await _references.build(name, records, Config().embedding_model_name)
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"name": name, "records": size}
+
+
+@app.post("/link/{name}")
+async def link(name: str, records: List[Record], request: Request):
+    """Match records against a reference dataset built with /references/{name}."""
+    if len(records) > 100:
+        raise HTTPException(
+            status_code=413,
+            detail="Too many records. Maximum allowed is 100 records.",
+        )
+    body = await request.body()
+    if len(body) > 102400:
+        raise HTTPException(
+            status_code=413,
+            detail="Request too large. Maximum allowed size is 100KB.",
+        )
+
+    try:
+        async with _references.use(name) as index:
+            return await link_records(records, index, Config())
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -62,3 +327,28 @@ async def dedupe(records: List[Record], request: Request):
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "port": os.getenv("PORT", "8080")}
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/traces/{trace_id}")
+async def get_trace(trace_id: str, format: str = "json"):
+    """Return a recorded trace as span JSON or in Chrome trace event format."""
+    trace = recent_traces.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_chrome() if format == "chrome" else trace.to_json()
+
+
+@app.get("/traces/{trace_id}/profile")
+async def get_trace_profile(trace_id: str):
+    """Return the CPU profile of a traced request in collapsed-stack format."""
+    trace = recent_traces.get(trace_id)
+    if trace is None or trace.profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(trace.profile.collapsed())
@@ -0,0 +1,66 @@
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from dedupe_it import service, vector_store
+from dedupe_it.comparator import Comparator
+from dedupe_it.merger import Merger
+from dedupe_it.metrics import record_llm_usage
+
+DIMENSION = 32
+# Usage the fake LLM reports per call; merges send whole groups
+COMPARE_USAGE = SimpleNamespace(input_tokens=90, output_tokens=10)
+MERGE_USAGE = SimpleNamespace(input_tokens=400, output_tokens=100)
+
+
+class FakeEmbeddingModel:
+    """Bag-of-words vectors, so records sharing words are near each other."""
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return DIMENSION
+
+    def encode(self, texts, **kwargs) -> np.ndarray:
+        vectors = np.zeros((len(texts), DIMENSION), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                digest = hashlib.sha256(word.encode()).digest()
+                vectors[i, digest[0] % DIMENSION] += 1.0
+        vectors += 1e-3
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def llm_usage():
+    """Usage the fake LLM reports per comparison and per merge."""
+    return SimpleNamespace(compare=COMPARE_USAGE, merge=MERGE_USAGE)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Fake embedding model and LLM: records are duplicates when their names
+    share a word. Calls are counted and charged to the running job's budget."""
+    calls = {"compare": [], "merge": 0}
+
+    async def are_duplicates(self, data1, data2, similarity=None):
+        calls["compare"].append((data1["name"], data2["name"]))
+        await asyncio.sleep(0)
+        record_llm_usage("comparator", COMPARE_USAGE)
+        words1 = set(data1["name"].lower().split())
+        return bool(words1 & set(data2["name"].lower().split()))
+
+    async def merge_records(self, records):
+        calls["merge"] += 1
+        await asyncio.sleep(0)
+        record_llm_usage("merger", MERGE_USAGE)
+        return {"name": " / ".join(sorted(record["name"] for record in records))}
+
+    monkeypatch.setattr(
+        vector_store, "_load_embedding_model", lambda name: FakeEmbeddingModel()
+    )
+    monkeypatch.setattr(Comparator, "are_duplicates", are_duplicates)
+    monkeypatch.setattr(Merger, "merge_records", merge_records)
+    yield calls
+    service.close_jobs()
@@ -0,0 +1,138 @@
+import json
+
+from dedupe_it.batch import MessageBatchRunner
+from dedupe_it.budget import Budget, spending
+from dedupe_it.comparator import Comparator
+from dedupe_it.config import Config
+from dedupe_it.grouper import Grouper
+from dedupe_it.metrics import record_llm_usage
+from dedupe_it.models import Record
+from dedupe_it.service import dedupe_records
+
+
+def test_merges_are_estimated_at_their_own_cost(llm_usage):
+    budget = Budget(max_tokens=2000)
+    assert budget.remaining_calls(merges=True) == 1
+    with spending(budget):
+        for _ in range(5):
+            record_llm_usage("comparator", llm_usage.compare)
+        # Without merges yet, merges are estimated at the average call
+        assert budget.remaining_calls(merges=True) == 15
+        record_llm_usage("merger", llm_usage.merge)
+
+    assert budget.merge_calls == 1
+    assert budget.remaining_calls(merges=True) == 2
+    assert budget.remaining_calls() == 10
+    with spending(budget):
+        # Merge answers from a message batch
+        record_llm_usage("batch", llm_usage.merge, merge=True)
+    assert budget.merge_calls == 2
+
+
+async def test_comparisons_leave_room_for_every_cascade_tier(monkeypatch, llm_usage):
+    config = Config(
+        compare_models=["small", "medium", "large"],
+        llm_call_budget=10,
+        llm_budget_merge_share=0.0,
+    )
+    grouper = Grouper(config, vector_store=None)
+
+    async def compare(row_pairs):
+        # Every pair is passed up to the last tier
+        for _ in row_pairs:
+            for _ in config.compare_models:
+                record_llm_usage("comparator", llm_usage.compare)
+        return [False] * len(row_pairs)
+
+    monkeypatch.setattr(grouper, "_compare", compare)
+    budget = Budget(config.llm_call_budget)
+    with spending(budget):
+        await grouper._compare_within_budget(
+            [(i, i + 1) for i in range(0, 20, 2)], [0] * 10, []
+        )
+
+    assert budget.calls <= config.llm_call_budget
+    assert grouper.pairs_compared == 3
+    assert grouper.pairs_skipped == 7
+
+
+async def test_merges_stop_at_the_token_budget(llm, llm_usage):
+    records = four_pairs()
+    config = Config(
+        embedding_model_name="fake-embedding-model",
+        match_columns=["name"],
+        llm_concurrency=4,
+    )
+    unbudgeted = await dedupe_records(records, config)
+    assert len(unbudgeted.groups) == 4
+    comparison_tokens = len(llm["compare"]) * token_count(llm_usage.compare)
+
+    # Room for every comparison and two of the four merges
+    config.llm_token_budget = comparison_tokens + 5 * token_count(llm_usage.merge) // 2
+    config.llm_budget_merge_share = 0.1
+    result = await dedupe_records(records, config)
+
+    assert result.coverage.llm_tokens <= config.llm_token_budget
+    assert result.coverage.pairs_skipped == 0
+    assert result.coverage.groups_total == 4
+    assert result.coverage.groups_merged == 2
+    assert result.coverage.budget_exhausted
+    unmerged = [group for group in result.groups if not group.merged]
+    assert all(" / " not in group.merged_data["name"] for group in unmerged)
+
+
+async def test_bulk_merges_are_charged_and_sized_to_the_token_budget(
+    llm, llm_usage, monkeypatch, tmp_path
+):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    batches = []
+
+    async def are_duplicates_bulk(self, pairs, similarities=None):
+        return [await self.are_duplicates(data1, data2) for data1, data2 in pairs]
+
+    async def run(self, requests):
+        batches.append(len(requests))
+        for _ in requests:
+            record_llm_usage("batch", llm_usage.merge, merge=self.merges)
+        return [json.dumps({"name": "merged"})] * len(requests)
+
+    monkeypatch.setattr(Comparator, "are_duplicates_bulk", are_duplicates_bulk)
+    monkeypatch.setattr(MessageBatchRunner, "run", run)
+    records = four_pairs()
+    config = Config(
+        embedding_model_name="fake-embedding-model",
+        match_columns=["name"],
+        bulk_mode=True,
+        batch_state_dir=str(tmp_path),
+    )
+    await dedupe_records(records, config)
+    assert batches == [4]
+    comparison_tokens = len(llm["compare"]) * token_count(llm_usage.compare)
+
+    # The first merge is priced in real time, then the batch gets what is left
+    config.llm_token_budget = comparison_tokens + 5 * token_count(llm_usage.merge) // 2
+    config.llm_budget_merge_share = 0.1
+    result = await dedupe_records(records, config)
+
+    assert llm["merge"] == 1
+    assert batches == [4, 1]
+    assert result.coverage.llm_tokens <= config.llm_token_budget
+    assert result.coverage.groups_merged == 2
+
+
+def four_pairs():
+    names = [
+        "red fox",
+        "fox hound",
+        "blue whale",
+        "whale shark",
+        "green tree",
+        "tree house",
+        "yellow sun",
+        "sun ray",
+    ]
+    return [Record(id=str(i), data={"name": name}) for i, name in enumerate(names)]
+
+
+def token_count(usage) -> int:
+    return usage.input_tokens + usage.output_tokens
@@ -0,0 +1,19 @@
+from dedupe_it.config import Config
+from dedupe_it.models import Record
+from dedupe_it.service import dedupe_records
+
+
+async def test_copies_must_agree_beyond_the_match_columns(llm):
+    records = [
+        Record(id="a", data={"name": "Red Fox", "note": "x", "_dedupit_row": 1}),
+        Record(id="b", data={"name": "red  fox", "note": "X", "_dedupit_row": 2}),
+        Record(id="c", data={"name": "red fox", "note": "y"}),
+    ]
+    config = Config(embedding_model_name="fake-embedding-model", match_columns=["name"])
+    result = await dedupe_records(records, config)
+
+    # a and b are copies, while c differs in a column not matched on and is
+    # merged with them rather than dropped
+    assert [sorted(group.record_ids) for group in result.groups] == [["a", "b", "c"]]
+    assert result.groups[0].merged
+    assert llm["merge"] == 1
@@ -0,0 +1,36 @@
+import json
+
+from dedupe_it import merger
+from dedupe_it.config import Config
+from dedupe_it.merger import Merger
+
+
+async def test_bulk_merge_retries_invalid_answers_in_real_time(monkeypatch, tmp_path):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    groups = [
+        [{"name": "red fox"}, {"name": "red fox hound"}],
+        [{"name": "blue whale"}, {"name": "blue whale shark"}],
+        [{"name": "green tree"}, {"name": "green tree house"}],
+    ]
+
+    async def run(self, requests):
+        return [json.dumps({"name": "red fox"}), "not json", None]
+
+    retried = []
+
+    async def merge_records(self, records):
+        retried.append(records[0]["name"])
+        return {"name": records[0]["name"]}
+
+    monkeypatch.setattr(merger.MessageBatchRunner, "run", run)
+    monkeypatch.setattr(Merger, "merge_records", merge_records)
+    merged = await Merger(Config(batch_state_dir=str(tmp_path))).merge_records_bulk(
+        groups
+    )
+
+    assert merged == [
+        {"name": "red fox"},
+        {"name": "blue whale"},
+        {"name": "green tree"},
+    ]
+    assert retried == ["blue whale", "green tree"]
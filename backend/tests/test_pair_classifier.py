@@ -0,0 +1,169 @@
+import json
+
+import numpy as np
+import pytest
+
+from dedupe_it.config import Config
+from dedupe_it.pair_classifier import (
+    HOLD_OUT_EVERY,
+    MIN_AUDITS,
+    MIN_HELD_OUT_ANSWERS,
+    PairClassifier,
+    pair_features,
+)
+
+COLUMNS = ["name", "email"]
+
+
+@pytest.fixture
+def config(tmp_path):
+    return Config(pair_classifier_dir=str(tmp_path), classifier_retrain_examples=10)
+
+
+def separable_verdicts(count: int, with_similarity: bool = True):
+    """Features where matches have equal emails and non-matches do not."""
+    rng = np.random.default_rng(0)
+    rows, verdicts = [], []
+    for i in range(count):
+        match = i % 2 == 0
+        email = "a@x.com" if match else f"{i}@y.com"
+        similarity = rng.uniform(0.8, 1.0) if match else rng.uniform(0.0, 0.4)
+        rows.append(
+            pair_features(
+                {"name": f"Ann {i}", "email": "a@x.com"},
+                {"name": f"Ann {i}", "email": email},
+                COLUMNS,
+                similarity if with_similarity else None,
+            )
+        )
+        verdicts.append(match)
+    return np.array(rows, dtype=np.float32), verdicts
+
+
+def test_features_have_a_similarity_only_when_the_pair_has_one():
+    data = {"name": "Ann", "email": "a@x.com"}
+    assert len(pair_features(data, data, COLUMNS, 0.9)) == 1 + 3 * len(COLUMNS)
+    assert len(pair_features(data, data, COLUMNS, None)) == 3 * len(COLUMNS)
+    assert pair_features(data, {"name": "Ann"}, COLUMNS, None) == [
+        1.0,
+        1.0,
+        1.0,
+        0.0,
+        0.0,
+        0.0,
+    ]
+
+
+def test_pairs_with_and_without_similarity_are_logged_apart(config):
+    with_similarity = PairClassifier(config, COLUMNS, with_similarity=True)
+    without_similarity = PairClassifier(config, COLUMNS, with_similarity=False)
+    assert with_similarity.path != without_similarity.path
+    assert with_similarity.width == without_similarity.width + 1
+
+
+def test_training_on_separable_verdicts_activates_the_classifier(config):
+    classifier = PairClassifier(config, COLUMNS)
+    features, verdicts = separable_verdicts(MIN_HELD_OUT_ANSWERS * HOLD_OUT_EVERY)
+    classifier.log(features, verdicts)
+    assert classifier.needs_training()
+    classifier.train()
+
+    assert classifier.active
+    assert classifier.model.held_out_answers >= MIN_HELD_OUT_ANSWERS
+    assert classifier.model.held_out_agreement == 1.0
+    probabilities, confident = classifier.decide(features)
+    assert confident.all()
+    assert ((probabilities >= 0.5) == np.array(verdicts)).all()
+    # A new job picks up the stored model
+    assert PairClassifier(config, COLUMNS).active
+
+
+def test_classifier_is_not_trusted_with_too_few_held_out_answers(config):
+    classifier = PairClassifier(config, COLUMNS)
+    features, verdicts = separable_verdicts(100)
+    classifier.log(features, verdicts)
+    classifier.train()
+
+    assert classifier.model.held_out_answers < MIN_HELD_OUT_ANSWERS
+    assert not classifier.active
+    _, confident = classifier.decide(features)
+    assert not confident.any()
+
+
+def test_classifier_is_not_trusted_below_min_agreement(config):
+    classifier = PairClassifier(config, COLUMNS)
+    features, verdicts = separable_verdicts(MIN_HELD_OUT_ANSWERS * HOLD_OUT_EVERY)
+    # Flip a few held-out labels so the model disagrees with them
+    for i in range(0, 50, HOLD_OUT_EVERY):
+        verdicts[i] = not verdicts[i]
+    classifier.log(features, verdicts)
+    classifier.train()
+
+    assert classifier.model.held_out_agreement < config.classifier_min_agreement
+    assert not classifier.active
+
+
+def test_classifier_needs_both_kinds_of_verdicts(config):
+    classifier = PairClassifier(config, COLUMNS)
+    features, _ = separable_verdicts(50)
+    classifier.log(features, [True] * len(features))
+    classifier.train()
+    assert classifier.model is None
+
+
+def test_training_skips_malformed_lines(config):
+    classifier = PairClassifier(config, COLUMNS)
+    features, verdicts = separable_verdicts(MIN_HELD_OUT_ANSWERS * HOLD_OUT_EVERY)
+    classifier.log(features[:10], verdicts[:10])
+    with open(classifier.verdicts_path, "a") as f:
+        f.write("{not json\n")
+        f.write(json.dumps([1.0, 2.0]) + "\n")
+        f.write(json.dumps(["a"] * (classifier.width + 1)) + "\n")
+    classifier.log(features[10:], verdicts[10:])
+    with open(classifier.verdicts_path, "a") as f:
+        f.write("[0.5, 1.0")
+    classifier.train()
+
+    assert classifier.active
+
+
+def test_audit_disagreement_switches_the_classifier_off(config):
+    classifier = PairClassifier(config, COLUMNS)
+    features, verdicts = separable_verdicts(MIN_HELD_OUT_ANSWERS * HOLD_OUT_EVERY)
+    classifier.log(features, verdicts)
+    classifier.train()
+    assert classifier.active
+
+    allowed = (1 - config.classifier_min_agreement) * MIN_AUDITS
+    for _ in range(int(allowed) + 1):
+        classifier.audit(True, False)
+    assert classifier.disabled
+    assert not classifier.active
+    _, confident = classifier.decide(features)
+    assert not confident.any()
+
+
+def test_agreeing_audits_keep_the_classifier_on(config):
+    classifier = PairClassifier(config, COLUMNS)
+    features, verdicts = separable_verdicts(MIN_HELD_OUT_ANSWERS * HOLD_OUT_EVERY)
+    classifier.log(features, verdicts)
+    classifier.train()
+
+    for _ in range(MIN_AUDITS * 4):
+        classifier.audit(True, True)
+    classifier.audit(True, False)
+    assert classifier.active
+
+
+def test_model_of_another_layout_is_ignored(config):
+    classifier = PairClassifier(config, COLUMNS)
+    features, verdicts = separable_verdicts(MIN_HELD_OUT_ANSWERS * HOLD_OUT_EVERY)
+    classifier.log(features, verdicts)
+    classifier.train()
+    with open(classifier.model_path) as f:
+        model = json.load(f)
+    model["weights"] = model["weights"][1:]
+    with open(classifier.model_path, "w") as f:
+        json.dump(model, f)
+
+    assert PairClassifier(config, COLUMNS).model is None
@@ -0,0 +1,23 @@
+import pytest
+
+from dedupe_it.tables import ARROW_STREAM, PARQUET, response_media_type
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        (None, PARQUET),
+        ("*/*", PARQUET),
+        (ARROW_STREAM, ARROW_STREAM),
+        (f"{PARQUET};q=0.2, {ARROW_STREAM};q=0.8", ARROW_STREAM),
+        (f"{ARROW_STREAM};q=0.5, {PARQUET};q=0.5", PARQUET),
+        (f"application/*;q=0.5, {ARROW_STREAM}", ARROW_STREAM),
+        # An explicit q=0 wins over the wildcard
+        (f"*/*, {PARQUET};q=0", ARROW_STREAM),
+        ("text/html, */*;q=0.1", PARQUET),
+        ("application/json", None),
+        (f"{ARROW_STREAM};q=bad", None),
+    ],
+)
+def test_response_media_type_follows_accept(accept, expected):
+    assert response_media_type(accept, PARQUET) == expected
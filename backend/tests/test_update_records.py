@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+from dedupe_it import service
+from dedupe_it.checkpoint import Checkpoint
+from dedupe_it.config import Config
+from dedupe_it.models import Record
+from dedupe_it.service import dedupe_records, update_records
+from dedupe_it.vector_store import VectorStore
+
+JOB_ID = "job"
+
+
+@pytest.fixture
+def config(tmp_path):
+    return Config(
+        embedding_model_name="fake-embedding-model",
+        match_columns=["name"],
+        max_neighbors=5,
+        checkpoint_dir=str(tmp_path),
+    )
+
+
+def records(**names: str):
+    return [
+        Record(id=record_id, data={"name": name}) for record_id, name in names.items()
+    ]
+
+
+def groups(result):
+    return sorted(sorted(group.record_ids) for group in result.groups)
+
+
+@pytest.fixture
+async def job(llm, config):
+    result = await dedupe_records(
+        records(
+            a1="red fox",
+            a2="fox hound",
+            a3="hound dog",
+            b1="blue whale",
+            b2="whale shark",
+            c1="green tree",
+            d1="yellow sun",
+        ),
+        Config(**{**config.__dict__, "job_id": JOB_ID}),
+    )
+    assert groups(result) == [["a1", "a2", "a3"], ["b1", "b2"]]
+    llm["compare"].clear()
+    llm["merge"] = 0
+    return result
+
+
+async def test_upsert_joins_a_group_without_redoing_others(job, llm, config):
+    result = await update_records(
+        JOB_ID, records(c1="green whale", e1="purple sun"), [], config
+    )
+
+    assert groups(result) == [["a1", "a2", "a3"], ["b1", "b2", "c1"], ["d1", "e1"]]
+    # Only pairs with a changed record went to the LLM, and only changed
+    # groups were merged again
+    assert all("green whale" in pair or "purple sun" in pair for pair in llm["compare"])
+    assert llm["merge"] == 2
+
+
+async def test_delete_splits_a_group_where_its_link_is_gone(job, llm, config):
+    result = await update_records(JOB_ID, [], ["a2"], config)
+
+    assert groups(result) == [["b1", "b2"]]
+    assert llm["merge"] == 0
+
+
+async def test_updates_reuse_the_open_job(job, llm, config, monkeypatch):
+    await update_records(JOB_ID, records(c1="green whale"), [], config)
+    opened = service._jobs[JOB_ID]
+    created = []
+    create = VectorStore.create.__func__
+
+    async def counting_create(cls, *args, **kwargs):
+        created.append(args)
+        return await create(cls, *args, **kwargs)
+
+    monkeypatch.setattr(VectorStore, "create", classmethod(counting_create))
+    result = await update_records(JOB_ID, records(e1="yellow moon"), ["a3"], config)
+
+    assert service._jobs[JOB_ID] is opened
+    assert not created
+    assert groups(result) == [["a1", "a2"], ["b1", "b2", "c1"], ["d1", "e1"]]
+
+
+async def test_reopened_job_replays_its_changes(job, llm, config):
+    await update_records(JOB_ID, records(c1="green whale"), ["a3"], config)
+    service.close_jobs()
+    llm["compare"].clear()
+
+    result = await update_records(JOB_ID, records(e1="yellow moon"), [], config)
+
+    assert groups(result) == [["a1", "a2"], ["b1", "b2", "c1"], ["d1", "e1"]]
+    assert all("yellow moon" in pair for pair in llm["compare"])
+    checkpoint = Checkpoint(config.checkpoint_dir, JOB_ID)
+    assert [record.id for record in checkpoint.records] == [
+        "a1",
+        "a2",
+        "b1",
+        "b2",
+        "c1",
+        "d1",
+        "e1",
+    ]
+    # Opening the job folded the earlier changes into the stored embeddings, and
+    # the update added to them
+    assert checkpoint.embedding_ids == ["a1", "a2", "b1", "b2", "c1", "d1", "e1"]
+
+
+async def test_concurrent_updates_of_a_job_take_turns(job, llm, config):
+    results = await asyncio.gather(
+        update_records(JOB_ID, records(c1="green whale"), [], config),
+        update_records(JOB_ID, records(e1="yellow moon"), [], config),
+        update_records(JOB_ID, [], ["a2"], config),
+    )
+
+    assert groups(results[-1]) == [["b1", "b2", "c1"], ["d1", "e1"]]
+    checkpoint = Checkpoint(config.checkpoint_dir, JOB_ID)
+    assert len(checkpoint.records) == 7
+
+
+async def test_invalid_changes_leave_the_job_untouched(job, llm, config):
+    with pytest.raises(ValueError, match="Unknown record ids"):
+        await update_records(JOB_ID, [], ["zz"], config)
+    with pytest.raises(ValueError, match="both upserted and deleted"):
+        await update_records(JOB_ID, records(a1="red fox"), ["a1"], config)
+
+    result = await update_records(JOB_ID, [], [], config)
+    assert groups(result) == [["a1", "a2", "a3"], ["b1", "b2"]]
+    assert not llm["compare"]